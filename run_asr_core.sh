@@ -1,9 +1,10 @@
 #!/bin/bash
 # Run IQ-TREE ASR on the pruned ingroup tree
 # Output will be generated in results/04_phylogeny_asr/ASR_core.*
+# Same command as step asr_S1 of `python scripts/run_pipeline.py`
 
-cd /home/tynan/0218
-source /home/tynan/miniforge3/etc/profile.d/conda.sh
+cd "$(dirname "$0")"
+source "$(conda info --base)/etc/profile.d/conda.sh"
 conda activate dah7ps_v4
 
 iqtree -s results/03_msa_core/core_asr.afa \
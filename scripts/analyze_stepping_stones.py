@@ -8,20 +8,20 @@ Outputs:
 """
 
 import argparse
+import os
 import subprocess
 import sys
 from collections import Counter, defaultdict
 from pathlib import Path
 
+# Add scripts directory to path for fasta_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fasta_utils import fasta_ids
+
 
 def load_ids_from_fasta(fasta_path):
     """Extract sequence IDs from FASTA file."""
-    ids = set()
-    with open(fasta_path) as f:
-        for line in f:
-            if line.startswith('>'):
-                ids.add(line[1:].strip().split()[0])
-    return ids
+    return set(fasta_ids(fasta_path))
 
 
 def get_subtype(seqid, subtype_map):
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+ASR Utilities — Dense NumPy loading of IQ-TREE ancestral-state (.state) files.
+
+Used by:
+  - Phase 4.5: cross_scenario_asr_sensitivity.py (S1/S2/S4a/S4b comparison)
+
+Key concepts:
+  - A .state file is one row per (node, site) with the MAP state and 20
+    amino-acid posteriors. It is loaded once into a StateTensor: a dense
+    float32 [node, site, 20] posterior array plus a uint8 [node, site]
+    MAP-state array, instead of one Python dict and 20 floats per row.
+  - MAP states are stored as their ASCII code, so codes are comparable
+    across scenarios without a shared vocabulary; code 0 marks a
+    (node, site) pair absent from the file.
+  - Per-site Shannon entropy and top posterior are computed from the
+    float64 text values while parsing and kept as float64, so entropy,
+    information and top-PP columns do not pick up float32 rounding. MAP
+    agreement and pairwise L1 are array operations over the float32
+    tensor; L1 is summed in float64 but starts from float32-rounded
+    posteriors, so it can differ from a float64 text parse by ~1e-7.
+  - The text is parsed in fixed-size line chunks (C-level float parsing via
+    np.loadtxt), so transient memory beyond the final tensor stays bounded.
+  - For bounded-memory runs, StateBlockReader scans a file once for the
+    byte span of every node block (files are sorted by Node, then Site) and
+    then parses one node at a time on demand, so peak memory is one node
+    block per scenario rather than the whole tensor.
+  - A StateTensor can be written as plain .npy arrays and reopened with
+    np.load(mmap_mode="r"), so worker processes share the posterior pages
+    through the OS page cache instead of receiving pickled copies.
+  - load_state_cached() keeps those arrays as a binary companion of the
+    .state file (<state>.npycache/<md5>.v<version>.<dtype>.*.npy), keyed
+    by the source md5 like the domtblout .cols.npz cache. The md5 itself is
+    remembered in <state>.npycache/source.md5cache.tsv by (size, mtime,
+    inode), so re-runs stat the file and memory-map the arrays instead of
+    re-reading the text; float16 posteriors halve the cache at ~3
+    significant digits.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+
+import numpy as np
+
+from hmmer_utils import cached_source_md5, prune_npy_cache, save_npy_atomic
+
+AA_ORDER = "ARNDCQEGHILKMFPSTWYV"
+AA_COLUMNS = [f"p_{aa}" for aa in AA_ORDER]
+INFO_MAX_BITS = math.log2(len(AA_ORDER))
+STATE_ARRAYS = ("sites", "probs", "map_state", "entropy", "max_pp", "nodes")
+STATE_CACHE_VERSION = 2
+STATE_CACHE_DTYPES = ("float32", "float16")
+
+
+class StateTensor:
+    """Posteriors of one .state file on a dense node x site grid.
+
+    Attributes:
+        nodes: node IDs in file order.
+        node_index: node ID -> row.
+        sites: int32 sorted site numbers (column axis).
+        probs: float32 [node, site, 20] posteriors in AA_ORDER.
+        map_state: uint8 [node, site] ASCII code of the MAP state (0 = absent).
+        entropy: float64 [node, site] Shannon entropy in bits.
+        max_pp: float64 [node, site] highest posterior (from the text values).
+        cache_prefix: .npy prefix the arrays are mapped from, if any.
+    """
+
+    def __init__(self, nodes, sites, probs, map_state, entropy, max_pp, cache_prefix=None):
+        self.nodes = list(nodes)
+        self.cache_prefix = cache_prefix
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.sites = np.asarray(sites, dtype=np.int32)
+        self.probs = probs
+        self.map_state = map_state
+        self.entropy = entropy
+        self.max_pp = max_pp
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    @property
+    def n_sites(self):
+        return len(self.sites)
+
+    @property
+    def present(self):
+        """bool [node, site]: True where the file has a row."""
+        return self.map_state != 0
+
+    def information(self, rows=slice(None)):
+        """Information content log2(20) - H in bits for the given node rows."""
+        return INFO_MAX_BITS - self.entropy[rows]
+
+    def top_pp(self, rows=slice(None)):
+        """Highest posterior per (node, site) for the given node rows."""
+        return self.max_pp[rows]
+
+    def site_positions(self, site_axis):
+        """Column of each of this tensor's sites within a sorted global site axis."""
+        return np.searchsorted(site_axis, self.sites)
+
+
+def entropy_bits(probs):
+    """Row-wise Shannon entropy (bits) of a [..., 20] float64 array; 0 log 0 = 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(probs > 0, probs * np.log2(probs), 0.0)
+    return -terms.sum(axis=-1)
+
+
+def _state_columns(header, path):
+    """Column indexes of Node, Site, State and p_* in a .state header line."""
+    fields = header.rstrip("\n").split("\t")
+    expected = {"Node", "Site", "State", *AA_COLUMNS}
+    if not expected.issubset(fields):
+        raise ValueError(f"unexpected .state header in {path}")
+    return (
+        fields.index("Node"),
+        fields.index("Site"),
+        fields.index("State"),
+        [fields.index(column) for column in AA_COLUMNS],
+    )
+
+
+def _parse_state_chunk(lines, columns, node_index, nodes):
+    """Parse .state data lines into (node rows, sites, state codes, probs, entropy, max_pp)."""
+    node_col, site_col, state_col, prob_cols = columns
+    lead = max(node_col, site_col, state_col) + 1
+    rows = [line.split("\t", lead) for line in lines]
+    node_rows = np.empty(len(rows), dtype=np.int32)
+    for i, row in enumerate(rows):
+        node = row[node_col]
+        idx = node_index.get(node)
+        if idx is None:
+            idx = node_index[node] = len(nodes)
+            nodes.append(node)
+        node_rows[i] = idx
+    sites = np.array([row[site_col] for row in rows], dtype=np.int64)
+    states = "".join(row[state_col] for row in rows)
+    if len(states) != len(rows):
+        raise ValueError("State column must hold single-character states")
+    codes = np.frombuffer(states.encode("ascii"), dtype=np.uint8)
+    probs = np.loadtxt(lines, delimiter="\t", usecols=prob_cols,
+                       dtype=np.float64, ndmin=2)
+    return (node_rows, sites, codes, probs.astype(np.float32), entropy_bits(probs),
+            probs.max(axis=-1))
+
+
+def _tensor_from_parts(nodes, parts):
+    """Scatter parsed chunks onto a dense StateTensor."""
+    if not parts:
+        return StateTensor(nodes, [], np.zeros((len(nodes), 0, len(AA_ORDER)), np.float32),
+                           np.zeros((len(nodes), 0), np.uint8), np.zeros((len(nodes), 0)),
+                           np.zeros((len(nodes), 0)))
+
+    node_rows = np.concatenate([p[0] for p in parts])
+    site_values = np.concatenate([p[1] for p in parts])
+    sites = np.unique(site_values)
+    site_cols = np.searchsorted(sites, site_values)
+
+    shape = (len(nodes), len(sites))
+    probs = np.zeros(shape + (len(AA_ORDER),), dtype=np.float32)
+    map_state = np.zeros(shape, dtype=np.uint8)
+    entropy = np.zeros(shape, dtype=np.float64)
+    max_pp = np.zeros(shape, dtype=np.float64)
+    start = 0
+    for rows, _, codes, chunk_probs, chunk_entropy, chunk_max_pp in parts:
+        stop = start + len(rows)
+        cols = site_cols[start:stop]
+        probs[rows, cols] = chunk_probs
+        map_state[rows, cols] = codes
+        entropy[rows, cols] = chunk_entropy
+        max_pp[rows, cols] = chunk_max_pp
+        start = stop
+    return StateTensor(nodes, sites, probs, map_state, entropy, max_pp)
+
+
+def iter_state_lines(handle):
+    """Yield (header, data line iterator) for an open .state file, skipping # comments."""
+    lines = (line for line in handle if not line.startswith("#") and line.strip())
+    header = next(lines, None)
+    return header, lines
+
+
+def read_state_tensor(path, chunk_lines=200_000):
+    """Load an IQ-TREE .state file into a StateTensor.
+
+    Args:
+        path: Path to the .state file.
+        chunk_lines: Data lines parsed per NumPy batch.
+
+    Returns:
+        StateTensor with nodes in file order and sites sorted ascending.
+        Duplicate (node, site) rows keep the last occurrence.
+    """
+    nodes = []
+    node_index = {}
+    parts = []
+    with open(path) as handle:
+        header, lines = iter_state_lines(handle)
+        if header is None:
+            raise ValueError(f"unexpected .state header in {path}")
+        columns = _state_columns(header, path)
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                parts.append(_parse_state_chunk(chunk, columns, node_index, nodes))
+                chunk = []
+        if chunk:
+            parts.append(_parse_state_chunk(chunk, columns, node_index, nodes))
+
+    return _tensor_from_parts(nodes, parts)
+
+
+class StateBlockReader:
+    """Random access to the node blocks of a .state file without loading it.
+
+    The constructor makes one pass over the file recording, per node, the
+    byte spans of its rows; read(node) then parses just those rows.
+
+    Attributes:
+        path: Path to the .state file.
+        nodes: node IDs in file order.
+        spans: node ID -> list of (offset, length) byte spans.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.nodes = []
+        self.spans = {}
+        self.columns = None
+        with open(path, "rb") as handle:
+            offset = 0
+            node_col = 0
+            current = None
+            span_start = 0
+            for raw in handle:
+                line_start = offset
+                offset += len(raw)
+                if raw.startswith(b"#") or not raw.strip():
+                    if current is not None:
+                        self._add_span(current, span_start, line_start)
+                        current = None
+                    continue
+                if self.columns is None:
+                    self.columns = _state_columns(raw.decode(), path)
+                    node_col = self.columns[0]
+                    continue
+                node = raw.split(b"\t", node_col + 1)[node_col].decode()
+                if node != current:
+                    if current is not None:
+                        self._add_span(current, span_start, line_start)
+                    current = node
+                    span_start = line_start
+            if current is not None:
+                self._add_span(current, span_start, offset)
+        if self.columns is None:
+            raise ValueError(f"unexpected .state header in {path}")
+
+    def _add_span(self, node, start, stop):
+        if node not in self.spans:
+            self.spans[node] = []
+            self.nodes.append(node)
+        self.spans[node].append((start, stop - start))
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    def read(self, node):
+        """StateTensor holding only `node` (one row), or None if absent."""
+        spans = self.spans.get(node)
+        if spans is None:
+            return None
+        with open(self.path, "rb") as handle:
+            chunks = []
+            for offset, length in spans:
+                handle.seek(offset)
+                chunks.append(handle.read(length))
+        lines = [
+            line for line in b"".join(chunks).decode().splitlines(keepends=True)
+            if line.strip() and not line.startswith("#")
+        ]
+        nodes = []
+        parts = [_parse_state_chunk(lines, self.columns, {}, nodes)]
+        return _tensor_from_parts(nodes, parts)
+
+
+def save_state_npy(tensor, prefix, dtype=None):
+    """Write a StateTensor as <prefix>.<array>.npy files.
+
+    Each file is written under a per-writer temporary name and renamed; the
+    node list goes last, so its presence marks a complete set.
+    """
+    probs = tensor.probs if dtype is None else tensor.probs.astype(dtype)
+    arrays = {
+        "sites": tensor.sites,
+        "probs": probs,
+        "map_state": tensor.map_state,
+        "entropy": tensor.entropy,
+        "max_pp": tensor.max_pp,
+        "nodes": np.array(tensor.nodes, dtype=str),
+    }
+    for name in STATE_ARRAYS:
+        save_npy_atomic(f"{prefix}.{name}.npy", arrays[name])
+
+
+def load_state_npy(prefix, mmap=True):
+    """Reopen a StateTensor written by save_state_npy (memory-mapped by default)."""
+    mode = "r" if mmap else None
+    nodes = np.load(f"{prefix}.nodes.npy").tolist()
+    arrays = {name: np.load(f"{prefix}.{name}.npy", mmap_mode=mode)
+              for name in STATE_ARRAYS[:-1]}
+    return StateTensor(nodes, arrays["sites"], arrays["probs"], arrays["map_state"],
+                       arrays["entropy"], arrays["max_pp"], cache_prefix=prefix)
+
+
+def state_cache_dir(path, cache_dir=None):
+    base = os.path.basename(path) + ".npycache"
+    return os.path.join(cache_dir or os.path.dirname(path) or ".", base)
+
+
+def load_state_cached(path, cache=True, cache_dir=None, dtype="float32", mmap=True):
+    """Load a .state file via its md5-keyed memory-mapped binary cache.
+
+    Args:
+        path: IQ-TREE .state file.
+        cache: read/write the cache (default True). Entries built from an
+            earlier version of the file (an overwritten .state) are removed
+            when a new entry is written.
+        cache_dir: parent directory of <state>.npycache (default: next to `path`).
+        dtype: posterior storage, "float32" or "float16".
+        mmap: memory-map cached arrays (default True).
+
+    Returns:
+        StateTensor; cache_prefix is set when the arrays come from the cache.
+    """
+    if dtype not in STATE_CACHE_DTYPES:
+        raise ValueError(f"unsupported posterior dtype: {dtype}")
+    if not cache:
+        tensor = read_state_tensor(path)
+        if dtype != "float32":
+            tensor.probs = tensor.probs.astype(dtype)
+        return tensor
+
+    root = state_cache_dir(path, cache_dir)
+    source_md5 = cached_source_md5(path, root)
+    stem = f"{source_md5}.v{STATE_CACHE_VERSION}.{dtype}"
+    prefix = os.path.join(root, stem)
+    if os.path.isfile(f"{prefix}.nodes.npy"):
+        try:
+            return load_state_npy(prefix, mmap=mmap)
+        except (OSError, ValueError):
+            pass  # truncated or unreadable cache: rebuild below
+
+    tensor = read_state_tensor(path)
+    try:
+        os.makedirs(root, exist_ok=True)
+        save_state_npy(tensor, prefix, dtype=dtype)
+    except OSError:
+        # read-only results directory: still return the parsed tensor
+        if dtype != "float32":
+            tensor.probs = tensor.probs.astype(dtype)
+        return tensor
+    prune_npy_cache(root, path, source_md5, ".nodes.npy")
+    return load_state_npy(prefix, mmap=mmap)
@@ -27,22 +27,14 @@ import os
 import sys
 from collections import defaultdict
 
+# Add scripts directory to path for hmmer_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from hmmer_utils import best_full_score
+
 
 def parse_domtbl_scores(path):
     """Parse domtblout, return dict: seqid -> best full-sequence score (col 7, 0-indexed)."""
-    best = {}
-    with open(path) as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            cols = line.split()
-            if len(cols) < 22:
-                continue
-            seqid = cols[0]
-            score = float(cols[7])  # full-sequence bit score
-            if seqid not in best or score > best[seqid]:
-                best[seqid] = score
-    return best
+    return best_full_score(path)
 
 
 def load_ids(path):
@@ -10,6 +10,10 @@ The script computes:
   - input_md5
   - git_commit
 
+Each distinct file is hashed once per run, on a thread pool. md5s are kept
+in <output>.md5cache.tsv keyed by (path, size, mtime, inode), so
+unchanged files are not re-read when the manifest is regenerated.
+
 Usage:
   python scripts/build_artifact_manifest.py \
     --spec results/04_phylogeny_asr/artifact_manifest.spec.tsv \
@@ -24,6 +28,8 @@ import hashlib
 import os
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
@@ -39,6 +45,24 @@ REQUIRED_COLUMNS = [
     "formal_status",
 ]
 
+MANIFEST_COLUMNS = [
+    "artifact_id",
+    "scenario_id",
+    "artifact_role",
+    "file_path",
+    "output_md5",
+    "source_script",
+    "git_commit",
+    "command",
+    "input_paths",
+    "input_md5",
+    "generated_at",
+    "formal_status",
+    "notes",
+]
+
+MD5_CACHE_SUFFIX = ".md5cache.tsv"
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -46,6 +70,21 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument("--spec", required=True, help="Input spec TSV")
     parser.add_argument("--output", required=True, help="Output manifest TSV")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(8, os.cpu_count() or 1),
+        help="Hashing threads (default: min(8, cores))",
+    )
+    parser.add_argument(
+        "--hash_cache",
+        help=f"md5 cache TSV (default: <output>{MD5_CACHE_SUFFIX})",
+    )
+    parser.add_argument(
+        "--no_hash_cache",
+        action="store_true",
+        help="Re-hash every file and do not read or write the md5 cache",
+    )
     return parser.parse_args()
 
 
@@ -62,6 +101,74 @@ def md5_of_file(path: Path) -> str:
     return digest.hexdigest()
 
 
+class Md5Cache:
+    """File md5s keyed by (path, size, mtime_ns, inode), persisted as a TSV.
+
+    A cached digest is reused only while the file's stat is unchanged. The
+    stat is taken before hashing, so a file modified mid-read is re-hashed
+    on the next run. path=None keeps the cache in memory only.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path
+        self.entries: dict[str, tuple[int, int, int, str]] = {}
+        self.n_hashed = 0
+        self.lock = threading.Lock()
+        if path is not None and path.is_file():
+            with path.open() as handle:
+                for line in handle:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) != 5 or fields[0] == "path":
+                        continue
+                    try:
+                        size, mtime_ns, inode = (int(v) for v in fields[1:4])
+                    except ValueError:
+                        continue
+                    self.entries[fields[0]] = (size, mtime_ns, inode, fields[4])
+
+    def md5(self, path: Path | str) -> str:
+        key = os.path.abspath(path)
+        st = os.stat(key)
+        stat_key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        cached = self.entries.get(key)
+        if cached is not None and cached[:3] == stat_key:
+            return cached[3]
+        digest = md5_of_file(Path(key))
+        with self.lock:
+            self.entries[key] = (*stat_key, digest)
+            self.n_hashed += 1
+        return digest
+
+    def md5_many(self, paths, workers: int = 1) -> dict[str, str]:
+        """md5 per distinct path (hashing each file at most once, on `workers` threads)."""
+        keys = {str(path): os.path.abspath(path) for path in paths}
+        unique = list(dict.fromkeys(keys.values()))
+        if workers <= 1 or len(unique) < 2:
+            digests = {key: self.md5(key) for key in unique}
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                digests = dict(zip(unique, pool.map(self.md5, unique)))
+        return {path: digests[key] for path, key in keys.items()}
+
+    def save(self) -> None:
+        """Write entries for files that still exist; a read-only location is not an error."""
+        if self.path is None:
+            return
+        tmp = self.path.with_name(self.path.name + f".tmp{os.getpid()}")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open("w") as handle:
+                handle.write("path\tsize\tmtime_ns\tinode\tmd5\n")
+                for key in sorted(self.entries):
+                    if os.path.isfile(key):
+                        size, mtime_ns, inode, digest = self.entries[key]
+                        handle.write(f"{key}\t{size}\t{mtime_ns}\t{inode}\t{digest}\n")
+            os.replace(tmp, self.path)
+        except OSError as exc:
+            print(f"[build_artifact_manifest] WARNING: could not write md5 cache "
+                  f"{self.path}: {exc}", file=sys.stderr)
+
+
 def git_commit() -> str:
     try:
         result = subprocess.run(
@@ -91,6 +198,10 @@ def main() -> None:
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
     commit = git_commit()
+    if args.no_hash_cache:
+        hasher = Md5Cache()
+    else:
+        hasher = Md5Cache(Path(args.hash_cache or f"{output_path}{MD5_CACHE_SUFFIX}"))
 
     rows: list[dict[str, str]] = []
     with spec_path.open() as handle:
@@ -114,34 +225,28 @@ def main() -> None:
                     f"{row['artifact_id']}: {', '.join(missing_inputs)}"
                 )
 
-            row["output_md5"] = md5_of_file(file_path)
-            row["input_md5"] = ",".join(md5_of_file(Path(path)) for path in input_paths)
             row["git_commit"] = commit
             rows.append(row)
 
-    fieldnames = [
-        "artifact_id",
-        "scenario_id",
-        "artifact_role",
-        "file_path",
-        "output_md5",
-        "source_script",
-        "git_commit",
-        "command",
-        "input_paths",
-        "input_md5",
-        "generated_at",
-        "formal_status",
-        "notes",
-    ]
+    paths = []
+    for row in rows:
+        paths.append(row["file_path"])
+        paths.extend(normalize_paths(row["input_paths"]))
+    digests = hasher.md5_many(paths, args.workers)
+    for row in rows:
+        row["output_md5"] = digests[row["file_path"]]
+        row["input_md5"] = ",".join(digests[path] for path in normalize_paths(row["input_paths"]))
+    if not args.no_hash_cache:
+        hasher.save()
 
     with output_path.open("w", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames, delimiter="\t")
+        writer = csv.DictWriter(handle, fieldnames=MANIFEST_COLUMNS, delimiter="\t")
         writer.writeheader()
         for row in rows:
-            writer.writerow({field: row.get(field, "") for field in fieldnames})
+            writer.writerow({field: row.get(field, "") for field in MANIFEST_COLUMNS})
 
-    print(f"[build_artifact_manifest] Wrote {len(rows)} rows to {output_path}")
+    print(f"[build_artifact_manifest] Wrote {len(rows)} rows to {output_path} "
+          f"({len({os.path.abspath(path) for path in digests})} distinct files, {hasher.n_hashed} hashed)")
 
 
 if __name__ == "__main__":
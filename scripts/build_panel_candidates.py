@@ -5,6 +5,8 @@ Steps:
   1. Build skeleton from local data (rep_id, subtype, cluster_id, cluster_size, seq_len)
   2. Query PDB availability via PDBe SIFTS API (UniProt -> PDB mapping)
   3. Query AFDB availability via AlphaFold DB API
+     (steps 2-3 and AFDB downloads run concurrently under a shared rate
+     limit; see fetch_utils.py)
   4. Compute core-region pLDDT from AFDB confidence (B-factor in mmCIF)
   5. Output panel_candidates.tsv
 
@@ -14,15 +16,16 @@ Usage:
 
 import argparse
 import csv
-import json
 import os
 import sys
-import time
-import urllib.request
-import urllib.error
 from collections import defaultdict
 from pathlib import Path
 
+# Add scripts directory to path for hmmer_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fetch_utils import HttpBackend, LocalBackend, StructureFetcher
+from hmmer_utils import load_domtbl_table
+
 
 def load_ids_from_fasta(fasta_path):
     """Extract (id, seq_len) from FASTA."""
@@ -83,125 +86,56 @@ def is_uniprot_accession(acc):
     return not acc.startswith('UPI')
 
 
-def query_pdb_sifts(accession, cache_dir):
+def query_pdb_sifts(accession, fetcher):
     """Query PDBe SIFTS for UniProt -> PDB mapping. Returns list of PDB IDs."""
-    cache_file = cache_dir / f"{accession}_pdb.json"
-    if cache_file.exists():
-        with open(cache_file) as f:
-            data = json.load(f)
-        return data.get('pdb_ids', [])
-
-    url = f"https://www.ebi.ac.uk/pdbe/api/mappings/uniprot/{accession}"
-    try:
-        req = urllib.request.Request(url, headers={'Accept': 'application/json'})
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode())
-        # Extract PDB IDs
-        pdb_ids = []
-        for uniprot_acc, mapping in data.items():
-            for pdb_entry in mapping.get('PDB', {}):
-                pdb_ids.append(pdb_entry.upper())
-        result = {'pdb_ids': list(set(pdb_ids)), 'status': 'found'}
-    except urllib.error.HTTPError as e:
-        if e.code == 404:
-            result = {'pdb_ids': [], 'status': 'not_found'}
-        else:
-            result = {'pdb_ids': [], 'status': f'error_{e.code}'}
-    except Exception as e:
-        result = {'pdb_ids': [], 'status': f'error_{str(e)[:50]}'}
-
-    with open(cache_file, 'w') as f:
-        json.dump(result, f)
-    return result.get('pdb_ids', [])
+    return fetcher.pdb_mapping(accession).get('pdb_ids', [])
 
 
-def query_afdb(accession, cache_dir):
+def query_afdb(accession, fetcher):
     """Query AlphaFold DB for structure availability. Returns entry info or None."""
-    cache_file = cache_dir / f"{accession}_afdb.json"
-    if cache_file.exists():
-        with open(cache_file) as f:
-            data = json.load(f)
-        return data if data.get('status') != 'not_found' else None
-
-    url = f"https://alphafold.ebi.ac.uk/api/prediction/{accession}"
-    try:
-        req = urllib.request.Request(url, headers={'Accept': 'application/json'})
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode())
-        # data is a list of entries; take the first (latest version)
-        if isinstance(data, list) and data:
-            entry = data[0]
-            result = {
-                'status': 'found',
-                'entryId': entry.get('entryId', ''),
-                'cifUrl': entry.get('cifUrl', ''),
-                'pdbUrl': entry.get('pdbUrl', ''),
-                'paeImageUrl': entry.get('paeImageUrl', ''),
-                'uniprotAccession': entry.get('uniprotAccession', accession),
-                'uniprotId': entry.get('uniprotId', ''),
-                'gene': entry.get('gene', ''),
-                'organism': entry.get('organismScientificName', ''),
-                'globalPlddt': entry.get('globalMetricValue', 0),
-            }
-        else:
-            result = {'status': 'not_found'}
-    except urllib.error.HTTPError as e:
-        if e.code == 404 or e.code == 422:
-            result = {'status': 'not_found'}
-        else:
-            result = {'status': f'error_{e.code}'}
-    except Exception as e:
-        result = {'status': f'error_{str(e)[:50]}'}
-
-    with open(cache_file, 'w') as f:
-        json.dump(result, f)
+    result = fetcher.afdb_entry(accession)
     return result if result.get('status') == 'found' else None
 
 
-def get_hmm_core_coords(rep_id, domtbl_files, hmm_lengths):
-    """Get HMM core region coordinates (sequence coords) from domtblout.
-    Returns (env_from, env_to) for the best domain hit, or merged for Type II.
+def build_core_coord_index(domtbl_path):
+    """Index one domtblout in a single pass: seqid -> (best domain score, (ali_from, ali_to)).
+
+    The best domain is the highest domain score (col 13); ties keep the
+    first hit, and scores <= -1 are ignored, as in the original per-rep scan.
+    """
+    if not os.path.exists(domtbl_path):
+        return {}
+    table = load_domtbl_table(domtbl_path)
+    codes, rows = table.best_rows('dom_score', mask=table['dom_score'] > -1)
+    scores = table['dom_score'][rows].tolist()
+    ali_from = table['ali_from'][rows].tolist()
+    ali_to = table['ali_to'][rows].tolist()
+    return {table.targets[c]: (score, (a, b))
+            for c, score, a, b in zip(codes.tolist(), scores, ali_from, ali_to)}
+
+
+def get_hmm_core_coords(rep_id, coord_indexes):
+    """Get HMM core region coordinates (sequence coords) from domtblout indexes.
+    Returns (ali_from, ali_to) for the best domain hit across the given indexes.
     """
-    acc_raw = rep_id
     best_coords = None
     best_score = -1
-
-    for st, domtbl_path, hmm_len in domtbl_files:
-        if not os.path.exists(domtbl_path):
-            continue
-        with open(domtbl_path) as f:
-            for line in f:
-                if line.startswith('#'):
-                    continue
-                parts = line.split()
-                if len(parts) < 22:
-                    continue
-                target_name = parts[0]
-                if target_name != acc_raw:
-                    continue
-                score = float(parts[13])  # domain score
-                ali_from = int(parts[17])  # ali coord start (1-based)
-                ali_to = int(parts[18])    # ali coord end
-                if score > best_score:
-                    best_score = score
-                    best_coords = (ali_from, ali_to)
-
+    for index in coord_indexes:
+        hit = index.get(rep_id)
+        if hit and hit[0] > best_score:
+            best_score, best_coords = hit
     return best_coords
 
 
-def download_afdb_pdb(accession, afdb_entry, struct_cache_dir):
+def download_afdb_pdb(accession, afdb_entry, struct_cache_dir, fetcher):
     """Download AFDB PDB file for pLDDT extraction. Returns local path or None."""
     pdb_url = afdb_entry.get('pdbUrl', '')
     if not pdb_url:
         return None
 
     local_path = struct_cache_dir / f"AF-{accession}-F1-model_v4.pdb"
-    if local_path.exists():
-        return local_path
-
     try:
-        urllib.request.urlretrieve(pdb_url, str(local_path))
-        return local_path
+        return fetcher.download(pdb_url, local_path)
     except Exception as e:
         print(f"  WARNING: Failed to download AFDB PDB for {accession}: {e}", file=sys.stderr)
         return None
@@ -248,7 +182,16 @@ def main():
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('--workdir', default='/home/tynan/0218')
     parser.add_argument('--rate_limit', type=float, default=0.2,
-                        help='Seconds between API calls (default: 0.2)')
+                        help='Minimum seconds between API calls across all workers (default: 0.2)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Concurrent fetch threads (default: 8)')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries for 429/5xx/connection errors (default: 3)')
+    parser.add_argument('--backend_dir', default=None,
+                        help='Serve API responses from a local directory '
+                             '(<dir>/<host>/<path>) instead of the network')
+    parser.add_argument('--api_base', default=None,
+                        help='Replace https://<host> in API URLs, e.g. a local HTTP stand-in')
     parser.add_argument('--skip_download', action='store_true',
                         help='Skip AFDB PDB downloads (use cached or leave pLDDT=0)')
     args = parser.parse_args()
@@ -263,6 +206,13 @@ def main():
     struct_cache_dir = outdir / 'structure_availability' / 'afdb_pdb'
     struct_cache_dir.mkdir(parents=True, exist_ok=True)
 
+    backend = LocalBackend(args.backend_dir) if args.backend_dir else HttpBackend()
+    fetcher = StructureFetcher(
+        backend, cache_dir,
+        rate=1.0 / args.rate_limit if args.rate_limit > 0 else 0,
+        workers=args.workers, retries=args.retries, api_base=args.api_base,
+    )
+
     # === Step A: Build skeleton table ===
     print("=== Step A: Building skeleton table ===")
 
@@ -305,6 +255,33 @@ def main():
     ]
     hmm_lengths = {'Ia': 355, 'Ib': 334, 'II': 471}
 
+    # One pass per domtbl file, shared by every representative
+    coord_indexes = defaultdict(list)
+    for st, domtbl_path, _ in domtbl_files:
+        coord_indexes[st].append(build_core_coord_index(domtbl_path))
+    print("  Indexed core coords: " + ", ".join(
+        f"{st}={sum(len(idx) for idx in coord_indexes[st])}" for st in ['Ia', 'Ib', 'II']))
+
+    # Fill the raw JSON store concurrently; the loop below then reads it
+    accessions = sorted({extract_accession(r['rep_id']) for r in rows
+                         if is_uniprot_accession(extract_accession(r['rep_id']))})
+    fetcher.prefetch(accessions)
+
+    pdb_paths = {}
+    if not args.skip_download:
+        downloads = []
+        for row in rows:
+            acc = extract_accession(row['rep_id'])
+            if not is_uniprot_accession(acc):
+                continue
+            afdb_entry = query_afdb(acc, fetcher)
+            if afdb_entry and get_hmm_core_coords(row['rep_id'],
+                                                  coord_indexes.get(row['subtype'], [])):
+                downloads.append((acc, afdb_entry))
+        pdb_paths = fetcher.map(
+            lambda job: download_afdb_pdb(job[0], job[1], struct_cache_dir, fetcher),
+            dict(downloads).items(), key=lambda job: job[0], label="afdb_pdb")
+
     total = len(rows)
     for i, row in enumerate(rows):
         acc = extract_accession(row['rep_id'])
@@ -314,16 +291,14 @@ def main():
         if (i + 1) % 20 == 0 or i == 0:
             print(f"  [{i+1}/{total}] Processing {acc} ({row['subtype']})...")
 
-        # PDB query
-        pdb_ids = query_pdb_sifts(acc, cache_dir) if is_uniprot else []
+        # PDB query (served from the content store)
+        pdb_ids = query_pdb_sifts(acc, fetcher) if is_uniprot else []
         row['has_pdb'] = 1 if pdb_ids else 0
         row['pdb_ids'] = ','.join(pdb_ids[:5]) if pdb_ids else ''
-        if pdb_ids:
-            time.sleep(args.rate_limit)
 
         # AFDB query
         if is_uniprot:
-            afdb_entry = query_afdb(acc, cache_dir)
+            afdb_entry = query_afdb(acc, fetcher)
         else:
             afdb_entry = None
 
@@ -331,13 +306,14 @@ def main():
         row['afdb_global_plddt'] = afdb_entry.get('globalPlddt', 0) if afdb_entry else 0
 
         # Core region coordinates (from domtblout)
-        st = row['subtype']
-        st_domtbls = [(s, d, h) for s, d, h in domtbl_files if s == st]
-        core_coords = get_hmm_core_coords(row['rep_id'], st_domtbls, hmm_lengths)
+        core_coords = get_hmm_core_coords(row['rep_id'], coord_indexes.get(row['subtype'], []))
 
         # Download AFDB PDB and compute core pLDDT
         if afdb_entry and not args.skip_download and core_coords:
-            pdb_path = download_afdb_pdb(acc, afdb_entry, struct_cache_dir)
+            if acc in pdb_paths:
+                pdb_path = pdb_paths[acc]  # prefetched (None if the download failed)
+            else:
+                pdb_path = download_afdb_pdb(acc, afdb_entry, struct_cache_dir, fetcher)
             core_from, core_to = core_coords
             core_plddt, core_cov = compute_core_plddt(pdb_path, core_from, core_to)
             row['afdb_plddt_core'] = round(core_plddt, 1)
@@ -361,9 +337,6 @@ def main():
         row['esmf_plddt_core'] = 0
         row['esmf_core_cov'] = 0
 
-        if afdb_entry:
-            time.sleep(args.rate_limit)
-
     # === Step C: Output panel_candidates.tsv ===
     print("\n=== Step C: Writing panel_candidates.tsv ===")
 
@@ -397,6 +370,7 @@ def main():
     total_afdb = sum(1 for r in rows if r['has_afdb'])
     total_esmf = sum(1 for r in rows if r['needs_esmf'])
     print(f"\n  Total: PDB={total_pdb}, AFDB={total_afdb}, needs_ESMFold={total_esmf}")
+    print(f"  API/download requests issued: {fetcher.n_requests}")
     print(f"\n  Done. Next: run select_structure_panel.py to validate.")
 
 
@@ -1,116 +1,29 @@
 #!/usr/bin/env python3
-"""compare_trees_lite.py — Lightweight tree comparison (no external deps).
+"""compare_trees_lite.py — Lightweight tree comparison.
 
-Parses newick trees with a minimal recursive descent parser,
+Parses newick trees with the shared array-backed parser (tree_utils.py),
 computes RF distance and monophyly checks.
 """
 import sys, os, re, datetime
 
-# ── Minimal Newick parser ────────────────────────────────────────────────────
-class Node:
-    __slots__ = ['name', 'children', 'branch_length']
-    def __init__(self, name="", children=None, branch_length=None):
-        self.name = name
-        self.children = children or []
-        self.branch_length = branch_length
+# Add scripts directory to path for tree_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tree_utils import parse_newick, split_bitsets, split_keys
 
-    def is_leaf(self):
-        return len(self.children) == 0
 
-    def get_leaves(self):
-        if self.is_leaf():
-            return [self.name]
-        leaves = []
-        for c in self.children:
-            leaves.extend(c.get_leaves())
-        return leaves
+def get_bipartitions(tree, tip_order):
+    """Get all non-trivial bipartitions as hashed bitset keys."""
+    return split_keys(split_bitsets(tree, tip_order))
 
 
-def parse_newick(s):
-    """Parse a newick string into a tree of Node objects."""
-    s = s.strip().rstrip(';').strip()
-    pos = [0]  # mutable index
-
-    def _parse():
-        children = []
-        if pos[0] < len(s) and s[pos[0]] == '(':
-            pos[0] += 1  # skip '('
-            children.append(_parse())
-            while pos[0] < len(s) and s[pos[0]] == ',':
-                pos[0] += 1  # skip ','
-                children.append(_parse())
-            if pos[0] < len(s) and s[pos[0]] == ')':
-                pos[0] += 1  # skip ')'
-
-        # Parse name and branch length
-        name = ""
-        while pos[0] < len(s) and s[pos[0]] not in (',', ')', ':', ';'):
-            name += s[pos[0]]
-            pos[0] += 1
-        bl = None
-        if pos[0] < len(s) and s[pos[0]] == ':':
-            pos[0] += 1
-            bl_str = ""
-            while pos[0] < len(s) and s[pos[0]] not in (',', ')', ';'):
-                bl_str += s[pos[0]]
-                pos[0] += 1
-            try:
-                bl = float(bl_str)
-            except ValueError:
-                pass
-
-        return Node(name=name.strip(), children=children, branch_length=bl)
-
-    return _parse()
-
-
-def get_bipartitions(root):
-    """Get all bipartitions (as frozenset pairs) from an unrooted tree."""
-    all_leaves = frozenset(root.get_leaves())
-    bips = set()
-
-    def _collect(node):
-        if node.is_leaf():
-            return frozenset([node.name])
-        clade_set = frozenset()
-        for c in node.children:
-            clade_set = clade_set | _collect(c)
-        # Add bipartition (skip root-level trivial ones)
-        complement = all_leaves - clade_set
-        if len(clade_set) > 0 and len(complement) > 0 and \
-           len(clade_set) > 1 and len(complement) > 1:
-            bip = frozenset([clade_set, complement])
-            bips.add(bip)
-        return clade_set
-
-    _collect(root)
-    return bips
-
-
-def check_monophyly(root, target_names):
+def check_monophyly(tree, target_names):
     """Check if target_names form a monophyletic clade."""
-    all_leaves = set(root.get_leaves())
-    present = set(n for n in target_names if n in all_leaves)
+    present = set(n for n in target_names if n in tree.tip_index)
     if len(present) < 2:
         return {"n": len(present), "mono": "NA", "type": "NA"}
 
-    # Find the smallest clade containing all target leaves
-    def _find_mrca(node):
-        if node.is_leaf():
-            return (frozenset([node.name]), node)
-        child_results = [_find_mrca(c) for c in node.children]
-        combined = frozenset()
-        for cr, _ in child_results:
-            combined = combined | cr
-        # Check if any single child contains all targets
-        for cr, cn in child_results:
-            if present.issubset(cr):
-                return (cr, cn)
-        # This node is the MRCA
-        return (combined, node)
-
-    mrca_leaves, mrca_node = _find_mrca(root)
-    mrca_leaf_set = set(mrca_node.get_leaves())
+    # Smallest clade containing all target leaves
+    mrca_leaf_set = set(tree.leaf_names(tree.mrca(present)))
 
     if mrca_leaf_set == present:
         return {"n": len(present), "mono": True, "type": "monophyletic"}
@@ -153,13 +66,13 @@ def main():
     print(f"Loading AA tree: {args.aa}")
     with open(args.aa) as f:
         aa_tree = parse_newick(f.read())
-    aa_tips = aa_tree.get_leaves()
+    aa_tips = aa_tree.tip_names
     print(f"  Tips: {len(aa_tips)}")
 
     print(f"Loading 3Di tree: {args.threedi}")
     with open(args.threedi) as f:
         di_tree = parse_newick(f.read())
-    di_tips = di_tree.get_leaves()
+    di_tips = di_tree.tip_names
     print(f"  Tips: {len(di_tips)}")
 
     # Tip match
@@ -170,8 +83,9 @@ def main():
 
     # RF distance
     print("Computing RF distance ...")
-    b_aa = get_bipartitions(aa_tree)
-    b_di = get_bipartitions(di_tree)
+    tip_order = sorted(aa_set | di_set)
+    b_aa = get_bipartitions(aa_tree, tip_order)
+    b_di = get_bipartitions(di_tree, tip_order)
     shared = b_aa & b_di
     only_aa = b_aa - b_di
     only_di = b_di - b_aa
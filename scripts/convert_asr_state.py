@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Build the memory-mapped binary cache for IQ-TREE .state files.
+
+Each .state file gets a companion <state>.npycache/ holding the posterior
+tensor, MAP states, entropy, top posterior and node/site index as .npy
+arrays keyed by the .state md5. Downstream readers (cross_scenario_asr_sensitivity.py,
+Phase 5 node locking) then memory-map the arrays instead of re-parsing text.
+
+Usage:
+  python scripts/convert_asr_state.py \
+    results/04_phylogeny_asr/ASR_core.state \
+    results/04_phylogeny_asr/ASR_core_S2.state
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+# Add scripts directory to path for asr_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from asr_utils import STATE_CACHE_DTYPES, load_state_cached
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Convert IQ-TREE .state files to md5-keyed memory-mapped .npy caches."
+    )
+    parser.add_argument("state", nargs="+", help="IQ-TREE .state file(s)")
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory for <state>.npycache (default: next to each .state file)",
+    )
+    parser.add_argument(
+        "--dtype",
+        choices=STATE_CACHE_DTYPES,
+        default="float32",
+        help="Posterior storage (default: float32)",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    for path in args.state:
+        if not os.path.isfile(path):
+            print(f"[convert_asr_state] ERROR: state file not found: {path}", file=sys.stderr)
+            sys.exit(1)
+        t0 = time.time()
+        try:
+            tensor = load_state_cached(path, cache_dir=args.cache_dir, dtype=args.dtype)
+        except ValueError as exc:
+            print(f"[convert_asr_state] ERROR: {exc}", file=sys.stderr)
+            sys.exit(1)
+        if tensor.cache_prefix is None:
+            print(f"[convert_asr_state] WARNING: could not write cache for {path}",
+                  file=sys.stderr)
+            continue
+        cache_bytes = sum(
+            os.path.getsize(os.path.join(os.path.dirname(tensor.cache_prefix), name))
+            for name in os.listdir(os.path.dirname(tensor.cache_prefix))
+            if name.startswith(os.path.basename(tensor.cache_prefix) + ".")
+        )
+        print(
+            f"[convert_asr_state] {path}: {tensor.n_nodes} nodes x {tensor.n_sites} sites "
+            f"-> {tensor.cache_prefix}.*.npy "
+            f"({cache_bytes / 1e6:.1f} MB vs {os.path.getsize(path) / 1e6:.1f} MB text, "
+            f"{time.time() - t0:.1f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -17,13 +17,46 @@ from __future__ import annotations
 
 import argparse
 import csv
-import math
 import os
 import sys
-from collections import defaultdict
-
-
-AA_COLUMNS = [f"p_{aa}" for aa in "ARNDCQEGHILKMFPSTWYV"]
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Add scripts directory to path for asr_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from asr_utils import (
+    AA_COLUMNS,
+    STATE_CACHE_DTYPES,
+    StateBlockReader,
+    StateTensor,
+    load_state_cached,
+    load_state_npy,
+    save_state_npy,
+)
+
+SITE_FIELDS = [
+    "reference_node",
+    "site",
+    "scenario_count",
+    "scenario_ids",
+    "map_states",
+    "map_consistent",
+    "max_top_pp_delta",
+    "mean_l1_posterior_delta",
+    "information_bits",
+    "information_range_bits",
+]
+NODE_FIELDS = [
+    "reference_node",
+    "scenario_count",
+    "site_count",
+    "map_consistency_rate",
+    "mean_max_top_pp_delta",
+    "mean_information_range_bits",
+    "high_conflict_sites",
+]
 
 
 def parse_args() -> argparse.Namespace:
@@ -47,6 +80,38 @@ def parse_args() -> argparse.Namespace:
         default=0.90,
         help="Posterior threshold for counting high-confidence conflicts",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=(
+            "Bounded-memory mode: index each .state file once, then parse one "
+            "node block per scenario at a time instead of loading whole tensors"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help=(
+            "Worker processes for the per-reference-node comparison; state "
+            "tensors are shared as memory-mapped .npy files (default: 1)"
+        ),
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Parse .state text every run instead of using the md5-keyed .npycache",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory for <state>.npycache (default: next to each .state file)",
+    )
+    parser.add_argument(
+        "--cache_dtype",
+        choices=STATE_CACHE_DTYPES,
+        default="float32",
+        help="Posterior storage in the binary cache (default: float32)",
+    )
     return parser.parse_args()
 
 
@@ -88,42 +153,46 @@ def read_node_map(path: str | None, scenarios: list[str]) -> dict[str, dict[str,
     return mapping
 
 
-def entropy(probs: list[float]) -> float:
-    value = 0.0
-    for p in probs:
-        if p > 0:
-            value -= p * math.log2(p)
-    return value
-
-
-def information_bits(probs: list[float]) -> float:
-    return math.log2(len(probs)) - entropy(probs)
+def load_state_source(
+    path: str, args: argparse.Namespace
+) -> StateTensor | StateBlockReader:
+    try:
+        if args.stream:
+            return StateBlockReader(path)
+        return load_state_cached(
+            path, cache=not args.no_cache, cache_dir=args.cache_dir, dtype=args.cache_dtype
+        )
+    except ValueError as exc:
+        fail(str(exc))
+
+
+def shared_site_axis(
+    state_tables: dict[str, StateTensor],
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """Sorted union of sites across tensors, and each tensor's columns in it."""
+    if not state_tables:
+        return np.zeros(0, dtype=np.int32), {}
+    site_axis = np.unique(np.concatenate([table.sites for table in state_tables.values()]))
+    return site_axis, {
+        scenario: table.site_positions(site_axis) for scenario, table in state_tables.items()
+    }
 
 
-def read_state_table(path: str) -> dict[str, dict[int, dict[str, object]]]:
-    node_site: dict[str, dict[int, dict[str, object]]] = defaultdict(dict)
-    with open(path) as handle:
-        reader = csv.DictReader(
-            (line for line in handle if not line.startswith("#")),
-            delimiter="\t",
-        )
-        expected = {"Node", "Site", "State", *AA_COLUMNS}
-        if reader.fieldnames is None or not expected.issubset(reader.fieldnames):
-            fail(f"unexpected .state header in {path}")
-        for row in reader:
-            probs = [float(row[column]) for column in AA_COLUMNS]
-            node_site[row["Node"]][int(row["Site"])] = {
-                "map_state": row["State"],
-                "top_pp": max(probs),
-                "entropy_bits": entropy(probs),
-                "information_bits": information_bits(probs),
-                "probs": probs,
-            }
-    return node_site
+def read_node_blocks(
+    readers: dict[str, StateBlockReader],
+    per_scenario_nodes: dict[str, str],
+) -> dict[str, StateTensor]:
+    """Parse one reference node's block from each scenario's .state file."""
+    blocks = {}
+    for scenario, node_id in per_scenario_nodes.items():
+        block = readers[scenario].read(node_id)
+        if block is not None:
+            blocks[scenario] = block
+    return blocks
 
 
 def resolve_reference_nodes(
-    state_tables: dict[str, dict[str, dict[int, dict[str, object]]]],
+    state_tables: dict[str, StateTensor | StateBlockReader],
     node_map: dict[str, dict[str, str]],
 ) -> dict[str, dict[str, str]]:
     if node_map:
@@ -131,7 +200,7 @@ def resolve_reference_nodes(
 
     common_nodes = None
     for table in state_tables.values():
-        nodes = set(table.keys())
+        nodes = set(table.nodes)
         common_nodes = nodes if common_nodes is None else common_nodes & nodes
     if not common_nodes:
         fail("no common node IDs found across scenarios; provide --node_map")
@@ -142,18 +211,210 @@ def resolve_reference_nodes(
     return resolved
 
 
-def site_union(
-    state_tables: dict[str, dict[str, dict[int, dict[str, object]]]],
+def mean(values: list[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def stack_node(
+    state_tables: dict[str, StateTensor],
+    site_columns: dict[str, np.ndarray],
+    n_sites: int,
     per_scenario_nodes: dict[str, str],
-) -> list[int]:
-    sites: set[int] = set()
-    for scenario, node_id in per_scenario_nodes.items():
-        sites.update(state_tables[scenario][node_id].keys())
-    return sorted(sites)
+    scenarios_present: list[str],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Stack one reference node's posteriors from each scenario on the shared site axis."""
+    k = len(scenarios_present)
+    probs = np.zeros((k, n_sites, len(AA_COLUMNS)), dtype=np.float32)
+    states = np.zeros((k, n_sites), dtype=np.uint8)
+    info = np.zeros((k, n_sites), dtype=np.float64)
+    top_pp = np.zeros((k, n_sites), dtype=np.float64)
+    for i, scenario in enumerate(scenarios_present):
+        table = state_tables.get(scenario)
+        row = None if table is None else table.node_index.get(per_scenario_nodes[scenario])
+        if row is None:
+            continue
+        cols = site_columns[scenario]
+        probs[i, cols] = table.probs[row]
+        states[i, cols] = table.map_state[row]
+        info[i, cols] = table.information(row)
+        top_pp[i, cols] = table.top_pp(row)
+    return probs, states, info, top_pp
+
+
+def compare_node(
+    ref_node: str,
+    scenarios_present: list[str],
+    probs: np.ndarray,
+    states: np.ndarray,
+    info: np.ndarray,
+    top_pp: np.ndarray,
+    site_axis: np.ndarray,
+    min_pp_high_conf: float,
+) -> tuple[list[list[object]], list[object]]:
+    """Site rows and the node row for one reference node.
+
+    probs/states/info/top_pp are [scenario, site(, state)] stacks in
+    scenarios_present order; a zero MAP-state code marks a scenario without
+    that site. info and top_pp are float64 values from the text, so only
+    the L1 column is computed from float32 posteriors.
+    """
+    present = states != 0
+    keep = np.flatnonzero(present.sum(axis=0) >= 2)
+    probs, states, info, top_pp, present = (
+        probs[:, keep], states[:, keep], info[:, keep], top_pp[:, keep], present[:, keep]
+    )
 
+    top_hi = np.where(present, top_pp, -np.inf).max(axis=0)
+    top_lo = np.where(present, top_pp, np.inf).min(axis=0)
+    max_pp_delta = top_hi - top_lo
+    map_consistent = (
+        np.where(present, states, 0).max(axis=0) == np.where(present, states, 255).min(axis=0)
+    )
+    info_range = np.where(present, info, -np.inf).max(axis=0) - np.where(
+        present, info, np.inf
+    ).min(axis=0)
+    high_conflict = ~map_consistent & (top_lo >= min_pp_high_conf)
+
+    k = len(scenarios_present)
+    l1_total = np.zeros(len(keep), dtype=np.float64)
+    l1_pairs = np.zeros(len(keep), dtype=np.int64)
+    for i in range(k):
+        for j in range(i + 1, k):
+            both = present[i] & present[j]
+            l1 = np.abs(probs[i].astype(np.float64) - probs[j]).sum(axis=-1) / 2.0
+            l1_total += np.where(both, l1, 0.0)
+            l1_pairs += both
+    mean_l1_delta = l1_total / l1_pairs
+
+    site_rows: list[list[object]] = []
+    all_present = present.all(axis=0)
+    for col in range(len(keep)):
+        members = (
+            range(k) if all_present[col] else np.flatnonzero(present[:, col]).tolist()
+        )
+        names = [scenarios_present[i] for i in members]
+        site_rows.append(
+            [
+                ref_node,
+                int(site_axis[keep[col]]),
+                len(names),
+                ",".join(names),
+                ";".join(
+                    f"{scenarios_present[i]}:{chr(states[i, col])}" for i in members
+                ),
+                int(map_consistent[col]),
+                f"{max_pp_delta[col]:.6f}",
+                f"{mean_l1_delta[col]:.6f}",
+                ";".join(f"{scenarios_present[i]}:{info[i, col]:.6f}" for i in members),
+                f"{info_range[col]:.6f}",
+            ]
+        )
 
-def mean(values: list[float]) -> float:
-    return sum(values) / len(values) if values else 0.0
+    site_count = len(keep)
+    node_row = [
+        ref_node,
+        k,
+        site_count,
+        f"{int(map_consistent.sum()) / site_count:.6f}" if site_count else "NA",
+        f"{mean(max_pp_delta.tolist()):.6f}" if site_count else "NA",
+        f"{mean(info_range.tolist()):.6f}" if site_count else "NA",
+        int(high_conflict.sum()),
+    ]
+    return site_rows, node_row
+
+
+def compare_reference_node(
+    state_tables: dict[str, StateTensor | StateBlockReader],
+    shared_axis: tuple[np.ndarray, dict[str, np.ndarray]] | None,
+    ref_node: str,
+    per_scenario_nodes: dict[str, str],
+    min_pp_high_conf: float,
+) -> tuple[list[list[object]], list[object]]:
+    """Compare one reference node; shared_axis is None for block readers."""
+    if shared_axis is None:
+        node_tables = read_node_blocks(state_tables, per_scenario_nodes)
+        site_axis, site_columns = shared_site_axis(node_tables)
+    else:
+        node_tables = state_tables
+        site_axis, site_columns = shared_axis
+
+    scenarios_present = sorted(per_scenario_nodes)
+    probs, states, info, top_pp = stack_node(
+        node_tables, site_columns, len(site_axis), per_scenario_nodes, scenarios_present
+    )
+    return compare_node(
+        ref_node, scenarios_present, probs, states, info, top_pp, site_axis, min_pp_high_conf
+    )
+
+
+_WORKER: dict[str, object] = {}
+
+
+def init_worker(
+    sources: dict[str, str | StateBlockReader], stream: bool, min_pp_high_conf: float
+) -> None:
+    """Pool initializer: open block readers as-is, tensors from .npy memmaps."""
+    if stream:
+        tables = sources
+        shared_axis = None
+    else:
+        tables = {scenario: load_state_npy(prefix) for scenario, prefix in sources.items()}
+        shared_axis = shared_site_axis(tables)
+    _WORKER.update(tables=tables, shared_axis=shared_axis, min_pp_high_conf=min_pp_high_conf)
+
+
+def compare_shard(
+    shard: list[tuple[str, dict[str, str]]],
+) -> tuple[list[list[object]], list[list[object]]]:
+    """Worker task: site rows and node rows for a contiguous run of reference nodes."""
+    site_rows: list[list[object]] = []
+    node_rows: list[list[object]] = []
+    for ref_node, per_scenario_nodes in shard:
+        rows, node_row = compare_reference_node(
+            _WORKER["tables"],
+            _WORKER["shared_axis"],
+            ref_node,
+            per_scenario_nodes,
+            _WORKER["min_pp_high_conf"],
+        )
+        site_rows.extend(rows)
+        node_rows.append(node_row)
+    return site_rows, node_rows
+
+
+def iter_results(
+    args: argparse.Namespace,
+    state_tables: dict[str, StateTensor | StateBlockReader],
+    jobs: list[tuple[str, dict[str, str]]],
+):
+    """Yield (site rows, node rows) batches in reference-node order."""
+    if args.workers <= 1 or len(jobs) < 2:
+        shared_axis = None if args.stream else shared_site_axis(state_tables)
+        for ref_node, per_scenario_nodes in jobs:
+            rows, node_row = compare_reference_node(
+                state_tables, shared_axis, ref_node, per_scenario_nodes, args.min_pp_high_conf
+            )
+            yield rows, [node_row]
+        return
+
+    shard_size = max(1, -(-len(jobs) // (args.workers * 8)))
+    shards = [jobs[i : i + shard_size] for i in range(0, len(jobs), shard_size)]
+    with tempfile.TemporaryDirectory(prefix="asr_tensors_") as tmpdir:
+        if args.stream:
+            sources = state_tables
+        else:
+            sources = {}
+            for scenario, table in state_tables.items():
+                if table.cache_prefix is None:
+                    table.cache_prefix = os.path.join(tmpdir, scenario)
+                    save_state_npy(table, table.cache_prefix)
+                sources[scenario] = table.cache_prefix
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=init_worker,
+            initargs=(sources, args.stream, args.min_pp_high_conf),
+        ) as pool:
+            yield from pool.map(compare_shard, shards)
 
 
 def main() -> None:
@@ -161,10 +422,15 @@ def main() -> None:
     scenario_paths = [parse_state_arg(item) for item in args.state]
     scenarios = [scenario for scenario, _ in scenario_paths]
     state_tables = {
-        scenario: read_state_table(path) for scenario, path in scenario_paths
+        scenario: load_state_source(path, args) for scenario, path in scenario_paths
     }
     node_map = read_node_map(args.node_map, scenarios)
     reference_nodes = resolve_reference_nodes(state_tables, node_map)
+    jobs = [
+        (ref_node, per_scenario_nodes)
+        for ref_node, per_scenario_nodes in sorted(reference_nodes.items())
+        if all(scenario in per_scenario_nodes for scenario in scenarios)
+    ]
 
     out_prefix = args.out_prefix
     out_dir = os.path.dirname(out_prefix) or "."
@@ -174,128 +440,21 @@ def main() -> None:
     node_path = f"{out_prefix}_node.tsv"
     scenario_path = f"{out_prefix}_scenario.tsv"
 
-    site_rows: list[dict[str, object]] = []
-    node_rows: list[dict[str, object]] = []
-
-    for ref_node, per_scenario_nodes in sorted(reference_nodes.items()):
-        missing = [scenario for scenario in scenarios if scenario not in per_scenario_nodes]
-        if missing:
-            continue
-
-        agreement_flags: list[int] = []
-        pp_deltas: list[float] = []
-        info_ranges: list[float] = []
-        high_conflict_sites = 0
-
-        for site in site_union(state_tables, per_scenario_nodes):
-            per_scenario = {}
-            for scenario, node_id in per_scenario_nodes.items():
-                record = state_tables[scenario][node_id].get(site)
-                if record is not None:
-                    per_scenario[scenario] = record
-
-            if len(per_scenario) < 2:
-                continue
-
-            map_states = {scenario: rec["map_state"] for scenario, rec in per_scenario.items()}
-            top_pps = {scenario: float(rec["top_pp"]) for scenario, rec in per_scenario.items()}
-            info_bits = {
-                scenario: float(rec["information_bits"]) for scenario, rec in per_scenario.items()
-            }
-            prob_vectors = [rec["probs"] for rec in per_scenario.values()]
-
-            map_consistent = int(len(set(map_states.values())) == 1)
-            max_pp_delta = max(top_pps.values()) - min(top_pps.values())
-            l1_deltas = []
-            scenarios_present = sorted(per_scenario)
-            for i, left in enumerate(scenarios_present):
-                for right in scenarios_present[i + 1 :]:
-                    left_probs = per_scenario[left]["probs"]
-                    right_probs = per_scenario[right]["probs"]
-                    l1_deltas.append(
-                        sum(abs(a - b) for a, b in zip(left_probs, right_probs)) / 2.0
-                    )
-            mean_l1_delta = mean(l1_deltas)
-            info_range = max(info_bits.values()) - min(info_bits.values())
-
-            agreement_flags.append(map_consistent)
-            pp_deltas.append(max_pp_delta)
-            info_ranges.append(info_range)
-            if (
-                not map_consistent
-                and max(top_pps.values()) >= args.min_pp_high_conf
-                and min(top_pps.values()) >= args.min_pp_high_conf
-            ):
-                high_conflict_sites += 1
-
-            site_rows.append(
-                {
-                    "reference_node": ref_node,
-                    "site": site,
-                    "scenario_count": len(per_scenario),
-                    "scenario_ids": ",".join(scenarios_present),
-                    "map_states": ";".join(
-                        f"{scenario}:{map_states[scenario]}" for scenario in scenarios_present
-                    ),
-                    "map_consistent": map_consistent,
-                    "max_top_pp_delta": f"{max_pp_delta:.6f}",
-                    "mean_l1_posterior_delta": f"{mean_l1_delta:.6f}",
-                    "information_bits": ";".join(
-                        f"{scenario}:{info_bits[scenario]:.6f}"
-                        for scenario in scenarios_present
-                    ),
-                    "information_range_bits": f"{info_range:.6f}",
-                }
-            )
-
-        node_rows.append(
-            {
-                "reference_node": ref_node,
-                "scenario_count": len(per_scenario_nodes),
-                "site_count": len(agreement_flags),
-                "map_consistency_rate": (
-                    f"{sum(agreement_flags) / len(agreement_flags):.6f}"
-                    if agreement_flags
-                    else "NA"
-                ),
-                "mean_max_top_pp_delta": f"{mean(pp_deltas):.6f}" if pp_deltas else "NA",
-                "mean_information_range_bits": (
-                    f"{mean(info_ranges):.6f}" if info_ranges else "NA"
-                ),
-                "high_conflict_sites": high_conflict_sites,
-            }
-        )
-
-    with open(site_path, "w", newline="") as handle:
-        fieldnames = [
-            "reference_node",
-            "site",
-            "scenario_count",
-            "scenario_ids",
-            "map_states",
-            "map_consistent",
-            "max_top_pp_delta",
-            "mean_l1_posterior_delta",
-            "information_bits",
-            "information_range_bits",
-        ]
-        writer = csv.DictWriter(handle, fieldnames=fieldnames, delimiter="\t")
-        writer.writeheader()
-        writer.writerows(site_rows)
-
-    with open(node_path, "w", newline="") as handle:
-        fieldnames = [
-            "reference_node",
-            "scenario_count",
-            "site_count",
-            "map_consistency_rate",
-            "mean_max_top_pp_delta",
-            "mean_information_range_bits",
-            "high_conflict_sites",
-        ]
-        writer = csv.DictWriter(handle, fieldnames=fieldnames, delimiter="\t")
-        writer.writeheader()
-        writer.writerows(node_rows)
+    n_site_rows = 0
+    n_node_rows = 0
+
+    with open(site_path, "w", newline="") as site_handle, open(
+        node_path, "w", newline=""
+    ) as node_handle:
+        site_writer = csv.writer(site_handle, delimiter="\t", lineterminator="\r\n")
+        node_writer = csv.writer(node_handle, delimiter="\t", lineterminator="\r\n")
+        site_writer.writerow(SITE_FIELDS)
+        node_writer.writerow(NODE_FIELDS)
+        for site_rows, node_rows in iter_results(args, state_tables, jobs):
+            site_writer.writerows(site_rows)
+            node_writer.writerows(node_rows)
+            n_site_rows += len(site_rows)
+            n_node_rows += len(node_rows)
 
     with open(scenario_path, "w", newline="") as handle:
         fieldnames = ["scenario_id", "state_path", "node_count"]
@@ -306,13 +465,13 @@ def main() -> None:
                 {
                     "scenario_id": scenario,
                     "state_path": path,
-                    "node_count": len(state_tables[scenario]),
+                    "node_count": state_tables[scenario].n_nodes,
                 }
             )
 
     print(
         "[cross_scenario_asr_sensitivity] "
-        f"wrote {len(site_rows)} site rows and {len(node_rows)} node rows"
+        f"wrote {n_site_rows} site rows and {n_node_rows} node rows"
     )
 
 
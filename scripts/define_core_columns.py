@@ -13,6 +13,11 @@ Implements meta/params.json:
   core_definition.lddt_min = "auto_inflection" or numeric
   core_definition.gap_fraction_max
   core_definition.pad_residues
+
+Grid mode (--grid-lddt-min / --grid-gap-max / --grid-pad) evaluates every
+(lddt_min, gap_fraction_max, pad_residues) triple from the same score and
+gap-fraction vectors and writes core_grid.tsv instead of the core outputs;
+masks for all triples are computed as stacked boolean arrays in one pass.
 """
 
 from __future__ import annotations
@@ -21,35 +26,28 @@ import argparse
 import json
 import os
 import re
+import sys
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Tuple, Optional
 
+import numpy as np
+
+# Add scripts directory to path for msa_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from msa_utils import Alignment, mask_to_string, read_alignment, write_alignment
+
 
-GAP_CHARS = set(["-", "."])
-
-
-def read_fasta(path: Path) -> List[Tuple[str, str]]:
-    records: List[Tuple[str, str]] = []
-    name: Optional[str] = None
-    seq_chunks: List[str] = []
-    with path.open("r", errors="replace") as fh:
-        for line in fh:
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith(">"):
-                if name is not None:
-                    records.append((name, "".join(seq_chunks)))
-                name = line[1:].split()[0]
-                seq_chunks = []
-            else:
-                seq_chunks.append(line)
-    if name is not None:
-        records.append((name, "".join(seq_chunks)))
-    if not records:
+def read_msa(path: Path) -> Alignment:
+    try:
+        aln = read_alignment(path)
+    except ValueError as exc:
+        raise SystemExit(
+            f"[ERROR] MSA is not rectangular: sequences have different alignment lengths ({exc})"
+        )
+    if aln.n_seqs == 0:
         raise SystemExit(f"[ERROR] No FASTA records read from: {path}")
-    return records
+    return aln
 
 
 def extract_json_array_after_key(text: str, key: str) -> str:
@@ -104,79 +102,133 @@ def knee_threshold(scores: List[float]) -> float:
     scores: per-column, with -1 meaning 'unscored'
     Returns threshold on original score scale.
     """
-    valid = [s for s in scores if s >= 0.0]
-    if not valid:
+    score_arr = np.asarray(scores, dtype=float)
+    valid_sorted = np.sort(score_arr[score_arr >= 0.0])[::-1]
+    if valid_sorted.size == 0:
         raise SystemExit("[ERROR] No valid (>=0) LDDT scores found.")
-    valid_sorted = sorted(valid, reverse=True)
 
-    if len(valid_sorted) < 3:
-        return min(valid_sorted)
+    if valid_sorted.size < 3:
+        return float(valid_sorted[-1])
 
-    s_max = max(valid_sorted)
-    s_min = min(valid_sorted)
+    s_max = valid_sorted[0]
+    s_min = valid_sorted[-1]
     if s_max == s_min:
-        return s_max
-
-    # normalize to [0,1]
-    y = [(s - s_min) / (s_max - s_min) for s in valid_sorted]
-    n = len(y)
-    best_i = 0
-    best_dist = -1.0
-    for i, yi in enumerate(y):
-        xi = i / (n - 1)
-        line_y = 1.0 - xi  # diagonal from (0,1) to (1,0)
-        dist = line_y - yi
-        if dist > best_dist:
-            best_dist = dist
-            best_i = i
-    return valid_sorted[best_i]
-
-
-def contiguous_blocks(mask: List[bool]) -> List[Tuple[int, int]]:
-    blocks: List[Tuple[int, int]] = []
-    in_block = False
-    start = 0
-    for i, keep in enumerate(mask):
-        if keep and not in_block:
-            in_block = True
-            start = i
-        elif (not keep) and in_block:
-            in_block = False
-            blocks.append((start, i - 1))
-    if in_block:
-        blocks.append((start, len(mask) - 1))
-    return blocks
-
-
-def apply_block_padding(
-    keep: List[bool],
-    pad: int,
-    scores: List[float],
-) -> List[bool]:
+        return float(s_max)
+
+    # normalize to [0,1]; distance below the diagonal from (0,1) to (1,0)
+    y = (valid_sorted - s_min) / (s_max - s_min)
+    x = np.arange(valid_sorted.size) / (valid_sorted.size - 1)
+    dist = (1.0 - x) - y
+    return float(valid_sorted[int(np.argmax(dist))])
+
+
+def resolve_lddt_min(lddt_min, scores: List[float]) -> Tuple[float, str]:
+    """Numeric threshold and its provenance note for a params/CLI lddt_min value."""
+    if isinstance(lddt_min, str) and lddt_min == "auto_inflection":
+        return knee_threshold(scores), "auto_inflection(knee)"
+    if isinstance(lddt_min, (int, float)):
+        return float(lddt_min), "numeric_from_params"
+    # allow strings like "0.70"
+    try:
+        return float(lddt_min), "coerced_string"
+    except Exception as e:
+        raise SystemExit(f"[ERROR] Unrecognized lddt_min in params: {lddt_min!r} ({e})")
+
+
+def contiguous_blocks(mask) -> List[Tuple[int, int]]:
+    """(start, end) inclusive index pairs of the True runs in a 1-D mask."""
+    edges = np.diff(np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def apply_block_padding(keep, pad: int, scores) -> np.ndarray:
     """
     Expand each kept contiguous block by ±pad columns.
     Safety: do NOT turn on columns whose score is -1 (unscored), even if padded.
+
+    keep may be one mask (L,) or a stack of masks (..., L). A column is
+    within ±pad of a kept block iff the window [j-pad, j+pad] holds a kept
+    column, which is read off a cumulative sum along the last axis.
     """
+    keep = np.asarray(keep, dtype=bool)
     if pad <= 0:
-        return keep[:]
-    L = len(keep)
-    out = keep[:]
-    for s, e in contiguous_blocks(keep):
-        s2 = max(0, s - pad)
-        e2 = min(L - 1, e + pad)
-        for j in range(s2, e2 + 1):
-            if scores[j] >= 0.0:  # exclude unscored columns
-                out[j] = True
-    return out
-
-
-def write_fasta(path: Path, records: List[Tuple[str, str]]) -> None:
-    with path.open("w") as fh:
-        for name, seq in records:
-            fh.write(f">{name}\n")
-            # wrap for readability
-            for i in range(0, len(seq), 80):
-                fh.write(seq[i : i + 80] + "\n")
+        return keep.copy()
+    L = keep.shape[-1]
+    csum = np.zeros(keep.shape[:-1] + (L + 1,), dtype=np.int64)
+    np.cumsum(keep, axis=-1, out=csum[..., 1:])
+    cols = np.arange(L)
+    hi = np.minimum(cols + pad + 1, L)
+    lo = np.maximum(cols - pad, 0)
+    near_block = (csum[..., hi] - csum[..., lo]) > 0
+    return keep | (near_block & (np.asarray(scores, dtype=float) >= 0.0))
+
+
+def base_core_masks(score_arr: np.ndarray, gap_frac_arr: np.ndarray,
+                    lddt_mins, gap_maxes) -> np.ndarray:
+    """bool (n_lddt, n_gap, L) base core rule for every threshold pair."""
+    lddt_ok = score_arr[None, :] >= np.asarray(lddt_mins, dtype=float)[:, None]
+    gap_ok = gap_frac_arr[None, :] <= np.asarray(gap_maxes, dtype=float)[:, None]
+    return (score_arr >= 0.0) & lddt_ok[:, None, :] & gap_ok[None, :, :]
+
+
+def parse_grid_values(text: Optional[str], default, cast):
+    """Comma-separated grid axis values; the single params/CLI value if not given."""
+    if text is None:
+        return [default]
+    values = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item == "auto_inflection":
+            values.append(item)
+            continue
+        try:
+            values.append(cast(item))
+        except ValueError:
+            raise SystemExit(f"[ERROR] Invalid grid value: {item!r}")
+    if not values:
+        raise SystemExit(f"[ERROR] Empty grid: {text!r}")
+    return values
+
+
+def run_grid(aln: Alignment, scores: List[float], lddt_values, gap_maxes, pads,
+             out_path: Path) -> None:
+    """Write base/padded core lengths for every (lddt_min, gap_max, pad) triple."""
+    score_arr = np.asarray(scores, dtype=float)
+    gap_frac_arr = aln.gap_fractions()
+    lddt_resolved = [resolve_lddt_min(v, scores) for v in lddt_values]
+    lddt_mins = [t for t, _ in lddt_resolved]
+
+    base = base_core_masks(score_arr, gap_frac_arr, lddt_mins, gap_maxes)
+    padded = np.stack([apply_block_padding(base, pad=p, scores=score_arr) for p in pads], axis=2)
+    # padded: (n_lddt, n_gap, n_pad, L); flatten in (lddt, gap, pad) order
+    flat = padded.reshape(-1, aln.n_cols)
+    core_lens = flat.sum(axis=1)
+    base_lens = np.repeat(base.reshape(-1, aln.n_cols).sum(axis=1), len(pads))
+    n_blocks = (np.diff(flat.astype(np.int8), axis=1, prepend=0) == 1).sum(axis=1)
+    residues = np.sort(aln.kept_residue_counts(flat), axis=0)
+    res_min = residues[0]
+    res_med = residues[aln.n_seqs // 2]
+
+    with out_path.open("w") as fh:
+        fh.write("lddt_min\tlddt_min_source\tgap_fraction_max\tpad_residues\t"
+                 "base_core_len\tcore_len\tn_blocks\tseq_residues_min\tseq_residues_median\n")
+        k = 0
+        for (lddt_min, note), lddt_value in zip(lddt_resolved, lddt_values):
+            source = note if lddt_value == "auto_inflection" else "numeric"
+            for gap_max in gap_maxes:
+                for pad in pads:
+                    fh.write(f"{lddt_min:.4f}\t{source}\t{gap_max}\t{pad}\t{base_lens[k]}\t"
+                             f"{core_lens[k]}\t{n_blocks[k]}\t{res_min[k]}\t{res_med[k]}\n")
+                    k += 1
+
+    print(f"[INFO] Grid: {len(lddt_mins)} lddt_min x {len(gap_maxes)} gap_fraction_max x "
+          f"{len(pads)} pad_residues = {len(core_lens)} combinations")
+    print(f"[OK] Wrote {out_path}")
+    print(f"[SUMMARY] core_len range {int(core_lens.min())}-{int(core_lens.max())}")
 
 
 def main() -> None:
@@ -197,6 +249,15 @@ def main() -> None:
                      help="Output prefix for core FASTA files")
     ap.add_argument("--lddt-min", default=None,
                      help="Override core_definition.lddt_min (float), e.g. 0.70")
+    ap.add_argument("--grid-lddt-min", default=None,
+                     help="Grid mode: comma-separated lddt_min values "
+                          "(numbers and/or auto_inflection), e.g. auto_inflection,0.6,0.7")
+    ap.add_argument("--grid-gap-max", default=None,
+                     help="Grid mode: comma-separated gap_fraction_max values, e.g. 0.2,0.3,0.4")
+    ap.add_argument("--grid-pad", default=None,
+                     help="Grid mode: comma-separated pad_residues values, e.g. 0,10,20")
+    ap.add_argument("--grid-out", default=None,
+                     help="Grid mode output TSV (default: <outdir>/core_grid.tsv)")
     args = ap.parse_args()
 
     msa_path = Path(args.msa)
@@ -227,15 +288,10 @@ def main() -> None:
         lddt_method = "from_params"
 
     # --- read MSA ---
-    records = read_fasta(msa_path)
-    names = [r[0] for r in records]
-    seqs = [r[1] for r in records]
-
-    L = len(seqs[0])
-    if any(len(s) != L for s in seqs):
-        raise SystemExit("[ERROR] MSA is not rectangular: sequences have different alignment lengths.")
+    aln = read_msa(msa_path)
+    L = aln.n_cols
 
-    print(f"[INFO] MSA: {len(seqs)} sequences, alignment length {L}")
+    print(f"[INFO] MSA: {aln.n_seqs} sequences, alignment length {L}")
 
     # --- parse LDDT scores ---
     scores, msa_lddt = parse_lddt_from_html(html_path)
@@ -245,96 +301,77 @@ def main() -> None:
 
     print(f"[INFO] LDDT scores parsed: {len(scores)} columns, msaLDDT={msa_lddt}")
 
+    # --- grid mode: sweep thresholds, report core_len per combination ---
+    if any(v is not None for v in (args.grid_lddt_min, args.grid_gap_max, args.grid_pad)):
+        run_grid(
+            aln,
+            scores,
+            parse_grid_values(args.grid_lddt_min, lddt_min, float),
+            parse_grid_values(args.grid_gap_max, gap_max, float),
+            parse_grid_values(args.grid_pad, pad, int),
+            Path(args.grid_out) if args.grid_out else outdir / "core_grid.tsv",
+        )
+        return
+
     # --- determine threshold ---
-    if isinstance(lddt_min, str) and lddt_min == "auto_inflection":
-        threshold = knee_threshold(scores)
-        lddt_min_used = threshold
-        lddt_min_note = "auto_inflection(knee)"
-    elif isinstance(lddt_min, (int, float)):
-        lddt_min_used = float(lddt_min)
-        lddt_min_note = "numeric_from_params"
-    else:
-        # allow strings like "0.70"
-        try:
-            lddt_min_used = float(lddt_min)
-            lddt_min_note = "coerced_string"
-        except Exception as e:
-            raise SystemExit(f"[ERROR] Unrecognized lddt_min in params: {lddt_min!r} ({e})")
+    lddt_min_used, lddt_min_note = resolve_lddt_min(lddt_min, scores)
 
     print(f"[INFO] LDDT threshold: {lddt_min_used:.4f} ({lddt_min_note})")
 
     # --- compute gap fractions & base mask ---
-    n = len(seqs)
-    gap_fracs: List[float] = []
-    keep0: List[bool] = []
-
-    for i in range(L):
-        gaps = 0
-        for s in seqs:
-            if s[i] in GAP_CHARS:
-                gaps += 1
-        gf = gaps / n
-        gap_fracs.append(gf)
-        score = scores[i]
-        # base core rule
-        keep = (score >= 0.0) and (score >= lddt_min_used) and (gf <= gap_max)
-        keep0.append(keep)
-
-    base_core_len = sum(1 for x in keep0 if x)
+    n = aln.n_seqs
+    gap_frac_arr = aln.gap_fractions()
+    score_arr = np.asarray(scores, dtype=float)
+    # base core rule
+    keep0_arr = base_core_masks(score_arr, gap_frac_arr, [lddt_min_used], [gap_max])[0, 0]
+
+    base_core_len = int(keep0_arr.sum())
     print(f"[INFO] Base core (before padding): {base_core_len} columns")
 
     # --- apply padding ---
-    keep = apply_block_padding(keep0, pad=pad, scores=scores)
+    keep_arr = apply_block_padding(keep0_arr, pad=pad, scores=score_arr)
 
-    core_len = sum(1 for x in keep if x)
-    valid_scores = [s for s in scores if s >= 0.0]
-    n_valid = len(valid_scores)
+    core_len = int(keep_arr.sum())
+    n_valid = int((score_arr >= 0.0).sum())
 
     print(f"[INFO] Core after padding (±{pad}): {core_len} columns")
 
     # --- write mask ---
     mask_path = outdir / "core_columns.mask"
-    mask_str = "".join("1" if k else "0" for k in keep)
+    mask_str = mask_to_string(keep_arr)
     mask_path.write_text(mask_str + "\n")
 
     # --- write masked AA fasta ---
-    core_records = []
-    per_seq_non_gap = []
-    for name, seq in zip(names, seqs):
-        core_seq = "".join(ch for ch, k in zip(seq, keep) if k)
-        core_records.append((name, core_seq))
-        nongap = sum(1 for ch in core_seq if ch not in GAP_CHARS)
-        per_seq_non_gap.append(nongap)
+    core_aln = aln.select_columns(keep_arr)
+    per_seq_non_gap = core_aln.residue_counts().tolist()
 
     aa_out = outdir / f"{args.prefix}_core_aa.fa"
-    write_fasta(aa_out, core_records)
+    write_alignment(core_aln, aa_out, line_width=80)
 
     # --- optionally mask 3di alignment with same columns ---
     if args.msa_3di:
         msa3_path = Path(args.msa_3di)
         if not msa3_path.is_file():
             raise SystemExit(f"[ERROR] 3Di MSA file not found: {msa3_path}")
-        rec3 = read_fasta(msa3_path)
-        seq3 = [r[1] for r in rec3]
-        if len(seq3) != n:
+        try:
+            aln3 = read_alignment(msa3_path)
+        except ValueError:
+            raise SystemExit("[ERROR] 3Di MSA length != AA MSA length; cannot apply same mask safely.")
+        if aln3.n_seqs != n:
             raise SystemExit("[ERROR] 3Di MSA record count != AA MSA record count; cannot apply same mask safely.")
-        if any(len(s) != L for s in seq3):
+        if aln3.n_cols != L:
             raise SystemExit("[ERROR] 3Di MSA length != AA MSA length; cannot apply same mask safely.")
-        core3 = []
-        for (name3, s3) in rec3:
-            core_seq3 = "".join(ch for ch, k in zip(s3, keep) if k)
-            core3.append((name3, core_seq3))
         out3 = outdir / f"{args.prefix}_core_3di.fa"
-        write_fasta(out3, core3)
+        write_alignment(aln3.select_columns(keep_arr), out3, line_width=80)
 
     # --- write per-column table ---
     tsv_path = outdir / "core_columns.tsv"
     with tsv_path.open("w") as fh:
         fh.write("col_index\tlddt\tgap_fraction\tkeep_base\tkeep_padded\n")
-        for i in range(L):
-            fh.write(
-                f"{i+1}\t{scores[i]:.6f}\t{gap_fracs[i]:.6f}\t{int(keep0[i])}\t{int(keep[i])}\n"
-            )
+        for i, (score, gap_frac, k0, k) in enumerate(
+            zip(scores, gap_frac_arr.tolist(), keep0_arr.tolist(), keep_arr.tolist())
+        ):
+            fh.write(f"{i+1}\t{score:.6f}\t{gap_frac:.6f}\t{int(k0)}\t{int(k)}\n")
 
     # --- QC report ---
     qc_path = outdir / "qc_core_definition.md"
@@ -6,7 +6,9 @@ an HMM profile, with mandatory hit stitching (SOP CHECK-06).
 Phase 3.6 of the DAH7PS V4.1 SOP.
 
 Pipeline:
-  1. Run hmmsearch --domtblout against the core HMM
+  1. Run hmmsearch --domtblout against the core HMM (optionally sharded:
+     --shards N splits the FASTA into residue-balanced shards searched in
+     parallel with -Z set to the full database size)
   2. Parse domain hits, filter by i-Evalue and HMM span
   3. Stitch multi-domain hits in HMM coordinate space (merge_gap tolerance)
   4. Compute coverage = stitched_hmm_span / model_length
@@ -24,29 +26,10 @@ import subprocess
 import sys
 import tempfile
 
-# Add scripts directory to path for hmmer_utils
+# Add scripts directory to path for fasta_utils / hmmer_utils
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from hmmer_utils import parse_domtbl_all_domains, merge_intervals, union_coverage_hmm
-
-
-def parse_fasta(path):
-    """Parse FASTA file, return dict of seqid -> sequence."""
-    seqs = {}
-    current_id = None
-    current_seq = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                if current_id is not None:
-                    seqs[current_id] = "".join(current_seq)
-                current_id = line[1:].split()[0]
-                current_seq = []
-            else:
-                current_seq.append(line)
-    if current_id is not None:
-        seqs[current_id] = "".join(current_seq)
-    return seqs
+from fasta_utils import FastaIndex
+from hmmer_utils import load_domtbl_table, run_hmmsearch_sharded, stitch_domtbl
 
 
 def get_hmm_length(hmm_path):
@@ -58,8 +41,27 @@ def get_hmm_length(hmm_path):
     raise ValueError(f"Could not find LENG in {hmm_path}")
 
 
-def run_hmmsearch(hmm_path, fasta_path, domtblout_path, cpu=4):
-    """Run hmmsearch and produce domtblout."""
+def run_hmmsearch(hmm_path, fasta_path, domtblout_path, cpu=4, shards=1):
+    """Run hmmsearch and produce domtblout (sharded when shards > 1)."""
+    if shards > 1:
+        print(
+            f"[extract_core_domains] Running hmmsearch on {shards} residue-balanced shards "
+            f"(total --cpu {cpu})",
+            file=sys.stderr,
+        )
+        try:
+            info = run_hmmsearch_sharded(
+                hmm_path, fasta_path, domtblout_path, shards, cpu=cpu, extra_args=["--noali"]
+            )
+        except RuntimeError as exc:
+            print(f"[ERROR] {exc}", file=sys.stderr)
+            sys.exit(1)
+        print(
+            f"[extract_core_domains] hmmsearch completed: {info['n_shards']} shards x "
+            f"--cpu {info['cpu_per_shard']}, -Z {info['n_seqs']}, domZ {info['domZ']:g}.",
+            file=sys.stderr,
+        )
+        return
     cmd = [
         "hmmsearch",
         "--domtblout", domtblout_path,
@@ -87,6 +89,7 @@ def extract_core_domains(
     coverage_min=0.70,
     pad=20,
     cpu=4,
+    shards=1,
 ):
     """Main extraction pipeline."""
     # 0. Get model length
@@ -95,20 +98,22 @@ def extract_core_domains(
 
     # 1. Run hmmsearch
     domtbl_path = out_tsv.replace(".tsv", "_domtblout.txt")
-    run_hmmsearch(hmm_path, fasta_path, domtbl_path, cpu=cpu)
+    run_hmmsearch(hmm_path, fasta_path, domtbl_path, cpu=cpu, shards=shards)
 
-    # 2. Parse domain hits
-    all_domains = parse_domtbl_all_domains(
-        domtbl_path, ievalue_max=ievalue, min_hmm_span=hmm_span_min
-    )
+    # 2. Parse domain hits; stitch HMM and envelope intervals for all sequences at once
+    table = load_domtbl_table(domtbl_path)
+    qualifying = table.mask(ievalue_max=ievalue, min_hmm_span=hmm_span_min)
+    hits = stitch_domtbl(table, hmm_len, mask=qualifying, merge_gap=merge_gap)
+    hit_ids = [table.targets[code] for code in hits.n_domains.nonzero()[0].tolist()]
     print(
-        f"[extract_core_domains] Sequences with qualifying hits: {len(all_domains)}",
+        f"[extract_core_domains] Sequences with qualifying hits: {len(hit_ids)}",
         file=sys.stderr,
     )
 
-    # 3. Parse input FASTA
-    seqs = parse_fasta(fasta_path)
-    print(f"[extract_core_domains] Input sequences: {len(seqs)}", file=sys.stderr)
+    # 3. Index input FASTA; load only sequences with qualifying hits
+    fasta_index = FastaIndex(fasta_path)
+    hit_seqs = fasta_index.get(hit_ids)
+    print(f"[extract_core_domains] Input sequences: {len(fasta_index)}", file=sys.stderr)
 
     # 4. Stitch, filter, extract
     n_pass = 0
@@ -119,20 +124,20 @@ def extract_core_domains(
     tsv_rows = []
     fasta_records = []
 
-    for seqid, seq in seqs.items():
-        seq_len = len(seq)
-
-        if seqid not in all_domains:
+    for seqid in fasta_index.ids:
+        if seqid not in hit_seqs:
             n_no_hit += 1
             continue
 
-        domains = all_domains[seqid]
-        n_hits = len(domains)
+        seq = hit_seqs[seqid]
+        seq_len = len(seq)
 
-        # Compute stitched HMM coverage
-        coverage, hmm_merged, _ = union_coverage_hmm(
-            domains, hmm_len, merge_gap=merge_gap
-        )
+        code = table.target_index[seqid]
+        n_hits = int(hits.n_domains[code])
+
+        # Stitched HMM coverage
+        coverage = float(hits.coverage[code])
+        hmm_merged = hits.hmm_intervals(code)
 
         stitched = n_hits > 1 and len(hmm_merged) < n_hits
         if stitched:
@@ -144,9 +149,8 @@ def extract_core_domains(
             continue
 
         # Extract stitched envelope region from sequence
-        # Use envelope coords (env_from, env_to) and merge with same gap tolerance
-        env_intervals = [(d["env_from"], d["env_to"]) for d in domains]
-        env_merged = merge_intervals(env_intervals, merge_gap=0)
+        # (envelope coords env_from..env_to, merged without gap tolerance)
+        env_merged = hits.env_intervals(code)
 
         # Raw (unpadded) envelope boundaries
         raw_env_start = env_merged[0][0]
@@ -196,7 +200,7 @@ def extract_core_domains(
 
     # 5. Print summary
     print(f"\n[extract_core_domains] === Summary ===", file=sys.stderr)
-    print(f"  Input sequences:    {len(seqs)}", file=sys.stderr)
+    print(f"  Input sequences:    {len(fasta_index)}", file=sys.stderr)
     print(f"  No qualifying hit:  {n_no_hit}", file=sys.stderr)
     print(f"  Failed coverage:    {n_fail_cov} (< {coverage_min})", file=sys.stderr)
     print(f"  Passed (output):    {n_pass}", file=sys.stderr)
@@ -294,6 +298,13 @@ def main():
     parser.add_argument(
         "--cpu", type=int, default=4, help="CPUs for hmmsearch (default: 4)"
     )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the FASTA into N residue-balanced shards searched in parallel, "
+        "sharing --cpu (default: 1 = single hmmsearch)",
+    )
 
     args = parser.parse_args()
 
@@ -343,6 +354,7 @@ def main():
         coverage_min=coverage_min,
         pad=pad,
         cpu=args.cpu,
+        shards=args.shards,
     )
 
     if n_pass == 0:
@@ -25,6 +25,10 @@ import argparse
 import os
 import sys
 
+# Add scripts directory to path for fasta_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fasta_utils import FastaIndex
+
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -56,26 +60,12 @@ def read_ids(path):
     return ids
 
 
-def parse_fasta(path, keep_ids=None):
-    """Parse FASTA → dict id -> sequence (uppercase). keep_ids: set of IDs to load."""
-    seqs = {}
-    current_id = None
-    current_seq = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                if current_id is not None:
-                    if keep_ids is None or current_id in keep_ids:
-                        seqs[current_id] = "".join(current_seq).upper()
-                current_id = line[1:].split()[0]
-                current_seq = []
-            else:
-                current_seq.append(line)
-    if current_id is not None:
-        if keep_ids is None or current_id in keep_ids:
-            seqs[current_id] = "".join(current_seq).upper()
-    return seqs
+def parse_fasta(path, keep_ids):
+    """Load keep_ids from an indexed FASTA → dict id -> sequence (uppercase).
+
+    Only the requested records are read (see fasta_utils.FastaIndex).
+    """
+    return {sid: seq.upper() for sid, seq in FastaIndex(path).get(keep_ids).items()}
 
 
 def load_core_coords(path, keep_ids):
@@ -31,6 +31,12 @@ import argparse
 import os
 import sys
 import csv
+from contextlib import ExitStack
+
+# Add scripts directory to path for fasta_utils / hmmer_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fasta_utils import FastaIndex
+from hmmer_utils import load_domtbl_table
 
 
 def parse_args():
@@ -61,30 +67,22 @@ def parse_args():
     return p.parse_args()
 
 
-def parse_fasta_multi(paths):
-    """Parse multiple FASTA files, return dict of seqid -> sequence."""
+def parse_fasta_multi(paths, keep_ids):
+    """Load keep_ids from multiple indexed FASTA files, return (seqid -> sequence, n_total).
+
+    Only the requested records are read; n_total counts all records across
+    files. A seqid present in several files takes the sequence from the last.
+    """
     seqs = {}
+    n_total = 0
     for path in paths:
         if not os.path.isfile(path):
             print(f"[ERROR] FASTA not found: {path}", file=sys.stderr)
             sys.exit(1)
-        sid = None
-        chunks = []
-        with open(path) as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if line.startswith(">"):
-                    if sid is not None:
-                        seqs[sid] = "".join(chunks)
-                    sid = line[1:].split()[0]
-                    chunks = []
-                else:
-                    chunks.append(line)
-        if sid is not None:
-            seqs[sid] = "".join(chunks)
-    return seqs
+        index = FastaIndex(path)
+        n_total += len(index)
+        seqs.update(index.get(keep_ids))
+    return seqs, n_total
 
 
 def load_coords(path):
@@ -100,34 +98,33 @@ def load_coords(path):
     return coords
 
 
-def load_domtbl(path):
-    """Parse hmmsearch domtblout, return dict of seqid -> list of hit dicts."""
-    hits = {}
+# Modules cut from HMM envelopes: module column -> substring of the HMM name
+HMM_MODULES = {"ACT_domain": "ACT", "CM_domain": "CM"}
+
+
+def load_best_module_hits(path, modules):
+    """Best hit (lowest i-Evalue) per sequence for each HMM-defined module.
+
+    Returns:
+        dict module -> {seqid: (env_from, env_to)}; empty per module if no domtbl.
+    """
+    best = {mod: {} for mod in modules}
     if path is None or not os.path.isfile(path):
-        return hits
-    with open(path) as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            fields = line.split()
-            if len(fields) < 22:
-                continue
-            seq_id = fields[0]
-            hit = {
-                "target": seq_id,
-                "query": fields[3],   # HMM name (ACT, CM_1, CM_2)
-                "acc": fields[4],     # HMM accession
-                "ievalue": float(fields[12]),
-                "score": float(fields[13]),
-                "ali_from": int(fields[17]),  # alignment start on target
-                "ali_to": int(fields[18]),    # alignment end on target
-                "env_from": int(fields[19]),
-                "env_to": int(fields[20]),
-            }
-            if seq_id not in hits:
-                hits[seq_id] = []
-            hits[seq_id].append(hit)
-    return hits
+        return best
+    table = load_domtbl_table(path)
+    for mod in modules:
+        codes, rows = table.best_rows(
+            "i_evalue", mask=table.mask(query=HMM_MODULES[mod]), lowest=True
+        )
+        best[mod] = {
+            table.targets[code]: (env_from, env_to)
+            for code, env_from, env_to in zip(
+                codes.tolist(),
+                table["env_from"][rows].tolist(),
+                table["env_to"][rows].tolist(),
+            )
+        }
+    return best
 
 
 def extract_tails(coords, seqs, min_tail, output):
@@ -173,8 +170,52 @@ def parse_env_segments(seg_str):
     return segments
 
 
+def largest_internal_gap(segs):
+    """Largest gap between consecutive env segments as (start, end), or None.
+
+    Ties keep the first gap.
+    """
+    gaps = []
+    for i in range(len(segs) - 1):
+        gap_start = segs[i][1] + 1
+        gap_end = segs[i + 1][0] - 1
+        if gap_end >= gap_start:
+            gaps.append((gap_start, gap_end, gap_end - gap_start + 1))
+    if not gaps:
+        return None
+    gaps.sort(key=lambda x: x[2], reverse=True)
+    return gaps[0][0], gaps[0][1]
+
+
+def module_interval(mod, seq_id, coord_row, best_hits):
+    """1-based (start, end) of one module on one sequence, or (None, None).
+
+    Modules without a rule (unknown matrix columns) yield no interval.
+    """
+    seq_len = int(coord_row["seq_len"])
+    raw_env_start = int(coord_row["raw_env_start"])
+    raw_env_end = int(coord_row["raw_env_end"])
+
+    if mod == "N_ext":
+        return 1, raw_env_start - 1
+    if mod == "alpha2beta3_insert":
+        # Largest gap between env_segments
+        gap = largest_internal_gap(parse_env_segments(coord_row["env_segments"]))
+        return gap if gap is not None else (None, None)
+    if mod == "C_tail":
+        return raw_env_end + 1, seq_len
+    if mod in HMM_MODULES:
+        # HMM envelope of the best hit (lowest i-Evalue)
+        return best_hits[mod].get(seq_id, (None, None))
+    return None, None
+
+
 def extract_modules(coords, seqs, matrix_path, domtbl_path, outdir):
-    """Extract per-module sequences based on presence/absence matrix."""
+    """Extract per-module sequences based on presence/absence matrix.
+
+    One pass over the matrix rows writes every module's FASTA and coordinate
+    table; HMM-defined modules use best hits precomputed per sequence.
+    """
     os.makedirs(outdir, exist_ok=True)
 
     # Load presence/absence matrix
@@ -187,86 +228,49 @@ def extract_modules(coords, seqs, matrix_path, domtbl_path, outdir):
         matrix_cols = reader.fieldnames
         matrix = {row["seq_id"]: row for row in reader}
 
-    # Load HMM hits for ACT/CM coordinates
-    hmm_hits = load_domtbl(domtbl_path)
-
     # Determine which modules are present in the matrix
     module_cols = [c for c in matrix_cols if c not in ("seq_id", "boundary_confidence")]
 
-    module_stats = {}
-    for mod in module_cols:
-        fasta_path = os.path.join(outdir, f"{mod}_seqs.fasta")
-        coords_path = os.path.join(outdir, f"{mod}_domain_coords.tsv")
-        n_written = 0
-
-        with open(fasta_path, "w") as fasta_out, \
-             open(coords_path, "w") as coords_out:
-            coords_out.write("seq_id\tseq_len\tmodule\tfrom\tto\tmodule_len\n")
+    # Best HMM hits for ACT/CM coordinates
+    best_hits = load_best_module_hits(domtbl_path, [m for m in module_cols if m in HMM_MODULES])
+
+    module_stats = {mod: 0 for mod in module_cols}
+    fasta_paths = {mod: os.path.join(outdir, f"{mod}_seqs.fasta") for mod in module_cols}
+    with ExitStack() as stack:
+        fasta_out = {}
+        coords_out = {}
+        for mod in module_cols:
+            fasta_out[mod] = stack.enter_context(open(fasta_paths[mod], "w"))
+            coords_out[mod] = stack.enter_context(
+                open(os.path.join(outdir, f"{mod}_domain_coords.tsv"), "w"))
+            coords_out[mod].write("seq_id\tseq_len\tmodule\tfrom\tto\tmodule_len\n")
+
+        for seq_id, row in matrix.items():
+            if seq_id not in seqs or seq_id not in coords:
+                continue
+            full_seq = seqs[seq_id]
+            coord_row = coords[seq_id]
+            seq_len = int(coord_row["seq_len"])
 
-            for seq_id, row in matrix.items():
+            for mod in module_cols:
                 if row.get(mod, "0") != "1":
                     continue
-                if seq_id not in seqs:
-                    continue
-                if seq_id not in coords:
+                start, end = module_interval(mod, seq_id, coord_row, best_hits)
+                if start is None or end is None or end < start:
                     continue
+                # Convert to 0-indexed for slicing
+                subseq = full_seq[start - 1:end]
+                if len(subseq) > 0:
+                    out = fasta_out[mod]
+                    out.write(f">{seq_id} {mod}={start}-{end}\n")
+                    for i in range(0, len(subseq), 80):
+                        out.write(subseq[i:i+80] + "\n")
+                    coords_out[mod].write(
+                        f"{seq_id}\t{seq_len}\t{mod}\t{start}\t{end}\t{end - start + 1}\n")
+                    module_stats[mod] += 1
 
-                full_seq = seqs[seq_id]
-                coord_row = coords[seq_id]
-                seq_len = int(coord_row["seq_len"])
-                raw_env_start = int(coord_row["raw_env_start"])
-                raw_env_end = int(coord_row["raw_env_end"])
-
-                start, end = None, None
-
-                if mod == "N_ext":
-                    start = 1
-                    end = raw_env_start - 1
-                elif mod == "alpha2beta3_insert":
-                    # Extract the gap between env_segments
-                    segs = parse_env_segments(coord_row["env_segments"])
-                    if len(segs) >= 2:
-                        # Take the largest internal gap
-                        gaps = []
-                        for i in range(len(segs) - 1):
-                            gap_start = segs[i][1] + 1
-                            gap_end = segs[i + 1][0] - 1
-                            if gap_end >= gap_start:
-                                gaps.append((gap_start, gap_end, gap_end - gap_start + 1))
-                        if gaps:
-                            # Use the largest gap
-                            gaps.sort(key=lambda x: x[2], reverse=True)
-                            start, end = gaps[0][0], gaps[0][1]
-                elif mod == "C_tail":
-                    start = raw_env_end + 1
-                    end = seq_len
-                elif mod in ("ACT_domain", "CM_domain"):
-                    # Use HMM envelope coordinates
-                    if seq_id in hmm_hits:
-                        relevant = []
-                        for h in hmm_hits[seq_id]:
-                            if mod == "ACT_domain" and "ACT" in h["query"]:
-                                relevant.append(h)
-                            elif mod == "CM_domain" and "CM" in h["query"]:
-                                relevant.append(h)
-                        if relevant:
-                            # Take best hit (lowest i-Evalue)
-                            best = min(relevant, key=lambda x: x["ievalue"])
-                            start = best["env_from"]
-                            end = best["env_to"]
-
-                if start is not None and end is not None and end >= start:
-                    # Convert to 0-indexed for slicing
-                    subseq = full_seq[start - 1:end]
-                    if len(subseq) > 0:
-                        fasta_out.write(f">{seq_id} {mod}={start}-{end}\n")
-                        for i in range(0, len(subseq), 80):
-                            fasta_out.write(subseq[i:i+80] + "\n")
-                        coords_out.write(f"{seq_id}\t{seq_len}\t{mod}\t{start}\t{end}\t{end - start + 1}\n")
-                        n_written += 1
-
-        module_stats[mod] = n_written
-        print(f"[extract_module_seqs] {mod}: {n_written} sequences → {fasta_path}",
+    for mod in module_cols:
+        print(f"[extract_module_seqs] {mod}: {module_stats[mod]} sequences → {fasta_paths[mod]}",
               file=sys.stderr)
 
     return module_stats
@@ -279,9 +283,10 @@ def main():
     print(f"[extract_module_seqs] Loaded {len(coords)} coordinate records",
           file=sys.stderr)
 
-    seqs = parse_fasta_multi(args.sequences)
-    print(f"[extract_module_seqs] Loaded {len(seqs)} full-length sequences",
-          file=sys.stderr)
+    # Both modes only use sequences that have a coordinate record
+    seqs, n_total = parse_fasta_multi(args.sequences, coords)
+    print(f"[extract_module_seqs] Loaded {len(seqs)} of {n_total} full-length sequences "
+          f"(IDs in coords)", file=sys.stderr)
 
     if args.extract_tails:
         if not args.output:
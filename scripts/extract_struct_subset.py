@@ -22,6 +22,10 @@ import os
 import re
 import sys
 
+# Add scripts directory to path for msa_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from msa_utils import Alignment, read_alignment, write_alignment
+
 
 ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
 UNIREF_RE = re.compile(r"UniRef\d+_([A-Za-z0-9]+)")
@@ -39,6 +43,8 @@ def parse_args():
                    help="Column name in manifest for sequence IDs (default: rep_id)")
     p.add_argument("--no-remap", action="store_true",
                    help="Skip UniRef→AF header remapping (keep original IDs)")
+    p.add_argument("--line_width", type=int, default=60,
+                   help="Wrap output sequence lines at this width (default: 60)")
     return p.parse_args()
 
 
@@ -73,6 +79,12 @@ def is_noise_line(line):
     return False
 
 
+def clean_line(line):
+    """Strip ANSI codes; None for noise lines (see is_noise_line)."""
+    line = ANSI_RE.sub("", line)
+    return None if is_noise_line(line) else line
+
+
 def remap_header(sid):
     """UniRef90_<ACC> → AF-<ACC>-F1-model_v4."""
     m = UNIREF_RE.match(sid)
@@ -97,33 +109,23 @@ def main():
 
     os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
 
-    n_found = 0
-    writing = False
-    with open(args.input) as fin, open(args.output, "w") as fout:
-        for raw_line in fin:
-            line = ANSI_RE.sub("", raw_line.rstrip("\n"))
-
-            if is_noise_line(line):
-                continue
-
-            if line.startswith(">"):
-                sid = line[1:].split()[0]
-                writing = sid in panel_ids
-                if writing:
-                    n_found += 1
-                    out_id = sid if args.no_remap else remap_header(sid)
-                    fout.write(f">{out_id}\n")
-            elif writing:
-                # Strip spaces (shouldn't be in aligned FASTA)
-                fout.write(line.replace(" ", "") + "\n")
+    try:
+        subset = read_alignment(args.input, keep_ids=panel_ids, clean=clean_line)
+    except ValueError as exc:
+        print(f"[ERROR] {args.input}: {exc}", file=sys.stderr)
+        sys.exit(1)
+    n_found = subset.n_seqs
+    out_ids = subset.ids if args.no_remap else [remap_header(sid) for sid in subset.ids]
+    write_alignment(Alignment(out_ids, subset.matrix), args.output,
+                    line_width=args.line_width)
 
     print(f"[extract_struct_subset] Extracted {n_found}/{len(panel_ids)} "
           f"sequences → {args.output}", file=sys.stderr)
 
-    missing = panel_ids - set()  # We don't track found IDs, just count
-    if n_found < len(panel_ids):
-        print(f"[WARNING] {len(panel_ids) - n_found} panel IDs not found "
-              f"in input MSA", file=sys.stderr)
+    missing = panel_ids - set(subset.ids)
+    if missing:
+        print(f"[WARNING] {len(missing)} panel IDs not found "
+              f"in input MSA: {sorted(missing)[:5]}", file=sys.stderr)
 
     if n_found == 0:
         print("[ERROR] No sequences extracted!", file=sys.stderr)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+FASTA Utilities — Streaming records and indexed random access for sequence FASTA.
+
+Used by:
+  - Phase 1:   filter_kdops.py (record-level filtering), gate_checks.py
+  - Phase 2:   analyze_stepping_stones.py (subtype ID sets)
+  - Phase 3.6: extract_core_domains.py (hit sequences only)
+  - Phase 3.8: extract_module_seqs.py (coordinate-table IDs only)
+  - Phase 3.9: extract_linkers.py, select_sequences.py
+
+Key concepts:
+  - Record IDs are the first whitespace-delimited token of the header;
+    sequence lines are stripped of surrounding whitespace and blank lines
+    are ignored. Case is preserved (callers upper-case if they need to).
+  - FastaIndex keeps a samtools-faidx-compatible index next to the FASTA
+    (<fasta>.fai: name, length, offset, linebases, linebytes). It is built
+    with one binary scan on first use, so loading a subset costs one seek
+    and one read per requested record instead of decoding the whole file.
+  - The FASTA's (size, mtime_ns, inode) at build time is recorded in a
+    <fasta>.fai.stat sidecar, and the index is reused only while all three
+    still match; a FASTA replaced by a file with an older mtime (cp -p,
+    rsync -t, mv) or an index without a sidecar is rebuilt.
+  - A record is read as the exact byte span implied by its line geometry;
+    records whose wrapping is irregular (which samtools would reject) are
+    read line by line up to the next header instead, so any FASTA the
+    streaming parser accepts is also served by the index.
+  - With duplicate IDs, the index resolves a name to its last record, as
+    the dict-building parsers it replaces did; ids keeps first-seen order.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import NamedTuple
+
+FAI_SUFFIX = ".fai"
+STAT_SUFFIX = ".stat"
+
+
+class FaiRecord(NamedTuple):
+    name: str
+    length: int
+    offset: int
+    linebases: int
+    linebytes: int
+
+
+def _header_id(line):
+    """First whitespace-delimited token after '>' ('' for an empty header)."""
+    fields = line[1:].split()
+    return fields[0] if fields else ""
+
+
+def iter_fasta(path):
+    """Yield (id, sequence) for each record without holding the whole file."""
+    current_id = None
+    chunks = []
+    with open(path) as handle:
+        for line in handle:
+            if line.startswith(">"):
+                if current_id is not None:
+                    yield current_id, "".join(chunks)
+                current_id = _header_id(line)
+                chunks = []
+            elif current_id is not None:
+                line = line.strip()
+                if line:
+                    chunks.append(line)
+    if current_id is not None:
+        yield current_id, "".join(chunks)
+
+
+def fasta_ids(path):
+    """Record IDs in file order, from a current .fai if there is one, else from headers."""
+    path = os.fspath(path)
+    fai_path = path + FAI_SUFFIX
+    if fai_is_current(path, fai_path):
+        try:
+            return [rec.name for rec in read_fai(fai_path)]
+        except (OSError, ValueError):
+            pass
+    ids = []
+    with open(path) as handle:
+        for line in handle:
+            if line.startswith(">"):
+                ids.append(_header_id(line))
+    return ids
+
+
+def build_fai(path):
+    """Scan a FASTA once (binary) and return its FaiRecord list."""
+    records = []
+    name = None
+    length = offset = linebases = linebytes = 0
+    pos = 0
+    with open(path, "rb") as handle:
+        for line in handle:
+            if line.startswith(b">"):
+                if name is not None:
+                    records.append(FaiRecord(name, length, offset, linebases, linebytes))
+                fields = line[1:].split()
+                name = fields[0].decode() if fields else ""
+                length = linebases = linebytes = 0
+                offset = pos + len(line)
+            elif name is not None:
+                n_bases = len(line.strip())
+                if n_bases and not linebases:
+                    linebases = len(line.rstrip(b"\r\n"))
+                    linebytes = len(line)
+                length += n_bases
+            pos += len(line)
+    if name is not None:
+        records.append(FaiRecord(name, length, offset, linebases, linebytes))
+    return records
+
+
+def fasta_stamp(path):
+    """(size, mtime_ns, inode) of a file, the identity an index is tied to."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, "w") as handle:
+            handle.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def write_fai(records, fai_path, stamp=None):
+    """Write records atomically as a .fai; returns False if the location is not writable.
+
+    stamp: fasta_stamp() of the FASTA taken before it was scanned; written
+    to the <fai>.stat sidecar that fai_is_current() checks.
+    """
+    text = "".join(f"{rec.name}\t{rec.length}\t{rec.offset}\t"
+                   f"{rec.linebases}\t{rec.linebytes}\n" for rec in records)
+    if not _write_atomic(fai_path, text):
+        return False
+    if stamp is not None:
+        return _write_atomic(fai_path + STAT_SUFFIX, "\t".join(map(str, stamp)) + "\n")
+    return True
+
+
+def read_fai(fai_path):
+    """Parse a .fai into FaiRecords (extra samtools columns, e.g. FASTQ qualoffset, ignored)."""
+    records = []
+    with open(fai_path) as handle:
+        for line in handle:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 5:
+                raise ValueError(f"malformed .fai line: {line!r}")
+            records.append(FaiRecord(fields[0], *(int(v) for v in fields[1:5])))
+    return records
+
+
+def fai_is_current(path, fai_path):
+    """True if fai_path exists and its .stat sidecar matches the FASTA's current stamp."""
+    try:
+        with open(fai_path + STAT_SUFFIX) as handle:
+            stamp = tuple(int(v) for v in handle.read().split())
+        return os.path.isfile(fai_path) and stamp == fasta_stamp(path)
+    except (OSError, ValueError):
+        return False
+
+
+class FastaIndex:
+    """Random access to FASTA records through a (cached) .fai index.
+
+    fai_path defaults to <path>.fai; it is rebuilt when missing or when the
+    FASTA's size, mtime or inode differ from its .stat sidecar, and written
+    back unless write=False (a read-only location just keeps the index in
+    memory).
+    """
+
+    def __init__(self, path, fai_path=None, write=True):
+        self.path = os.fspath(path)
+        self.fai_path = fai_path or self.path + FAI_SUFFIX
+        self.records = None
+        if fai_is_current(path, self.fai_path):
+            try:
+                self.records = read_fai(self.fai_path)
+            except (OSError, ValueError):
+                self.records = None
+        if self.records is None:
+            stamp = fasta_stamp(path)
+            self.records = build_fai(path)
+            if write:
+                write_fai(self.records, self.fai_path, stamp)
+        self.index = {rec.name: rec for rec in self.records}
+        self.ids = list(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def length(self, name):
+        return self.index[name].length
+
+    def _read(self, handle, rec):
+        if rec.length == 0:
+            return ""
+        handle.seek(rec.offset)
+        if rec.linebases > 0:
+            full_lines, rest = divmod(rec.length, rec.linebases)
+            data = handle.read(full_lines * rec.linebytes + rest)
+            seq = data.translate(None, b" \t\r\n\v\f")
+            if len(seq) == rec.length and b">" not in seq:
+                return seq.decode()
+            handle.seek(rec.offset)
+        # Irregular line wrapping or embedded whitespace: read up to the next header.
+        chunks = []
+        for line in handle:
+            if line.startswith(b">"):
+                break
+            chunks.append(line.strip())
+        return b"".join(chunks).decode()
+
+    def fetch(self, name):
+        """Sequence of one record (KeyError if absent)."""
+        rec = self.index[name]
+        with open(self.path, "rb") as handle:
+            return self._read(handle, rec)
+
+    def get(self, ids):
+        """dict id -> sequence for the requested IDs present in the file.
+
+        Records are read in file-offset order through one handle; IDs not in
+        the index are skipped (compare the result's keys to detect them).
+        """
+        wanted = sorted((self.index[name] for name in set(ids) if name in self.index),
+                        key=lambda rec: rec.offset)
+        seqs = {}
+        with open(self.path, "rb") as handle:
+            for rec in wanted:
+                seqs[rec.name] = self._read(handle, rec)
+        return seqs
+
+
+def filter_fasta(input_path, output_path, remove_ids):
+    """Copy a FASTA, dropping records whose ID is in remove_ids.
+
+    Kept records are copied byte for byte (headers and line wrapping
+    unchanged). Returns (kept, removed) record counts.
+    """
+    kept = 0
+    removed = 0
+    skip = False
+    with open(input_path, "rb") as fin, open(output_path, "wb") as fout:
+        for line in fin:
+            if line.startswith(b">"):
+                fields = line[1:].split()
+                seqid = fields[0].decode() if fields else ""
+                if seqid in remove_ids:
+                    skip = True
+                    removed += 1
+                    continue
+                skip = False
+                kept += 1
+            if not skip:
+                fout.write(line)
+    return kept, removed
+
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Fetch Utilities — Concurrent, rate-limited structure-availability fetching.
+
+Used by:
+  - Phase 3.1A-1: build_panel_candidates.py (PDBe SIFTS, AFDB API, AFDB PDB files)
+
+Key concepts:
+  - Requests run on a thread pool, but every request first takes a token
+    from a shared TokenBucket, so throughput is bounded by the API rate
+    limit rather than by round-trip latency.
+  - HttpBackend keeps one keep-alive connection per host per worker thread
+    (http.client), retries 429/5xx and connection errors with exponential
+    backoff, and honours Retry-After.
+  - LocalBackend serves the same URLs from a directory tree
+    (<root>/<host>/<path>), so the pipeline can run offline or against
+    fixtures; a local HTTP stand-in works through HttpBackend with
+    --api_base.
+  - The structure_availability/raw/*.json files remain the content store:
+    a cached answer is never re-fetched, except cached transient errors
+    (status "error_*"), which are retried on the next run. Within a run,
+    every answer (errors included) is fetched at most once.
+"""
+
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+PDBE_SIFTS_URL = "https://www.ebi.ac.uk/pdbe/api/mappings/uniprot/{acc}"
+AFDB_PREDICTION_URL = "https://alphafold.ebi.ac.uk/api/prediction/{acc}"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, burst `capacity`."""
+
+    def __init__(self, rate, capacity=1.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HttpBackend:
+    """GET over http.client with per-thread keep-alive connections."""
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self, scheme, host):
+        conns = getattr(self.local, "conns", None)
+        if conns is None:
+            conns = self.local.conns = {}
+        key = (scheme, host)
+        if key not in conns:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conns[key] = cls(host, timeout=self.timeout)
+        return conns[key]
+
+    def _drop(self, scheme, host):
+        """Close and forget this thread's connection to host (next call reconnects)."""
+        conn = getattr(self.local, "conns", {}).pop((scheme, host), None)
+        if conn is not None:
+            conn.close()
+
+    def get(self, url, headers=None, _redirects=3):
+        """Return (status, body bytes, response headers dict)."""
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        for attempt in range(2):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path or "/", headers=headers or {})
+                resp = conn.getresponse()
+                body = resp.read()
+                break
+            except Exception as exc:
+                # A failed exchange leaves the connection mid-request: never reuse it
+                self._drop(parts.scheme, parts.netloc)
+                # Stale keep-alive connection or socket error: retry once on a fresh one
+                if attempt or not isinstance(exc, (OSError, http.client.ImproperConnectionState)):
+                    raise
+        resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+        if resp.status in (301, 302, 303, 307, 308) and _redirects and "location" in resp_headers:
+            return self.get(resp_headers["location"], headers, _redirects - 1)
+        return resp.status, body, resp_headers
+
+
+class LocalBackend:
+    """Serve URLs from <root>/<host>/<path>; missing files are 404s."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, url, headers=None):
+        parts = urlsplit(url)
+        path = os.path.join(self.root, parts.netloc, parts.path.lstrip("/"))
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.json")
+        if not os.path.isfile(path):
+            return 404, b"", {}
+        with open(path, "rb") as handle:
+            return 200, handle.read(), {}
+
+
+class StructureFetcher:
+    """Rate-limited, retrying, cached access to PDBe SIFTS and AFDB.
+
+    Args:
+        backend: HttpBackend or LocalBackend.
+        cache_dir: Path of the raw JSON content store.
+        rate: max requests per second across all workers.
+        workers: thread-pool size.
+        retries: attempts after the first for 429/5xx/connection errors.
+        backoff: base seconds for exponential backoff.
+        api_base: optional replacement for https://<host> in API URLs
+            (e.g. http://127.0.0.1:8000 for a local stand-in).
+    """
+
+    def __init__(self, backend, cache_dir, rate=5.0, workers=8, retries=3,
+                 backoff=1.0, api_base=None):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.bucket = TokenBucket(rate)
+        self.workers = max(1, int(workers))
+        self.retries = retries
+        self.backoff = backoff
+        self.api_base = api_base.rstrip("/") if api_base else None
+        self.n_requests = 0
+        self.lock = threading.Lock()
+        self.answers = {}  # cache_file -> answer fetched or read in this run
+
+    def _url(self, template, acc):
+        url = template.format(acc=acc)
+        if self.api_base:
+            parts = urlsplit(url)
+            url = f"{self.api_base}{parts.path}"
+        return url
+
+    def request(self, url, headers=None):
+        """GET with token-bucket pacing and retry/backoff. Returns (status, body)."""
+        last_exc = None
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            with self.lock:
+                self.n_requests += 1
+            try:
+                status, body, resp_headers = self.backend.get(url, headers)
+            except (OSError, http.client.HTTPException) as exc:
+                last_exc = exc
+            else:
+                if status not in RETRY_STATUS or attempt == self.retries:
+                    return status, body
+                retry_after = resp_headers.get("retry-after", "")
+                if retry_after.isdigit():
+                    time.sleep(float(retry_after))
+                    continue
+            if attempt < self.retries:
+                time.sleep(self.backoff * (2 ** attempt))
+        raise last_exc
+
+    # ── Content store ───────────────────────────────────────────────────────
+    def _cached(self, cache_file):
+        """This run's answer, else cached JSON; None if absent or an earlier run's transient error."""
+        if cache_file in self.answers:
+            return self.answers[cache_file]
+        if not cache_file.exists():
+            return None
+        with open(cache_file) as f:
+            data = json.load(f)
+        if str(data.get("status", "")).startswith("error_"):
+            return None
+        self.answers[cache_file] = data
+        return data
+
+    def _store(self, cache_file, data):
+        self.answers[cache_file] = data
+        tmp = cache_file.with_name(cache_file.name + f".tmp{threading.get_ident()}")
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, cache_file)
+
+    # ── API calls ───────────────────────────────────────────────────────────
+    def pdb_mapping(self, accession):
+        """PDBe SIFTS UniProt -> PDB result dict ({'pdb_ids', 'status'})."""
+        cache_file = self.cache_dir / f"{accession}_pdb.json"
+        cached = self._cached(cache_file)
+        if cached is not None:
+            return cached
+        try:
+            status, body = self.request(self._url(PDBE_SIFTS_URL, accession),
+                                        {"Accept": "application/json"})
+            if status == 200:
+                data = json.loads(body.decode())
+                pdb_ids = []
+                for uniprot_acc, mapping in data.items():
+                    for pdb_entry in mapping.get("PDB", {}):
+                        pdb_ids.append(pdb_entry.upper())
+                result = {"pdb_ids": list(set(pdb_ids)), "status": "found"}
+            elif status == 404:
+                result = {"pdb_ids": [], "status": "not_found"}
+            else:
+                result = {"pdb_ids": [], "status": f"error_{status}"}
+        except Exception as e:
+            result = {"pdb_ids": [], "status": f"error_{str(e)[:50]}"}
+        self._store(cache_file, result)
+        return result
+
+    def afdb_entry(self, accession):
+        """AFDB prediction summary dict (status 'found' / 'not_found' / 'error_*')."""
+        cache_file = self.cache_dir / f"{accession}_afdb.json"
+        cached = self._cached(cache_file)
+        if cached is not None:
+            return cached
+        try:
+            status, body = self.request(self._url(AFDB_PREDICTION_URL, accession),
+                                        {"Accept": "application/json"})
+            if status == 200:
+                data = json.loads(body.decode())
+                # data is a list of entries; take the first (latest version)
+                if isinstance(data, list) and data:
+                    entry = data[0]
+                    result = {
+                        "status": "found",
+                        "entryId": entry.get("entryId", ""),
+                        "cifUrl": entry.get("cifUrl", ""),
+                        "pdbUrl": entry.get("pdbUrl", ""),
+                        "paeImageUrl": entry.get("paeImageUrl", ""),
+                        "uniprotAccession": entry.get("uniprotAccession", accession),
+                        "uniprotId": entry.get("uniprotId", ""),
+                        "gene": entry.get("gene", ""),
+                        "organism": entry.get("organismScientificName", ""),
+                        "globalPlddt": entry.get("globalMetricValue", 0),
+                    }
+                else:
+                    result = {"status": "not_found"}
+            elif status in (404, 422):
+                result = {"status": "not_found"}
+            else:
+                result = {"status": f"error_{status}"}
+        except Exception as e:
+            result = {"status": f"error_{str(e)[:50]}"}
+        self._store(cache_file, result)
+        return result
+
+    def download(self, url, local_path):
+        """Fetch url to local_path (skipped if present). Returns path or None."""
+        if local_path.exists():
+            return local_path
+        if self.api_base:
+            url = f"{self.api_base}{urlsplit(url).path}"
+        status, body = self.request(url)
+        if status != 200:
+            raise OSError(f"HTTP {status} for {url}")
+        tmp = local_path.with_name(local_path.name + ".part")
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, local_path)
+        return local_path
+
+    # ── Batch mode ──────────────────────────────────────────────────────────
+    def map(self, func, items, key=None, label="fetch", progress_every=100):
+        """Run func(item) over items on the pool.
+
+        Returns {key(item): result}, or {index: result} (position in items)
+        without key; an exception raised by func is stored as the result.
+        """
+        results = {}
+        items = list(items)
+        if not items:
+            return results
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(func, item): i for i, item in enumerate(items)}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                result_key = key(items[i]) if key else i
+                try:
+                    results[result_key] = future.result()
+                except Exception as e:
+                    results[result_key] = e
+                if done % progress_every == 0 or done == len(items):
+                    print(f"  [{label}] {done}/{len(items)} "
+                          f"({self.n_requests} requests, {time.time() - t0:.1f}s)")
+        return results
+
+    def prefetch(self, accessions):
+        """Fill the content store with SIFTS + AFDB answers for all accessions."""
+        jobs = [(kind, acc) for acc in accessions for kind in ("pdb", "afdb")]
+
+        def run(job):
+            kind, acc = job
+            return self.pdb_mapping(acc) if kind == "pdb" else self.afdb_entry(acc)
+
+        return self.map(run, jobs, key=lambda job: job, label="availability")
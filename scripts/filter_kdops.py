@@ -19,44 +19,20 @@ import argparse
 import os
 import sys
 
+# Add scripts directory to path for fasta_utils / hmmer_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fasta_utils import filter_fasta
+from hmmer_utils import best_full_score
+
 
 def parse_domtbl(path):
     """Parse domtblout, return dict: seqid -> best full-sequence score (column 7, 0-indexed)."""
-    best = {}
-    with open(path) as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            cols = line.split()
-            if len(cols) < 22:
-                continue
-            seqid = cols[0]
-            score = float(cols[7])  # full sequence score
-            if seqid not in best or score > best[seqid]:
-                best[seqid] = score
-    return best
+    return best_full_score(path)
 
 
 def write_filtered_fasta(input_path, output_path, remove_ids):
     """Write FASTA excluding remove_ids. Returns (kept, removed) counts."""
-    kept = 0
-    removed = 0
-    skip = False
-    with open(input_path) as fin, open(output_path, "w") as fout:
-        for line in fin:
-            if line.startswith(">"):
-                seqid = line[1:].split()[0]
-                if seqid in remove_ids:
-                    skip = True
-                    removed += 1
-                else:
-                    skip = False
-                    kept += 1
-                    fout.write(line)
-            else:
-                if not skip:
-                    fout.write(line)
-    return kept, removed
+    return filter_fasta(input_path, output_path, remove_ids)
 
 
 def main():
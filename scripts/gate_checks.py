@@ -13,6 +13,10 @@ import argparse
 import os
 import sys
 
+# Add scripts directory to path for fasta_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fasta_utils import fasta_ids
+
 
 def load_ids_from_file(path):
     """Load IDs from a text file (one per line)."""
@@ -27,13 +31,7 @@ def load_ids_from_file(path):
 
 def load_ids_from_fasta(path):
     """Load sequence IDs from a FASTA file."""
-    ids = set()
-    with open(path) as f:
-        for line in f:
-            if line.startswith(">"):
-                seqid = line[1:].split()[0]
-                ids.add(seqid)
-    return ids
+    return set(fasta_ids(path))
 
 
 def gate_a(workdir):
@@ -4,7 +4,8 @@ HMMER Utilities — Reusable functions for domtblout parsing and hit stitching.
 
 Used by:
   - Phase 2.1: qc_length_coverage.py (merged HMM coverage for Type II)
-  - Phase 3.6: extract_core_domains.py (hit stitching for core domain extraction)
+  - Phase 3.6: extract_core_domains.py (hit stitching for core domain extraction,
+    sharded hmmsearch)
 
 Key concepts:
   - "Hit stitching" merges multiple domain hits from the same query sequence
@@ -13,23 +14,290 @@ Key concepts:
   - Coverage is computed in HMM coordinate space (hmm_from/hmm_to), not
     sequence coordinate space, to correctly measure how much of the model
     is covered.
+  - A domtblout is tokenized once into a columnar DomtblTable (NumPy arrays
+    plus a target-name index) and cached next to the source as
+    <domtbl>.cols.npz, keyed by the source md5. Every parser below is a
+    view over that table, so re-runs skip text parsing entirely.
+  - merge_intervals_batch() / stitch_domtbl() stitch every target of a
+    table at once: intervals are sorted by (target, start), a running
+    maximum of interval ends (offset per target so one cumulative max
+    spans all of them) marks where a new merged interval opens, and
+    coverage is a per-target bincount of merged lengths.
+  - run_hmmsearch_sharded() splits the target FASTA into residue-balanced
+    contiguous shards and runs one hmmsearch per shard concurrently.
+    Sequence E-values use -Z <total sequences>; domain c-/i-Evalues are
+    rescaled from each shard's domZ to the summed domZ. Each shard reports
+    domains against its own (smaller) domZ, so rows whose rescaled
+    i-Evalue exceeds the run's --domE are dropped and the "#"/"of" domain
+    counts renumbered; the merged domtblout then matches a single run up
+    to HMMER's 2-digit E-value printing (domains within that rounding of
+    --domE can differ).
 """
 
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from build_artifact_manifest import Md5Cache
+
+# Numeric domtblout columns kept in the columnar cache: name -> (index, dtype)
+DOMTBL_COLUMNS = {
+    "tlen": (2, np.int32),
+    "qlen": (5, np.int32),
+    "full_evalue": (6, np.float64),
+    "full_score": (7, np.float64),
+    "dom_index": (9, np.int32),
+    "c_evalue": (11, np.float64),
+    "i_evalue": (12, np.float64),
+    "dom_score": (13, np.float64),
+    "hmm_from": (15, np.int32),
+    "hmm_to": (16, np.int32),
+    "ali_from": (17, np.int32),
+    "ali_to": (18, np.int32),
+    "env_from": (19, np.int32),
+    "env_to": (20, np.int32),
+}
+DOMTBL_CACHE_VERSION = 1
+SOURCE_MD5_CACHE = "source.md5cache.tsv"
+
+
+def md5_of_path(path, chunk_size=1 << 20):
+    """md5 hex digest of a file, read in 1 MB chunks."""
+    digest = hashlib.md5()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_npz_cache(cache_path, source_key, version):
+    """Arrays of an .npz cache written by save_npz_cache, or None to rebuild.
+
+    None is returned for a missing file, a different source_key/version,
+    and a truncated or corrupt file (e.g. left by an interrupted writer).
+    """
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as npz:
+            if str(npz["source_key"]) != source_key or int(npz["version"]) != version:
+                return None
+            return {name: npz[name] for name in npz.files}
+    except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def save_npz_cache(cache_path, source_key, version, **arrays):
+    """Write arrays as an .npz cache atomically; returns False if not writable.
+
+    The temporary file name is unique per process and thread, so concurrent
+    writers of the same cache never share it; the last os.replace wins.
+    """
+    tmp_path = f"{cache_path}.tmp{os.getpid()}-{threading.get_ident()}.npz"
+    try:
+        np.savez(tmp_path, source_key=np.array(source_key), version=np.array(version),
+                 **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def save_npy_atomic(path, array):
+    """np.save to path via a per-process, per-thread temporary name and os.replace."""
+    tmp_path = f"{path[:-len('.npy')]}.tmp{os.getpid()}-{threading.get_ident()}.npy"
+    try:
+        np.save(tmp_path, array)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def cached_source_md5(path, cache_root):
+    """md5 of path, reused from <cache_root>/source.md5cache.tsv while its stat is unchanged.
+
+    The lookup is keyed by (path, size, mtime_ns, inode) as in the artifact
+    manifest, so a cache hit costs one stat instead of reading the file.
+    """
+    hasher = Md5Cache(Path(cache_root) / SOURCE_MD5_CACHE)
+    digest = hasher.md5(path)
+    parent = os.path.dirname(os.path.abspath(cache_root))
+    if hasher.n_hashed and (os.path.isdir(cache_root) or os.access(parent, os.W_OK)):
+        hasher.save()
+    return digest
 
-def parse_domtbl_all_domains(path, ievalue_max=1e-5, min_hmm_span=30):
-    """Parse domtblout, return all qualifying domain hits per sequence.
 
-    Args:
-        path: Path to HMMER --domtblout output file.
-        ievalue_max: Maximum individual domain E-value to retain (default 1e-5).
-        min_hmm_span: Minimum HMM span (hmm_to - hmm_from + 1) to retain (default 30).
+def prune_npy_cache(cache_root, source_path, keep_md5, marker):
+    """Best-effort removal of cache entries built from earlier versions of source_path.
 
-    Returns:
-        dict: seqid -> list of domain dicts, each with keys:
-              full_score, dom_score, i_evalue,
-              hmm_from, hmm_to, env_from, env_to
+    Only files older than the source itself are removed, and each entry's
+    marker file (the one whose presence means "complete") goes first, so a
+    concurrent reader sees the entry as absent rather than partial. On POSIX
+    an unlinked file stays valid for any process that already mapped it.
     """
-    domains = {}
+    try:
+        source_mtime = os.stat(source_path).st_mtime_ns
+        names = os.listdir(cache_root)
+    except OSError:
+        return
+    stale = []
+    for name in names:
+        if name.startswith(keep_md5 + ".") or name == SOURCE_MD5_CACHE:
+            continue
+        try:
+            if os.stat(os.path.join(cache_root, name)).st_mtime_ns < source_mtime:
+                stale.append(name)
+        except OSError:
+            continue
+    stale.sort(key=lambda name: not name.endswith(marker))
+    for name in stale:
+        try:
+            os.remove(os.path.join(cache_root, name))
+        except OSError:
+            pass
+
+
+class DomtblTable:
+    """Columnar view of one domtblout file.
+
+    Attributes:
+        targets: list of unique target (sequence) names, in first-seen order.
+        queries: list of unique query (HMM) names, in first-seen order.
+        query_accs: HMM accession per entry of `queries`.
+        target_idx, query_idx: int32 per-row codes into targets/queries.
+        cols: dict column name -> NumPy array (see DOMTBL_COLUMNS).
+        source_md5: md5 of the domtblout the table was built from.
+    """
+
+    def __init__(self, targets, queries, query_accs, target_idx, query_idx, cols,
+                 source_md5=""):
+        self.targets = list(targets)
+        self.queries = list(queries)
+        self.query_accs = list(query_accs)
+        self.target_idx = np.asarray(target_idx, dtype=np.int32)
+        self.query_idx = np.asarray(query_idx, dtype=np.int32)
+        self.cols = cols
+        self.source_md5 = source_md5
+        self.target_index = {name: i for i, name in enumerate(self.targets)}
+        # Rows grouped by target (stable, so file order is kept within a target)
+        self._order = np.argsort(self.target_idx, kind="stable")
+        self._starts = np.searchsorted(
+            self.target_idx[self._order], np.arange(len(self.targets) + 1)
+        )
+
+    def __len__(self):
+        return len(self.target_idx)
+
+    def __getitem__(self, column):
+        return self.cols[column]
+
+    def hmm_span(self):
+        return self.cols["hmm_to"] - self.cols["hmm_from"] + 1
+
+    def mask(self, ievalue_max=None, min_hmm_span=None, query=None):
+        """Boolean row mask for common hit filters (all optional).
+
+        `query` keeps rows whose HMM name contains the given substring.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if ievalue_max is not None:
+            keep &= self.cols["i_evalue"] <= ievalue_max
+        if min_hmm_span is not None:
+            keep &= self.hmm_span() >= min_hmm_span
+        if query is not None:
+            codes = [i for i, name in enumerate(self.queries) if query in name]
+            keep &= np.isin(self.query_idx, codes)
+        return keep
+
+    def rows_for(self, seqid):
+        """Row indices (file order) of all hits on one target sequence."""
+        i = self.target_index.get(seqid)
+        if i is None:
+            return np.empty(0, dtype=np.int64)
+        return self._order[self._starts[i]:self._starts[i + 1]]
+
+    def best_rows(self, column, mask=None, lowest=False):
+        """Row of the highest (lowest=True: lowest) `column` value per target
+        (first row wins ties).
+
+        Returns:
+            (target_codes, rows): targets ordered by first appearance.
+        """
+        rows = np.arange(len(self))
+        if mask is not None:
+            rows = rows[mask]
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int32), rows
+        t = self.target_idx[rows]
+        values = self.cols[column][rows]
+        order = np.lexsort((rows, values if lowest else -values, t))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = t[order][1:] != t[order][:-1]
+        best = rows[order[first]]
+        codes = self.target_idx[best]
+        # Keep dict-building callers in first-seen target order
+        seen = np.argsort(codes, kind="stable")
+        return codes[seen], best[seen]
+
+    def row_dict(self, row, fields):
+        """One row as a plain dict (fields: columns, 'target', 'query', 'query_acc')."""
+        out = {}
+        for name in fields:
+            if name == "target":
+                out[name] = self.targets[self.target_idx[row]]
+            elif name == "query":
+                out[name] = self.queries[self.query_idx[row]]
+            elif name == "query_acc":
+                out[name] = self.query_accs[self.query_idx[row]]
+            else:
+                out[name] = self.cols[name][row].item()
+        return out
+
+    def grouped_dicts(self, fields, mask=None, renames=None):
+        """seqid -> list of hit dicts (file order), for legacy callers."""
+        renames = renames or {}
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        targets = self.target_idx[rows]
+        query = self.query_idx[rows]
+        values = {name: self.cols[name][rows].tolist() for name in fields
+                  if name not in ("target", "query", "query_acc")}
+        grouped = {}
+        for k, code in enumerate(targets.tolist()):
+            hit = {}
+            for name in fields:
+                key = renames.get(name, name)
+                if name == "target":
+                    hit[key] = self.targets[code]
+                elif name == "query":
+                    hit[key] = self.queries[query[k]]
+                elif name == "query_acc":
+                    hit[key] = self.query_accs[query[k]]
+                else:
+                    hit[key] = values[name][k]
+            grouped.setdefault(self.targets[code], []).append(hit)
+        return grouped
+
+
+def _parse_domtbl_text(path):
+    targets, queries, query_accs = {}, {}, []
+    target_idx, query_idx = [], []
+    raw = {name: [] for name in DOMTBL_COLUMNS}
     with open(path) as f:
         for line in f:
             if line.startswith("#"):
@@ -37,38 +305,94 @@ def parse_domtbl_all_domains(path, ievalue_max=1e-5, min_hmm_span=30):
             parts = line.rstrip().split(maxsplit=22)
             if len(parts) < 22:
                 continue
+            target_idx.append(targets.setdefault(parts[0], len(targets)))
+            if parts[3] not in queries:
+                queries[parts[3]] = len(queries)
+                query_accs.append(parts[4])
+            query_idx.append(queries[parts[3]])
+            for name, (col, _) in DOMTBL_COLUMNS.items():
+                raw[name].append(parts[col])
+    cols = {name: np.array(raw[name], dtype=np.float64).astype(dtype)
+            for name, (_, dtype) in DOMTBL_COLUMNS.items()}
+    return list(targets), list(queries), query_accs, target_idx, query_idx, cols
 
-            seqid = parts[0]
-            full_score = float(parts[7])
-            i_evalue = float(parts[12])
-            dom_score = float(parts[13])
-            hmm_from = int(parts[15])
-            hmm_to = int(parts[16])
-            env_from = int(parts[19])
-            env_to = int(parts[20])
-
-            # Filter: skip weak/tiny hits
-            hmm_span = hmm_to - hmm_from + 1
-            if i_evalue > ievalue_max:
-                continue
-            if hmm_span < min_hmm_span:
-                continue
 
-            dom = {
-                "full_score": full_score,
-                "dom_score": dom_score,
-                "i_evalue": i_evalue,
-                "hmm_from": hmm_from,
-                "hmm_to": hmm_to,
-                "env_from": env_from,
-                "env_to": env_to,
-            }
+def domtbl_cache_path(path, cache_dir=None):
+    base = os.path.basename(path) + ".cols.npz"
+    return os.path.join(cache_dir or os.path.dirname(path) or ".", base)
+
+
+def load_domtbl_table(path, cache=True, cache_dir=None):
+    """Load a domtblout as a DomtblTable, via the md5-keyed columnar cache.
+
+    Args:
+        path: HMMER --domtblout file.
+        cache: read/write <path>.cols.npz (default True). A cache whose
+            stored md5 differs from the current file is rebuilt.
+        cache_dir: directory for the cache file (default: next to `path`).
+
+    Returns:
+        DomtblTable
+    """
+    source_md5 = md5_of_path(path)
+    cache_path = domtbl_cache_path(path, cache_dir)
+    npz = load_npz_cache(cache_path, source_md5, DOMTBL_CACHE_VERSION) if cache else None
+    if npz is not None and all(name in npz for name in DOMTBL_COLUMNS):
+        return DomtblTable(
+            npz["targets"].tolist(), npz["queries"].tolist(),
+            npz["query_accs"].tolist(), npz["target_idx"], npz["query_idx"],
+            {name: npz[name] for name in DOMTBL_COLUMNS},
+            source_md5,
+        )
+
+    targets, queries, query_accs, target_idx, query_idx, cols = _parse_domtbl_text(path)
+    table = DomtblTable(targets, queries, query_accs, target_idx, query_idx, cols,
+                        source_md5)
+    if cache:
+        # A read-only results directory just skips the write
+        save_npz_cache(
+            cache_path, source_md5, DOMTBL_CACHE_VERSION,
+            targets=np.array(targets, dtype=str),
+            queries=np.array(queries, dtype=str),
+            query_accs=np.array(query_accs, dtype=str),
+            target_idx=table.target_idx,
+            query_idx=table.query_idx,
+            **cols,
+        )
+    return table
+
+
+def best_full_score(path):
+    """Best full-sequence score (column 7) per target sequence.
+
+    Returns:
+        dict: seqid -> full_score
+    """
+    table = load_domtbl_table(path)
+    codes, rows = table.best_rows("full_score")
+    scores = table["full_score"][rows].tolist()
+    return {table.targets[c]: s for c, s in zip(codes.tolist(), scores)}
+
+
+def parse_domtbl_all_domains(path, ievalue_max=1e-5, min_hmm_span=30):
+    """Parse domtblout, return all qualifying domain hits per sequence.
 
-            if seqid not in domains:
-                domains[seqid] = []
-            domains[seqid].append(dom)
+    Args:
+        path: Path to HMMER --domtblout output file.
+        ievalue_max: Maximum individual domain E-value to retain (default 1e-5).
+        min_hmm_span: Minimum HMM span (hmm_to - hmm_from + 1) to retain (default 30).
 
-    return domains
+    Returns:
+        dict: seqid -> list of domain dicts, each with keys:
+              full_score, dom_score, i_evalue,
+              hmm_from, hmm_to, env_from, env_to
+    """
+    table = load_domtbl_table(path)
+    keep = table.mask(ievalue_max=ievalue_max, min_hmm_span=min_hmm_span)
+    return table.grouped_dicts(
+        ["full_score", "dom_score", "i_evalue", "hmm_from", "hmm_to", "env_from", "env_to"],
+        mask=keep,
+    )
 
 
 def parse_domtbl_best_domain(path):
@@ -77,25 +401,12 @@ def parse_domtbl_best_domain(path):
     Returns:
         dict: seqid -> (dom_score, hmm_from, hmm_to, env_from, env_to)
     """
-    best = {}
-    with open(path) as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
-            parts = line.rstrip().split(maxsplit=22)
-            if len(parts) < 22:
-                continue
-
-            seqid = parts[0]
-            dom_score = float(parts[13])
-            hmm_from = int(parts[15])
-            hmm_to = int(parts[16])
-            env_from = int(parts[19])
-            env_to = int(parts[20])
-
-            if seqid not in best or dom_score > best[seqid][0]:
-                best[seqid] = (dom_score, hmm_from, hmm_to, env_from, env_to)
-    return best
+    table = load_domtbl_table(path)
+    codes, rows = table.best_rows("dom_score")
+    fields = [table[name][rows].tolist()
+              for name in ("dom_score", "hmm_from", "hmm_to", "env_from", "env_to")]
+    return {table.targets[c]: values
+            for c, values in zip(codes.tolist(), zip(*fields))}
 
 
 def merge_intervals(intervals, merge_gap=0):
@@ -162,3 +473,315 @@ def union_coverage_env(domains, merge_gap=0):
     total = sum(e - s + 1 for s, e in merged)
 
     return total, merged
+
+
+# ── Batched stitching ───────────────────────────────────────────────────────
+def merge_intervals_batch(seq_idx, starts, ends, merge_gap=0):
+    """merge_intervals() for many sequences at once.
+
+    Args:
+        seq_idx: int array, sequence code of each interval.
+        starts, ends: int arrays of 1-based inclusive interval bounds.
+        merge_gap: Maximum gap between intervals to still merge (default 0).
+
+    Returns:
+        (seq, start, end) int64 arrays of merged intervals, sorted by
+        sequence then start.
+    """
+    seq_idx = np.asarray(seq_idx, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(seq_idx) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    order = np.lexsort((ends, starts, seq_idx))
+    q, s, e = seq_idx[order], starts[order], ends[order]
+
+    # Running max of `end` within each sequence: offset every sequence above
+    # the previous one's coordinate range so a single cumulative max works.
+    lo = min(int(s.min()), int(e.min()))
+    span = max(int(s.max()), int(e.max())) - lo + 1
+    run_max = np.maximum.accumulate((e - lo) + q * span) - q * span + lo
+
+    new_seq = np.ones(len(q), dtype=bool)
+    new_seq[1:] = q[1:] != q[:-1]
+    opens = new_seq.copy()
+    opens[1:] |= s[1:] > run_max[:-1] + merge_gap + 1
+    first = np.flatnonzero(opens)
+    return q[first], s[first], np.maximum.reduceat(e, first)
+
+
+def interval_offsets(merged_seq, n_seqs):
+    """Start index of each sequence's merged intervals (length n_seqs + 1)."""
+    return np.searchsorted(merged_seq, np.arange(n_seqs + 1))
+
+
+class StitchedHits:
+    """Hit stitching for every target of a DomtblTable, computed in one pass.
+
+    Attributes (indexed by target code, i.e. DomtblTable.targets order):
+        n_domains: qualifying hits per target.
+        coverage: union HMM coverage fraction (capped at 1), as union_coverage_hmm().
+        hmm, env: (seq, start, end) merged HMM / envelope intervals.
+        hmm_offsets, env_offsets: per-target slices into hmm / env.
+    """
+
+    def __init__(self, seq_idx, hmm_from, hmm_to, env_from, env_to, n_seqs, hmm_len,
+                 merge_gap=0, env_merge_gap=0):
+        seq_idx = np.asarray(seq_idx, dtype=np.int64)
+        self.n_domains = np.bincount(seq_idx, minlength=n_seqs)
+        self.hmm = merge_intervals_batch(seq_idx, hmm_from, hmm_to, merge_gap)
+        self.env = merge_intervals_batch(seq_idx, env_from, env_to, env_merge_gap)
+        self.hmm_offsets = interval_offsets(self.hmm[0], n_seqs)
+        self.env_offsets = interval_offsets(self.env[0], n_seqs)
+        hmm_q, hmm_s, hmm_e = self.hmm
+        cov_len = np.bincount(hmm_q, weights=hmm_e - hmm_s + 1, minlength=n_seqs)
+        self.coverage = np.minimum(cov_len, hmm_len) / hmm_len
+
+    def _slice(self, intervals, offsets, code):
+        lo, hi = offsets[code], offsets[code + 1]
+        return [[s, e] for s, e in zip(intervals[1][lo:hi].tolist(), intervals[2][lo:hi].tolist())]
+
+    def hmm_intervals(self, code):
+        """Merged HMM intervals of one target as [[start, end], ...]."""
+        return self._slice(self.hmm, self.hmm_offsets, code)
+
+    def env_intervals(self, code):
+        """Merged envelope intervals of one target as [[start, end], ...]."""
+        return self._slice(self.env, self.env_offsets, code)
+
+
+def stitch_domtbl(table, hmm_len, mask=None, merge_gap=0, env_merge_gap=0):
+    """StitchedHits over the rows of `table` selected by `mask` (all rows if None)."""
+    rows = np.arange(len(table)) if mask is None else np.flatnonzero(mask)
+    return StitchedHits(
+        table.target_idx[rows],
+        table["hmm_from"][rows], table["hmm_to"][rows],
+        table["env_from"][rows], table["env_to"][rows],
+        len(table.targets), hmm_len,
+        merge_gap=merge_gap, env_merge_gap=env_merge_gap,
+    )
+
+
+# ── Sharded hmmsearch ───────────────────────────────────────────────────────
+DOMZ_RE = re.compile(r"^Domain search space\s+\(domZ\):\s+(\S+)", re.M)
+DOMTBL_FIXED_FIELDS = 22
+DOMTBL_DOM_NUMBER_COLUMNS = (9, 10)  # "#" and "of"
+HMMSEARCH_DEFAULT_DOME = 10.0
+# Options that make domain reporting score-based, so domZ cannot change it
+SCORE_REPORTING_OPTIONS = ("--domT", "--cut_ga", "--cut_nc", "--cut_tc")
+
+
+def fasta_residue_counts(path):
+    """Residue count of every record in a FASTA file, in file order (streamed)."""
+    counts = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                counts.append(0)
+            elif counts:
+                counts[-1] += len(line.strip())
+    return counts
+
+
+def write_fasta_shards(path, n_shards, outdir):
+    """Split a FASTA into contiguous shards of roughly equal residue count.
+
+    Records keep their input order. Fewer than n_shards files are written
+    when there are fewer records than shards.
+
+    Returns:
+        (list of shard paths, total number of sequences)
+    """
+    counts = fasta_residue_counts(path)
+    total = sum(counts)
+    n_shards = max(1, min(n_shards, len(counts)))
+    target = total / n_shards if total else 1.0
+    shard_of = []
+    cum = 0
+    for count in counts:
+        # A record goes to the shard its residue midpoint falls in
+        shard_of.append(min(n_shards - 1, int((cum + count / 2) / target)))
+        cum += count
+
+    paths = []
+    handle = None
+    current = -1
+    record = -1
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                record += 1
+                if shard_of[record] != current:
+                    if handle is not None:
+                        handle.close()
+                    current = shard_of[record]
+                    paths.append(os.path.join(outdir, f"shard_{len(paths):03d}.fasta"))
+                    handle = open(paths[-1], "w")
+            if handle is not None:
+                handle.write(line)
+    if handle is not None:
+        handle.close()
+    return paths, len(counts)
+
+
+def domain_reporting_evalue(extra_args=()):
+    """hmmsearch's domain reporting i-Evalue threshold (--domE) for these options.
+
+    Accepts both "--domE X" and "--domE=X" (the last one given wins).
+    None when reporting is score-based (--domT or a --cut_* model cutoff).
+    """
+    args = [str(arg) for arg in extra_args]
+    names = [arg.split("=", 1)[0] for arg in args]
+    if any(option in names for option in SCORE_REPORTING_OPTIONS):
+        return None
+    dom_evalue = HMMSEARCH_DEFAULT_DOME
+    for i, arg in enumerate(args):
+        if arg.startswith("--domE="):
+            dom_evalue = float(arg.split("=", 1)[1])
+        elif arg == "--domE" and i + 1 < len(args):
+            dom_evalue = float(args[i + 1])
+    return dom_evalue
+
+
+def _replace_columns(line, values):
+    """Replace domtblout columns {index: text}, right-aligned in the original widths."""
+    spans = [m.span() for _, m in zip(range(DOMTBL_FIXED_FIELDS), re.finditer(r"\S+", line))]
+    out = []
+    prev = 0
+    for col in sorted(values):
+        start, end = spans[col]
+        out.append(line[prev:start])
+        out.append(values[col].rjust(end - start))
+        prev = end
+    out.append(line[prev:])
+    return "".join(out)
+
+
+def merge_domtbl_shards(shard_domtbls, shard_domz, out_path, target_file=None,
+                        dom_evalue=HMMSEARCH_DEFAULT_DOME):
+    """Merge per-shard domtblouts into one, rescaling domain E-values to the total domZ.
+
+    Targets are ordered by full-sequence score (descending) as in a single
+    hmmsearch run; each target's domain rows keep their order. Rows whose
+    rescaled i-Evalue exceeds dom_evalue (the run's --domE; None for
+    score-based reporting) would not have been reported by a single run and
+    are dropped; the "#"/"of" columns are renumbered over the kept rows.
+    Shard E-values are printed to 2 digits, so a domain within that
+    rounding of domE can still be kept or dropped differently.
+    The comment header and footer are taken from the first shard, with
+    "# Target file:" set to `target_file` if given.
+
+    Returns:
+        total domZ
+    """
+    total_domz = sum(shard_domz)
+    c_col = DOMTBL_COLUMNS["c_evalue"][0]
+    i_col = DOMTBL_COLUMNS["i_evalue"][0]
+    num_col, of_col = DOMTBL_DOM_NUMBER_COLUMNS
+    header, footer, rows = [], [], []
+    for k, (path, domz) in enumerate(zip(shard_domtbls, shard_domz)):
+        factor = total_domz / domz if domz else 1.0
+        seen_rows = False
+        kept = []
+        with open(path) as f:
+            for line in f:
+                if line.startswith("#"):
+                    if k == 0:
+                        (footer if seen_rows else header).append(line)
+                    continue
+                parts = line.split(maxsplit=DOMTBL_FIXED_FIELDS)
+                if len(parts) < DOMTBL_FIXED_FIELDS:
+                    continue
+                seen_rows = True
+                i_evalue = float(parts[i_col]) * factor
+                if dom_evalue is not None and i_evalue > dom_evalue:
+                    continue
+                kept.append((line, parts, i_evalue))
+
+        n_reported = {}
+        for _, parts, _ in kept:
+            n_reported[parts[0]] = n_reported.get(parts[0], 0) + 1
+        first_row = {}
+        dom_number = {}
+        for line, parts, i_evalue in kept:
+            target = parts[0]
+            dom_number[target] = dom_number.get(target, 0) + 1
+            values = {}
+            if factor != 1.0:
+                values[c_col] = f"{float(parts[c_col]) * factor:.2g}"
+                values[i_col] = f"{i_evalue:.2g}"
+            if (int(parts[num_col]), int(parts[of_col])) != (dom_number[target],
+                                                               n_reported[target]):
+                values[num_col] = str(dom_number[target])
+                values[of_col] = str(n_reported[target])
+            if values:
+                line = _replace_columns(line, values)
+            first = first_row.setdefault(target, len(rows))
+            full_score = float(parts[DOMTBL_COLUMNS["full_score"][0]])
+            rows.append((-full_score, k, first, len(rows), line))
+    rows.sort()
+    if target_file is not None:
+        footer = [f"# Target file:     {target_file}\n" if line.startswith("# Target file:")
+                  else line for line in footer]
+    with open(out_path, "w") as out:
+        out.writelines(header)
+        out.writelines(row[-1] for row in rows)
+        out.writelines(footer)
+    return total_domz
+
+
+def run_hmmsearch_sharded(hmm_path, fasta_path, domtblout_path, shards, cpu=4,
+                          extra_args=(), tmp_dir=None):
+    """hmmsearch over residue-balanced FASTA shards in parallel, merged into one domtblout.
+
+    Args:
+        hmm_path: query HMM.
+        fasta_path: target FASTA (whole database).
+        domtblout_path: merged --domtblout output.
+        shards: number of shards.
+        cpu: total CPU budget; shards run min(shards, cpu) at a time with
+            hmmsearch --cpu max(1, cpu // concurrent shards) each.
+        extra_args: further hmmsearch options (e.g. ["--noali"]); a --domE
+            here also sets the merge's domain reporting threshold.
+        tmp_dir: parent directory for the shard files (default: next to
+            domtblout_path).
+
+    Returns:
+        dict with n_shards, n_seqs (-Z), domZ and cpu_per_shard.
+
+    Raises:
+        RuntimeError: if any shard's hmmsearch fails.
+    """
+    tmp_parent = tmp_dir or os.path.dirname(os.path.abspath(domtblout_path))
+    with tempfile.TemporaryDirectory(prefix=".hmmsearch_shards_", dir=tmp_parent) as tmp:
+        shard_fastas, n_seqs = write_fasta_shards(fasta_path, shards, tmp)
+        workers = max(1, min(len(shard_fastas), cpu))
+        cpu_per_shard = max(1, cpu // workers)
+
+        def search(shard_fasta):
+            stem = os.path.splitext(shard_fasta)[0]
+            cmd = ["hmmsearch", "-Z", str(n_seqs), "--cpu", str(cpu_per_shard),
+                   "-o", stem + ".out", "--domtblout", stem + ".domtbl",
+                   *extra_args, hmm_path, shard_fasta]
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True)
+            except OSError as exc:
+                raise RuntimeError(f"could not run hmmsearch: {exc}") from exc
+            if result.returncode != 0:
+                raise RuntimeError(f"hmmsearch failed on {os.path.basename(shard_fasta)}:\n"
+                                   f"{result.stderr}")
+            with open(stem + ".out") as f:
+                match = DOMZ_RE.search(f.read())
+            if match is None:
+                raise RuntimeError(f"no domZ line in hmmsearch output for "
+                                   f"{os.path.basename(shard_fasta)}")
+            return stem + ".domtbl", float(match.group(1))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(search, shard_fastas))
+        domz = merge_domtbl_shards([r[0] for r in results], [r[1] for r in results],
+                                   domtblout_path, target_file=fasta_path,
+                                   dom_evalue=domain_reporting_evalue(extra_args))
+    return {"n_shards": len(shard_fastas), "n_seqs": n_seqs, "domZ": domz,
+            "cpu_per_shard": cpu_per_shard}
@@ -2,22 +2,172 @@
 """
 mad_root_fast.py — Efficient MAD rooting for large trees.
 
-Uses ete3's fast tree traversal if available, otherwise BioPython.
-The key optimization: instead of deepcopy+re-root per branch,
-compute root-to-tip distances via DFS traversal and branch-shift
-algebra to evaluate each candidate root position in O(n) time.
+Default backend ("linear") scores every branch of the tree in one O(n)
+sweep, with no re-rooting at all:
 
-For the DAH7PS 9,393-tip tree, this should complete in minutes, not hours.
+  1. Postorder pass: per subtree, accumulate tip count, sum and sum of
+     squares of node-to-tip distances.
+  2. Preorder pass: propagate the same three moments for the tips
+     *outside* each subtree, measured from the parent node.
+  3. For a root placed at distance x above node v on branch (v, parent),
+     the root-to-tip sum is linear in x and the sum of squares quadratic,
+     so rho(x) = sd/mean has a closed-form optimum on [0, branch_length].
+
+rho is the same clock-deviation proxy used by the S4 scenarios
+(coefficient of variation of root-to-tip distances). The per-branch table
+(--rho_table) also reports rho at the branch midpoint, which is what
+ete3 set_outgroup() evaluated in the legacy backends.
+
+The legacy ete3/BioPython backends are kept for provenance of S4a/S4b.
+
+For the DAH7PS 9,393-tip tree, the linear backend completes in seconds.
 
 Usage:
     python scripts/mad_root_fast.py \
         --input results/04_phylogeny_asr/CoreTree_rooted_ingroup.treefile \
-        --output results/04_phylogeny_asr/CoreTree_rooted_MAD_ingroup.treefile
+        --output results/04_phylogeny_asr/CoreTree_rooted_MAD_ingroup.treefile \
+        --rho_table results/04_phylogeny_asr/CoreTree_rooted_MAD_ingroup.rho.tsv
 """
-import argparse, sys, os
+import argparse, sys, os, time
 import numpy as np
 from io import StringIO
 
+# Add scripts directory to path for tree_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tree_utils import load_tree
+
+# ── Linear-time backend ──────────────────────────────────────────────────────
+def score_branches_linear(tree):
+    """Two-pass root-to-tip moments and closed-form rho for every branch.
+
+    Args:
+        tree: unrooted tree_utils.CompactTree (root of degree >= 3).
+
+    Returns:
+        dict of per-node arrays (index = child node of the branch):
+        n_in, x_opt, rho_opt, rho_mid; plus n_tips. Root entries are NaN.
+    """
+    parent = tree.parent
+    b = tree.lengths()
+    n_tot = tree.n_tips
+
+    # Postorder: moments of tips inside subtree(v), measured from v
+    cnt = tree.is_tip.astype(np.float64)
+    s1 = np.zeros(tree.n_nodes)
+    s2 = np.zeros(tree.n_nodes)
+    for level in reversed(tree.levels[1:]):
+        p, bl = parent[level], b[level]
+        c, a, q = cnt[level], s1[level], s2[level]
+        np.add.at(s2, p, q + 2.0 * bl * a + c * bl * bl)
+        np.add.at(s1, p, a + c * bl)
+        np.add.at(cnt, p, c)
+
+    # Preorder: moments of tips outside subtree(v), measured from parent(v)
+    # (out_*) and from v itself (up_*)
+    out_c, out_s, out_q = np.zeros_like(cnt), np.zeros_like(cnt), np.zeros_like(cnt)
+    up_c, up_s, up_q = np.zeros_like(cnt), np.zeros_like(cnt), np.zeros_like(cnt)
+    for level in tree.levels[1:]:
+        p, bl = parent[level], b[level]
+        c, a, q = cnt[level], s1[level], s2[level]
+        oc = up_c[p] + cnt[p] - c
+        os_ = up_s[p] + s1[p] - (a + c * bl)
+        oq = up_q[p] + s2[p] - (q + 2.0 * bl * a + c * bl * bl)
+        out_c[level], out_s[level], out_q[level] = oc, os_, oq
+        up_c[level] = oc
+        up_s[level] = os_ + oc * bl
+        up_q[level] = oq + 2.0 * bl * os_ + oc * bl * bl
+
+    # Root at distance x above v: sum = a0 + a1*x, sumsq = q0 + q1*x + q2*x^2
+    a0 = s1 + out_s + out_c * b
+    a1 = cnt - out_c
+    q0 = s2 + out_q + 2.0 * b * out_s + out_c * b * b
+    q1 = 2.0 * s1 - 2.0 * out_s - 2.0 * out_c * b
+    q2 = float(n_tot)
+
+    def rho_at(x):
+        total = a0 + a1 * x
+        sumsq = q0 + q1 * x + q2 * x * x
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = n_tot * sumsq / (total * total) - 1.0
+        return np.sqrt(np.clip(ratio, 0.0, None))
+
+    # d/dx [sumsq / sum^2] = 0 is linear in x (the x^2 terms cancel)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_star = (2.0 * a1 * q0 - q1 * a0) / (2.0 * q2 * a0 - q1 * a1)
+    x_star = np.where(np.isfinite(x_star), np.clip(x_star, 0.0, b), 0.0)
+    xs = np.vstack([x_star, np.zeros_like(b), b])
+    cands = np.vstack([rho_at(x) for x in xs])
+    pick = np.argmin(np.where(np.isnan(cands), np.inf, cands), axis=0)
+    cols = np.arange(tree.n_nodes)
+    rho_opt = cands[pick, cols]
+    x_opt = xs[pick, cols]
+    rho_mid = rho_at(b / 2.0)
+
+    for arr in (rho_opt, x_opt, rho_mid):
+        arr[0] = np.nan
+    return {"n_in": cnt, "x_opt": x_opt, "rho_opt": rho_opt, "rho_mid": rho_mid,
+            "n_tips": n_tot}
+
+
+def write_rho_table(path, tree, scores, keep):
+    """Per-branch rho table, sorted by rho_opt (best first)."""
+    n = scores["n_tips"]
+    blen = tree.lengths()
+    idx = np.arange(1, tree.n_nodes)
+    idx = idx[np.argsort(scores["rho_opt"][idx], kind="stable")]
+    with open(path, "w") as f:
+        f.write("node\tparent\tlabel\tn_desc\tsplit_min\tbranch_length\t"
+                "x_opt\trho_opt\trho_mid\tcandidate\n")
+        for v in idx:
+            n_in = int(scores["n_in"][v])
+            f.write(
+                f"{v}\t{tree.parent[v]}\t{tree.labels[v]}\t{n_in}\t{min(n_in, n - n_in)}\t"
+                f"{blen[v]:.6g}\t{scores['x_opt'][v]:.6g}\t"
+                f"{scores['rho_opt'][v]:.6f}\t{scores['rho_mid'][v]:.6f}\t"
+                f"{'yes' if keep[v] else 'no'}\n"
+            )
+
+
+def mad_root_linear(input_path, output_path, rho_table=None):
+    """MAD rooting by exact O(n) scoring of every branch."""
+    t0 = time.time()
+    tree = load_tree(input_path).unrooted()
+    print(f"[S4-linear] Tree loaded: {tree.n_tips} tips in {time.time() - t0:.2f}s")
+
+    t1 = time.time()
+    scores = score_branches_linear(tree)
+    n = scores["n_tips"]
+    n_in = scores["n_in"]
+    blen = tree.lengths()
+    # Same candidate set as the legacy backends: non-trivial splits, positive length
+    keep = (tree.parent >= 0) & (blen > 0) & (n_in >= 2) & (n - n_in >= 2)
+    print(f"[S4-linear] Scored {tree.n_nodes - 1} branches "
+          f"({int(keep.sum())} candidates) in {time.time() - t1:.2f}s")
+
+    if not keep.any():
+        print("[S4] WARNING: No candidate branch, keeping input rooting")
+        with open(input_path) as f_in, open(output_path, "w") as f_out:
+            f_out.write(f_in.read())
+        return float("nan")
+
+    best = int(np.argmin(np.where(keep, scores["rho_opt"], np.inf)))
+    best_rho = float(scores["rho_opt"][best])
+    x = float(scores["x_opt"][best])
+    print(f"[S4] Best rho = {best_rho:.6f} (midpoint rho = {scores['rho_mid'][best]:.6f})")
+    print(f"[S4] Root placed {x:.6g} above node {best} on branch of length {blen[best]:.6g}")
+
+    rooted = tree.rerooted(best, x)
+    sizes = [len(rooted.leaf_names(c)) for c in rooted.children(0)]
+    print(f"[S4] Root split sizes: {sizes}")
+    with open(output_path, "w") as f:
+        f.write(rooted.to_newick(internal_labels=False) + "\n")
+    print(f"[S4] MAD rooted tree written to: {output_path}")
+    if rho_table:
+        write_rho_table(rho_table, tree, scores, keep)
+        print(f"[S4] Per-branch rho table written to: {rho_table}")
+    return best_rho
+
+
 def try_ete3():
     try:
         from ete3 import Tree
@@ -216,6 +366,12 @@ def main():
     parser = argparse.ArgumentParser(description="Fast MAD rooting for large trees")
     parser.add_argument("--input", required=True)
     parser.add_argument("--output", required=True)
+    parser.add_argument("--backend", choices=["linear", "ete3", "biopython"],
+                        default="linear",
+                        help="linear = exact O(n) search over all branches (default); "
+                             "ete3/biopython = legacy per-branch re-rooting")
+    parser.add_argument("--rho_table", default=None,
+                        help="Optional per-branch rho TSV (linear backend only)")
     args = parser.parse_args()
 
     if not os.path.exists(args.input):
@@ -224,7 +380,10 @@ def main():
 
     os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
 
-    if try_ete3():
+    if args.backend == "linear":
+        print("Using linear backend (exact, all branches)")
+        mad_root_linear(args.input, args.output, args.rho_table)
+    elif args.backend == "ete3" and try_ete3():
         print("Using ete3 backend (fast)")
         mad_root_ete3(args.input, args.output)
     else:
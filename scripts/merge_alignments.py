@@ -5,9 +5,10 @@ Merge outgroup sequences into an existing trimmed core MSA.
 The outgroup sequences are aligned to the full (untrimmed) core HMM profile
 and therefore have the same number of columns as core_global_matchonly.afa.
 This script identifies which columns of the full alignment were retained in
-the trimmed alignment (core_tree.afa or core_asr.afa) by comparing a
-reference sequence present in both, then subsets the outgroup to the same
-columns.
+the trimmed alignment (core_tree.afa or core_asr.afa) from the trimmer's
+.cols.tsv report, or by matching whole columns across all shared sequences,
+verifies the mapping against every shared sequence, then subsets the
+outgroup to the same columns.
 
 Phase 4.1 of the DAH7PS V5.0 SOP.
 
@@ -16,13 +17,27 @@ Usage:
         --core       results/03_msa_core/core_tree.afa \
         --core_full  results/03_msa_core/core_global_matchonly.afa \
         --outgroup   results/04_phylogeny_asr/kdops_core_aligned.afa \
-        --output     results/04_phylogeny_asr/core_with_outgroup.afa
+        --output     results/04_phylogeny_asr/core_with_outgroup.afa \
+        [--cols_report results/03_msa_core/core_tree.cols.tsv]
 """
 
 import argparse
 import os
 import sys
 
+import numpy as np
+
+# Add scripts directory to path for msa_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from msa_utils import (
+    Alignment,
+    column_map_mismatches,
+    map_kept_columns,
+    read_alignment,
+    read_kept_columns,
+    write_alignment,
+)
+
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -36,58 +51,40 @@ def parse_args():
                    help="Outgroup MSA aligned to same HMM (521 cols)")
     p.add_argument("--output", required=True,
                    help="Output merged MSA (core + outgroup, trimmed cols)")
+    p.add_argument("--cols_report", default=None,
+                   help="minimal_trim column report for --core "
+                        "(default: <core>.cols.tsv if present; otherwise the "
+                        "mapping is derived from the alignments)")
     return p.parse_args()
 
 
-def parse_msa(path):
-    seqs = {}
-    order = []
-    cur_id = None
-    cur_seq = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                if cur_id is not None:
-                    seqs[cur_id] = "".join(cur_seq)
-                    order.append(cur_id)
-                cur_id = line[1:].split()[0]
-                cur_seq = []
-            else:
-                cur_seq.append(line)
-    if cur_id is not None:
-        seqs[cur_id] = "".join(cur_seq)
-        order.append(cur_id)
-    return seqs, order
-
-
-def find_kept_columns(full_seq, trimmed_seq):
-    """Find which columns of full_seq map to trimmed_seq.
-
-    Returns list of 0-based column indices in the full alignment
-    that correspond to the trimmed alignment columns.
+def find_kept_columns(full, core, report_path=None):
+    """Find which columns of the full alignment survive in the trimmed core.
+
+    Uses the trimmer's .cols.tsv report when given, otherwise matches whole
+    columns over all sequences shared by both alignments.
+
+    Returns:
+        (kept, source): 0-based column indices in the full alignment (None if
+        no mapping was found), and a label for how they were obtained.
     """
-    kept = []
-    t_pos = 0
-    t_len = len(trimmed_seq)
-    for f_pos in range(len(full_seq)):
-        if t_pos >= t_len:
-            break
-        if full_seq[f_pos].upper() == trimmed_seq[t_pos].upper():
-            kept.append(f_pos)
-            t_pos += 1
-    if t_pos != t_len:
-        return None  # matching failed
-    return kept
-
-
-def write_fasta(records, path):
-    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-    with open(path, "w") as f:
-        for sid, seq in records:
-            f.write(f">{sid}\n")
-            for i in range(0, len(seq), 60):
-                f.write(seq[i:i+60] + "\n")
+    if report_path:
+        try:
+            kept, n_cols = read_kept_columns(report_path)
+        except ValueError as exc:
+            print(f"[ERROR] {exc}", file=sys.stderr)
+            sys.exit(1)
+        if n_cols != full.n_cols or len(kept) != core.n_cols:
+            print(f"[ERROR] {report_path} describes {n_cols} → {len(kept)} cols, "
+                  f"but full/core have {full.n_cols} → {core.n_cols} cols.", file=sys.stderr)
+            sys.exit(1)
+        return kept, f"report {os.path.basename(report_path)}"
+
+    kept, n_ambiguous = map_kept_columns(full, core)
+    if kept is not None and n_ambiguous:
+        print(f"[WARNING] {n_ambiguous} trimmed columns match more than one identical "
+              f"full column; the earliest in order was used.", file=sys.stderr)
+    return kept, "column matching"
 
 
 def main():
@@ -98,69 +95,67 @@ def main():
             print(f"[ERROR] File not found: {path}", file=sys.stderr)
             sys.exit(1)
 
-    core_seqs, core_order = parse_msa(args.core)
-    full_seqs, _ = parse_msa(args.core_full)
-    og_seqs, og_order = parse_msa(args.outgroup)
+    try:
+        core = read_alignment(args.core)
+        full = read_alignment(args.core_full)
+        og = read_alignment(args.outgroup)
+    except ValueError as exc:
+        print(f"[ERROR] {exc}", file=sys.stderr)
+        sys.exit(1)
 
-    core_width = len(next(iter(core_seqs.values())))
-    full_width = len(next(iter(full_seqs.values())))
-    og_width = len(next(iter(og_seqs.values())))
+    core_width = core.n_cols
+    full_width = full.n_cols
+    og_width = og.n_cols
 
-    print(f"[merge_alignments] core: {len(core_seqs)} seqs × {core_width} cols", file=sys.stderr)
-    print(f"[merge_alignments] full: {len(full_seqs)} seqs × {full_width} cols", file=sys.stderr)
-    print(f"[merge_alignments] outgroup: {len(og_seqs)} seqs × {og_width} cols", file=sys.stderr)
+    print(f"[merge_alignments] core: {core.n_seqs} seqs × {core_width} cols", file=sys.stderr)
+    print(f"[merge_alignments] full: {full.n_seqs} seqs × {full_width} cols", file=sys.stderr)
+    print(f"[merge_alignments] outgroup: {og.n_seqs} seqs × {og_width} cols", file=sys.stderr)
 
     if og_width != full_width:
         print(f"[ERROR] Outgroup ({og_width} cols) and full ({full_width} cols) "
               f"must have the same number of columns.", file=sys.stderr)
         sys.exit(1)
 
-    # Find column mapping: use first sequence in core as reference
-    kept_cols = None
-    ref_id = None
-    for sid in core_order:
-        if sid in full_seqs:
-            ref_id = sid
-            kept_cols = find_kept_columns(full_seqs[sid], core_seqs[sid])
-            if kept_cols is not None and len(kept_cols) == core_width:
-                break
-            kept_cols = None
+    # Find column mapping
+    report_path = args.cols_report
+    if report_path is None:
+        default_report = args.core.rsplit(".", 1)[0] + ".cols.tsv"
+        if os.path.isfile(default_report):
+            report_path = default_report
+    elif not os.path.isfile(report_path):
+        print(f"[ERROR] File not found: {report_path}", file=sys.stderr)
+        sys.exit(1)
 
+    kept_cols, source = find_kept_columns(full, core, report_path)
     if kept_cols is None:
         print(f"[ERROR] Could not determine column mapping between full and trimmed MSA. "
-              f"No reference sequence matched.", file=sys.stderr)
+              f"No consistent column match across shared sequences.", file=sys.stderr)
         sys.exit(1)
 
     print(f"[merge_alignments] Column mapping: {full_width} → {len(kept_cols)} cols "
-          f"(reference: {ref_id})", file=sys.stderr)
-
-    # Validate mapping with 2 more reference sequences
-    n_validated = 0
-    for sid in core_order:
-        if sid == ref_id or sid not in full_seqs:
-            continue
-        trimmed = "".join(full_seqs[sid][c] for c in kept_cols)
-        if trimmed.upper() == core_seqs[sid].upper():
-            n_validated += 1
-        else:
-            print(f"[WARNING] Column mapping validation failed for {sid}", file=sys.stderr)
-        if n_validated >= 2:
-            break
-
-    if n_validated < 2:
-        print(f"[WARNING] Could only validate column mapping with {n_validated} "
-              f"additional sequences.", file=sys.stderr)
-
-    print(f"[merge_alignments] Column mapping validated with {n_validated + 1} sequences",
-          file=sys.stderr)
+          f"(from {source})", file=sys.stderr)
+
+    # Validate mapping against every sequence present in both core and full
+    n_shared = sum(1 for sid in core.ids if sid in full)
+    mismatched = column_map_mismatches(full, core, kept_cols)
+    if mismatched:
+        print(f"[ERROR] Column mapping does not reproduce the trimmed core for "
+              f"{len(mismatched)}/{n_shared} shared sequences "
+              f"(e.g. {', '.join(mismatched[:5])}).", file=sys.stderr)
+        sys.exit(1)
+    if n_shared == 0:
+        print("[WARNING] No sequences shared by core and full MSA; "
+              "column mapping could not be validated.", file=sys.stderr)
+    else:
+        print(f"[merge_alignments] Column mapping validated with {n_shared} sequences",
+              file=sys.stderr)
 
     # Apply column mapping to outgroup sequences
-    og_trimmed = {}
-    for sid in og_order:
-        og_trimmed[sid] = "".join(og_seqs[sid][c] for c in kept_cols)
+    og_trimmed = og.select_columns(kept_cols)
 
     # Check for ID conflicts
-    overlap = set(core_order) & set(og_order)
+    og_order = og.ids
+    overlap = set(core.ids) & set(og_order)
     if overlap:
         # If outgroup IDs are from --mapali skeleton, remove them
         print(f"[merge_alignments] {len(overlap)} IDs overlap between core and outgroup "
@@ -169,11 +164,13 @@ def main():
         og_order = [sid for sid in og_order if sid not in overlap]
 
     # Write merged output: core first, then outgroup
-    records = [(sid, core_seqs[sid]) for sid in core_order]
-    records += [(sid, og_trimmed[sid]) for sid in og_order]
-
-    write_fasta(records, args.output)
-    total = len(records)
+    merged = Alignment(
+        core.ids + og_order,
+        np.vstack([core.matrix, og_trimmed.select_rows(og_order).matrix]),
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_alignment(merged, args.output, line_width=60)
+    total = merged.n_seqs
     print(f"[merge_alignments] Output: {total} seqs × {core_width} cols → {args.output}",
           file=sys.stderr)
 
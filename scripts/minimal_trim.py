@@ -13,50 +13,159 @@ Outputs:
   - Trimmed alignment (FASTA)
   - Column retention report (TSV): original_col, gap_fraction, kept
   - Summary statistics to stderr
+
+A precomputed keep-mask (--mask: core_columns.mask or a prior .cols.tsv)
+skips the gap statistics entirely; --mmap serves the alignment from an
+md5-keyed memory-mapped matrix cache, so repeated trims of the same large
+alignment do not re-parse the FASTA.
+
+Threshold sweep (trimming sensitivity analysis, one pass over the alignment):
+    python scripts/minimal_trim.py sweep \
+        --input results/03_msa_core/core_global_matchonly.afa \
+        --thresholds 0.5,0.7,0.8,0.9,0.95 \
+        --out_prefix results/03_msa_core/trim_sweep [--write_alignments]
+
+  - <prefix>_summary.tsv: kept columns and residue retention per threshold
+  - <prefix>_per_sequence.tsv: retained-residue fraction per sequence
+  - optionally <prefix>_gap<t>.afa + .cols.tsv for each threshold
 """
 
 import argparse
 import os
 import sys
 
+import numpy as np
+
+# Add scripts directory to path for msa_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from msa_utils import load_alignment_cached, read_column_mask, write_alignment
+
+
+def write_column_report(path, gap_fracs, keep):
+    """Column report TSV: original_col_1based, gap_fraction (or NA), kept."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    n_cols = len(keep)
+    gf_text = (["NA"] * n_cols if gap_fracs is None
+               else [f"{gf:.6f}" for gf in gap_fracs.tolist()])
+    with open(path, "w") as f:
+        f.write("original_col_1based\tgap_fraction\tkept\n")
+        for i, (gf, k) in enumerate(zip(gf_text, keep.tolist())):
+            f.write(f"{i+1}\t{gf}\t{'Y' if k else 'N'}\n")
+
+
+def load_input(path, mmap):
+    """Load the input alignment or exit with an error."""
+    if not os.path.isfile(path):
+        print(f"[ERROR] File not found: {path}", file=sys.stderr)
+        sys.exit(1)
+    # Parse (rectangularity is validated while loading)
+    try:
+        aln = load_alignment_cached(path, cache=mmap)
+    except ValueError as exc:
+        print(f"[ERROR] {exc}", file=sys.stderr)
+        sys.exit(1)
+    if aln.n_seqs == 0:
+        print("[ERROR] No sequences found in input.", file=sys.stderr)
+        sys.exit(1)
+    return aln
+
 
-def parse_fasta(path):
-    """Parse aligned FASTA, return list of (seqid, sequence) tuples."""
-    records = []
-    current_id = None
-    current_seq = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                if current_id is not None:
-                    records.append((current_id, "".join(current_seq)))
-                current_id = line[1:].split()[0]
-                current_seq = []
-            else:
-                current_seq.append(line)
-    if current_id is not None:
-        records.append((current_id, "".join(current_seq)))
-    return records
-
-
-def compute_gap_fractions(records):
-    """Compute per-column gap fraction."""
-    if not records:
-        return []
-    n_seqs = len(records)
-    n_cols = len(records[0][1])
-    gap_counts = [0] * n_cols
-    for _, seq in records:
-        for i, ch in enumerate(seq):
-            if ch == "-" or ch == ".":
-                gap_counts[i] += 1
-    return [c / n_seqs for c in gap_counts]
+def sweep(argv):
+    """`sweep` subcommand: evaluate several gap thresholds from one set of column counts."""
+    parser = argparse.ArgumentParser(
+        prog="minimal_trim.py sweep",
+        description="Gap-threshold sweep: kept columns and per-sequence residue "
+                    "retention for several thresholds from a single pass (Phase 3.7).",
+    )
+    parser.add_argument("--input", required=True, help="Input aligned FASTA")
+    parser.add_argument(
+        "--thresholds",
+        required=True,
+        help="Comma-separated gap-fraction thresholds, e.g. 0.5,0.8,0.9,0.95",
+    )
+    parser.add_argument("--out_prefix", required=True, help="Output prefix")
+    parser.add_argument(
+        "--write_alignments",
+        action="store_true",
+        help="Also write <prefix>_gap<t>.afa and its .cols.tsv for every threshold",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Load the alignment through the md5-keyed memory-mapped cache",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        thresholds = sorted({float(t) for t in args.thresholds.split(",") if t.strip()})
+    except ValueError:
+        print(f"[ERROR] Invalid --thresholds: {args.thresholds}", file=sys.stderr)
+        sys.exit(1)
+    if not thresholds:
+        print("[ERROR] --thresholds is empty.", file=sys.stderr)
+        sys.exit(1)
+
+    aln = load_input(args.input, args.mmap)
+    n_seqs, n_cols = aln.n_seqs, aln.n_cols
+    print(f"[minimal_trim] Input: {n_seqs} seqs × {n_cols} cols", file=sys.stderr)
+
+    # One pass: column gap fractions, then per-sequence residues per threshold
+    gap_fracs = aln.gap_fractions()
+    masks = np.array([gap_fracs <= t for t in thresholds])
+    total_residues = aln.residue_counts()
+    kept_residues = aln.kept_residue_counts(masks)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        retained = np.where(total_residues[:, None] > 0,
+                            kept_residues / total_residues[:, None], 1.0)
+
+    out_dir = os.path.dirname(args.out_prefix) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    summary_path = f"{args.out_prefix}_summary.tsv"
+    per_seq_path = f"{args.out_prefix}_per_sequence.tsv"
+    labels = [f"{t:g}" for t in thresholds]
+
+    with open(summary_path, "w") as f:
+        f.write("gap_col_threshold\tn_cols_kept\tn_cols_removed\tpct_removed\t"
+                "mean_gap_kept\tmax_gap_kept\tresidues_retained\t"
+                "mean_seq_retained\tmin_seq_retained\tmedian_seq_retained\n")
+        for j, (label, keep) in enumerate(zip(labels, masks)):
+            n_kept = int(keep.sum())
+            kept_gf = gap_fracs[keep]
+            col = retained[:, j]
+            f.write(
+                f"{label}\t{n_kept}\t{n_cols - n_kept}\t"
+                f"{(n_cols - n_kept) / n_cols * 100:.2f}\t"
+                + (f"{kept_gf.mean():.6f}\t{kept_gf.max():.6f}\t" if n_kept else "NA\tNA\t")
+                + f"{kept_residues[:, j].sum() / max(int(total_residues.sum()), 1):.6f}\t"
+                f"{col.mean():.6f}\t{col.min():.6f}\t{np.median(col):.6f}\n"
+            )
+            print(f"[minimal_trim] gap <= {label}: {n_kept} / {n_cols} cols kept, "
+                  f"mean per-sequence residue retention {col.mean():.4f}", file=sys.stderr)
+    print(f"[minimal_trim] Wrote {summary_path}", file=sys.stderr)
+
+    with open(per_seq_path, "w") as f:
+        f.write("seq_id\tn_residues\t" + "\t".join(f"retained_gap{l}" for l in labels) + "\n")
+        for i, sid in enumerate(aln.ids):
+            f.write(f"{sid}\t{total_residues[i]}\t"
+                    + "\t".join(f"{v:.6f}" for v in retained[i].tolist()) + "\n")
+    print(f"[minimal_trim] Wrote {per_seq_path}", file=sys.stderr)
+
+    if args.write_alignments:
+        for label, keep in zip(labels, masks):
+            out_path = f"{args.out_prefix}_gap{label}.afa"
+            write_alignment(aln, out_path, columns=keep)
+            write_column_report(out_path.rsplit(".", 1)[0] + ".cols.tsv", gap_fracs, keep)
+            print(f"[minimal_trim] Wrote {out_path}", file=sys.stderr)
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        sweep(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
-        description="Minimal MSA trimming: remove columns exceeding gap-fraction threshold (Phase 3.7)."
+        description="Minimal MSA trimming: remove columns exceeding gap-fraction threshold (Phase 3.7).",
+        epilog="Multi-threshold sweep: minimal_trim.py sweep --help",
     )
     parser.add_argument(
         "--input", required=True, help="Input aligned FASTA"
@@ -73,45 +182,47 @@ def main():
     parser.add_argument(
         "--report",
         default=None,
-        help="Output column report TSV (optional; default: <output>.cols.tsv)",
+        help="Output column report TSV (optional; default: <output>.cols.tsv; "
+             "with --mask, written only when given)",
+    )
+    parser.add_argument(
+        "--mask",
+        default=None,
+        help="Precomputed keep-mask (core_columns.mask 0/1 string or a .cols.tsv "
+             "report); overrides --gap_col_threshold and skips gap statistics",
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Load the alignment through the md5-keyed memory-mapped cache "
+             "(<input>.npycache), building it on first use",
     )
 
     args = parser.parse_args()
 
-    if not os.path.isfile(args.input):
-        print(f"[ERROR] File not found: {args.input}", file=sys.stderr)
-        sys.exit(1)
-
     report_path = args.report or args.output.rsplit(".", 1)[0] + ".cols.tsv"
+    aln = load_input(args.input, args.mmap)
 
-    # Parse
-    records = parse_fasta(args.input)
-    if not records:
-        print("[ERROR] No sequences found in input.", file=sys.stderr)
-        sys.exit(1)
-
-    n_seqs = len(records)
-    n_cols = len(records[0][1])
+    n_seqs = aln.n_seqs
+    n_cols = aln.n_cols
     print(f"[minimal_trim] Input: {n_seqs} seqs × {n_cols} cols", file=sys.stderr)
-    print(f"[minimal_trim] Gap threshold: > {args.gap_col_threshold}", file=sys.stderr)
-
-    # Validate alignment
-    for sid, seq in records:
-        if len(seq) != n_cols:
-            print(
-                f"[ERROR] Sequence {sid} has {len(seq)} cols, expected {n_cols}.",
-                file=sys.stderr,
-            )
-            sys.exit(1)
-
-    # Compute gap fractions
-    gap_fracs = compute_gap_fractions(records)
 
-    # Determine kept columns
-    kept_cols = [
-        i for i, gf in enumerate(gap_fracs) if gf <= args.gap_col_threshold
-    ]
-    n_kept = len(kept_cols)
+    if args.mask:
+        # Precomputed mask: no gap statistics needed
+        try:
+            keep = read_column_mask(args.mask, n_cols)
+        except (OSError, ValueError) as exc:
+            print(f"[ERROR] {exc}", file=sys.stderr)
+            sys.exit(1)
+        gap_fracs = None
+        print(f"[minimal_trim] Column mask: {args.mask}", file=sys.stderr)
+    else:
+        print(f"[minimal_trim] Gap threshold: > {args.gap_col_threshold}", file=sys.stderr)
+        # Compute gap fractions
+        gap_fracs = aln.gap_fractions()
+        # Determine kept columns
+        keep = gap_fracs <= args.gap_col_threshold
+    n_kept = int(keep.sum())
     n_removed = n_cols - n_kept
     print(
         f"[minimal_trim] Columns kept: {n_kept} / {n_cols} "
@@ -121,31 +232,25 @@ def main():
 
     # Extract kept columns
     os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
-    kept_set = set(kept_cols)
-    with open(args.output, "w") as f:
-        for sid, seq in records:
-            trimmed = "".join(seq[i] for i in kept_cols)
-            f.write(f">{sid}\n{trimmed}\n")
+    write_alignment(aln, args.output, columns=keep)
     print(f"[minimal_trim] Wrote {args.output}", file=sys.stderr)
 
-    # Write column report
-    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
-    with open(report_path, "w") as f:
-        f.write("original_col_1based\tgap_fraction\tkept\n")
-        for i, gf in enumerate(gap_fracs):
-            f.write(f"{i+1}\t{gf:.6f}\t{'Y' if i in kept_set else 'N'}\n")
-    print(f"[minimal_trim] Wrote {report_path}", file=sys.stderr)
+    # Write column report (with --mask only on explicit --report, so a
+    # .cols.tsv used as the mask is never overwritten by its own copy)
+    if gap_fracs is not None or args.report:
+        write_column_report(report_path, gap_fracs, keep)
+        print(f"[minimal_trim] Wrote {report_path}", file=sys.stderr)
 
     # Summary
-    if kept_cols:
-        kept_gap_fracs = [gap_fracs[i] for i in kept_cols]
+    if n_kept and gap_fracs is not None:
+        kept_gap_fracs = gap_fracs[keep].tolist()
         mean_gap = sum(kept_gap_fracs) / len(kept_gap_fracs)
         max_gap = max(kept_gap_fracs)
         print(
             f"[minimal_trim] Kept columns — mean gap: {mean_gap:.4f}, max gap: {max_gap:.4f}",
             file=sys.stderr,
         )
-    else:
+    elif not n_kept:
         print("[WARNING] All columns removed!", file=sys.stderr)
         sys.exit(1)
 
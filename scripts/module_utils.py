@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Module Utilities — Per-sequence module features shared by annotation and trait recoding.
+
+Used by:
+  - Phase 3.8: annotate_modules.py (legacy 5-module strict/relaxed matrices)
+  - Trait encoding: recode_module_features.py (orthogonal feature matrix)
+
+Key concepts:
+  - The raw evidence for every module call is a handful of numbers per
+    sequence: N-terminal extension, largest α2β3 insert gap and C-terminal
+    extension (from core_domain_coords.tsv), and the best (lowest) i-Evalue
+    of the ACT / CM HMM hits (from module_hits.domtbl). These are computed
+    once into a ModuleFeatureTable of NumPy columns in coords-row order.
+  - The table is cached next to the coords file as
+    <coords>.features.npz, keyed by the md5 of both inputs, so a new
+    threshold set or encoding re-reads only the cache.
+  - Presence calls are vectorized comparisons on the columns; a missing HMM
+    hit is NaN and never passes an i-Evalue threshold.
+"""
+
+from __future__ import annotations
+
+import csv
+import os
+
+import numpy as np
+
+from hmmer_utils import load_domtbl_table, load_npz_cache, md5_of_path, save_npz_cache
+
+FEATURE_CACHE_VERSION = 1
+FEATURE_INT_COLUMNS = ("seq_len", "n_ext_len", "insert_len", "c_ext_len")
+# HMM evidence columns: column name -> substring of the HMM (query) name
+HMM_FEATURES = {"act_ievalue": "ACT", "cm_ievalue": "CM"}
+LEGACY_MODULES = ["N_ext", "alpha2beta3_insert", "ACT_domain", "CM_domain", "C_tail"]
+
+
+class ModuleFeatureTable:
+    """Columnar raw module features, one row per core_domain_coords.tsv row.
+
+    Attributes:
+        seq_ids: list of sequence IDs (coords order).
+        cols: dict column -> NumPy array (FEATURE_INT_COLUMNS as int64,
+            HMM_FEATURES as float64 with NaN for "no hit").
+        n_hits, n_hit_seqs: domtbl rows and distinct hit targets (0 if no domtbl).
+    """
+
+    def __init__(self, seq_ids, cols, n_hits=0, n_hit_seqs=0):
+        self.seq_ids = list(seq_ids)
+        self.cols = cols
+        self.n_hits = int(n_hits)
+        self.n_hit_seqs = int(n_hit_seqs)
+
+    def __len__(self):
+        return len(self.seq_ids)
+
+    def __getitem__(self, column):
+        return self.cols[column]
+
+
+def parse_env_segments(seg_str):
+    """Parse '5-271;274-399' → [(5,271), (274,399)]."""
+    segments = []
+    for part in seg_str.split(";"):
+        part = part.strip()
+        if "-" in part:
+            s, e = part.split("-", 1)
+            segments.append((int(s), int(e)))
+    return segments
+
+
+def largest_gap(seg_str):
+    """Largest gap between consecutive env_segments (0 with fewer than two segments)."""
+    segs = parse_env_segments(seg_str)
+    if len(segs) < 2:
+        return 0
+    return max(segs[i + 1][0] - segs[i][1] - 1 for i in range(len(segs) - 1))
+
+
+def _build_features(coords_path, domtbl_path):
+    with open(coords_path) as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+    seq_ids = [row["seq_id"] for row in rows]
+    n = len(rows)
+    seq_len = np.fromiter((int(r["seq_len"]) for r in rows), dtype=np.int64, count=n)
+    env_start = np.fromiter((int(r["raw_env_start"]) for r in rows), dtype=np.int64, count=n)
+    env_end = np.fromiter((int(r["raw_env_end"]) for r in rows), dtype=np.int64, count=n)
+    cols = {
+        "seq_len": seq_len,
+        "n_ext_len": env_start - 1,
+        "insert_len": np.fromiter((largest_gap(r["env_segments"]) for r in rows),
+                                  dtype=np.int64, count=n),
+        "c_ext_len": seq_len - env_end,
+    }
+
+    n_hits = n_hit_seqs = 0
+    for column in HMM_FEATURES:
+        cols[column] = np.full(n, np.nan)
+    if domtbl_path is not None:
+        table = load_domtbl_table(domtbl_path)
+        n_hits, n_hit_seqs = len(table), len(table.targets)
+        # Coords row -> target code (rows without any hit map to an extra NaN slot)
+        codes = np.fromiter((table.target_index.get(sid, len(table.targets)) for sid in seq_ids),
+                            dtype=np.int64, count=n)
+        for column, token in HMM_FEATURES.items():
+            best = np.full(len(table.targets) + 1, np.nan)
+            targets, rows_best = table.best_rows("i_evalue", mask=table.mask(query=token),
+                                                 lowest=True)
+            best[targets] = table["i_evalue"][rows_best]
+            cols[column] = best[codes]
+    return seq_ids, cols, n_hits, n_hit_seqs
+
+
+def feature_cache_path(coords_path, cache_dir=None):
+    base = os.path.basename(coords_path) + ".features.npz"
+    return os.path.join(cache_dir or os.path.dirname(coords_path) or ".", base)
+
+
+def load_module_features(coords_path, domtbl_path=None, cache=True, cache_dir=None):
+    """Load the ModuleFeatureTable for coords (+ optional domtbl), via the md5-keyed cache.
+
+    Args:
+        coords_path: core_domain_coords.tsv (seq_id, seq_len, raw_env_start,
+            raw_env_end, env_segments).
+        domtbl_path: module_hits.domtbl, or None for no HMM evidence.
+        cache: read/write <coords>.features.npz (default True). A cache built
+            from different input md5s is rebuilt.
+        cache_dir: directory for the cache file (default: next to coords).
+
+    Returns:
+        ModuleFeatureTable
+    """
+    key = md5_of_path(coords_path) + ":" + (md5_of_path(domtbl_path) if domtbl_path else "")
+    cache_path = feature_cache_path(coords_path, cache_dir)
+    columns = (*FEATURE_INT_COLUMNS, *HMM_FEATURES)
+    npz = load_npz_cache(cache_path, key, FEATURE_CACHE_VERSION) if cache else None
+    if npz is not None and all(name in npz for name in columns):
+        return ModuleFeatureTable(
+            npz["seq_ids"].tolist(),
+            {name: npz[name] for name in columns},
+            int(npz["n_hits"]), int(npz["n_hit_seqs"]),
+        )
+
+    seq_ids, cols, n_hits, n_hit_seqs = _build_features(coords_path, domtbl_path)
+    if cache:
+        # A read-only results directory just skips the write
+        save_npz_cache(
+            cache_path, key, FEATURE_CACHE_VERSION,
+            seq_ids=np.array(seq_ids, dtype=str),
+            n_hits=np.array(n_hits),
+            n_hit_seqs=np.array(n_hit_seqs),
+            **cols,
+        )
+    return ModuleFeatureTable(seq_ids, cols, n_hits, n_hit_seqs)
+
+
+def legacy_module_calls(features, thresholds):
+    """Strict/relaxed presence of the legacy 5 modules plus boundary confidence.
+
+    thresholds: module -> {"strict": x, "relaxed": y} (lengths are minimums,
+    ACT/CM values are maximum i-Evalues). C_tail additionally requires no
+    relaxed-level ACT/CM hit in BOTH matrices, which keeps strict ⊆ relaxed.
+
+    Returns:
+        (calls, confidence): calls[level][module] is an int8 array for level
+        in ("strict", "relaxed"); confidence is a str array of
+        high / medium / low (0 / ≤2 / >2 modules where strict != relaxed).
+    """
+    insert = np.maximum(features["insert_len"], 0)
+    calls = {}
+    for level in ("strict", "relaxed"):
+        calls[level] = {
+            "N_ext": features["n_ext_len"] >= thresholds["N_ext"][level],
+            "alpha2beta3_insert": insert >= thresholds["alpha2beta3_insert"][level],
+            "ACT_domain": features["act_ievalue"] <= thresholds["ACT_domain"][level],
+            "CM_domain": features["cm_ievalue"] <= thresholds["CM_domain"][level],
+        }
+    has_hmm_hit_relaxed = calls["relaxed"]["ACT_domain"] | calls["relaxed"]["CM_domain"]
+    for level in ("strict", "relaxed"):
+        calls[level]["C_tail"] = (
+            (features["c_ext_len"] >= thresholds["C_tail"][level]) & ~has_hmm_hit_relaxed
+        )
+        calls[level] = {m: calls[level][m].astype(np.int8) for m in LEGACY_MODULES}
+
+    mismatches = sum((calls["strict"][m] != calls["relaxed"][m]).astype(np.int64)
+                     for m in LEGACY_MODULES)
+    confidence = np.where(mismatches == 0, "high",
+                          np.where(mismatches <= 2, "medium", "low"))
+    return calls, confidence
+
+
+def orthogonal_feature_calls(features, thresholds):
+    """Orthogonal feature encoding (recode_module_features rules) as bool arrays.
+
+    thresholds: flat keys n_ext_/insert_/c_ext_ (minimum lengths) and
+    act_/cm_ (maximum i-Evalues), each with _relaxed and _strict.
+    c_residual_* is a C-terminal extension with no relaxed-level ACT/CM hit.
+    """
+    n_ext = features["n_ext_len"]
+    insert = features["insert_len"]
+    c_ext = features["c_ext_len"]
+    act = features["act_ievalue"]
+    cm = features["cm_ievalue"]
+    no_hmm_relaxed = ~((act <= thresholds["act_relaxed"]) | (cm <= thresholds["cm_relaxed"]))
+    calls = {}
+    for level in ("relaxed", "strict"):
+        calls[f"n_ext_{level}"] = n_ext >= thresholds[f"n_ext_{level}"]
+        calls[f"insert_{level}"] = insert >= thresholds[f"insert_{level}"]
+        calls[f"act_hmm_{level}"] = act <= thresholds[f"act_{level}"]
+        calls[f"cm_hmm_{level}"] = cm <= thresholds[f"cm_{level}"]
+        calls[f"c_ext_{level}"] = c_ext >= thresholds[f"c_ext_{level}"]
+        calls[f"c_residual_{level}"] = calls[f"c_ext_{level}"] & no_hmm_relaxed
+    return calls
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+MSA Utilities — Aligned FASTA as a uint8 matrix shared by the alignment scripts.
+
+Used by:
+  - Phase 3.5: define_core_columns.py (gap fractions, core-column masking)
+  - Phase 3.7: minimal_trim.py (gap-fraction column trimming)
+  - Phase 3.8: extract_struct_subset.py (panel row subset for FoldMason)
+  - Phase 3.9: stitch_full_length_msa.py (core | module | linker concatenation)
+  - Phase 4.1: merge_alignments.py (outgroup column mapping)
+
+Key concepts:
+  - An alignment is parsed once into an (n_seqs x n_cols) uint8 matrix of
+    ASCII codes plus an id -> row index, so column statistics, masks and
+    subsets are NumPy reductions and slices instead of per-character loops.
+  - Gaps are '-' and '.' (GAP_CHARS); case is preserved unless the caller
+    asks for upper-casing at load time.
+  - Column selection accepts a boolean mask or integer indexes and returns
+    a new Alignment sharing the id list; rows are selected by id.
+  - The writer emits whole rows with one tobytes() call each, either
+    unwrapped or wrapped at a fixed line width.
+  - Trimmed-to-full column maps come from the trimmer's .cols.tsv report
+    when available, otherwise from matching whole columns (all shared rows
+    at once) in order; either way the map is verified against every shared
+    row before use.
+  - load_alignment_cached() keeps the parsed matrix as a binary companion
+    (<afa>.npycache/<md5>.v<version>.*.npy) and memory-maps it on re-runs;
+    the md5 is remembered by (size, mtime, inode) in
+    <afa>.npycache/source.md5cache.tsv, so a hit does not re-read the file;
+    column statistics and the writer walk row blocks, so a trim or sweep
+    over a mapped matrix never materializes a second full copy.
+"""
+
+from __future__ import annotations
+
+import bisect
+import os
+
+import numpy as np
+
+from hmmer_utils import cached_source_md5, prune_npy_cache, save_npy_atomic
+
+GAP_CHARS = "-."
+GAP_CODES = np.frombuffer(GAP_CHARS.encode("ascii"), dtype=np.uint8)
+ROW_BLOCK = 4096
+MSA_CACHE_VERSION = 1
+
+
+class Alignment:
+    """Rectangular MSA stored as a uint8 matrix.
+
+    Attributes:
+        ids: sequence IDs in row order.
+        index: ID -> row.
+        matrix: uint8 (n_seqs, n_cols) ASCII codes.
+    """
+
+    def __init__(self, ids, matrix):
+        self.ids = list(ids)
+        self.index = {sid: i for i, sid in enumerate(self.ids)}
+        self.matrix = matrix
+
+    @property
+    def n_seqs(self):
+        return self.matrix.shape[0]
+
+    @property
+    def n_cols(self):
+        return self.matrix.shape[1]
+
+    def __len__(self):
+        return self.n_seqs
+
+    def __contains__(self, sid):
+        return sid in self.index
+
+    def __getitem__(self, sid):
+        """Aligned sequence string for an ID."""
+        return self.row_string(self.index[sid])
+
+    def row_string(self, row):
+        return self.matrix[row].tobytes().decode("ascii")
+
+    def records(self):
+        """Yield (id, aligned sequence) pairs in row order."""
+        for i, sid in enumerate(self.ids):
+            yield sid, self.row_string(i)
+
+    # ── Column statistics ──────────────────────────────────────────────────
+    def gap_mask(self):
+        """bool (n_seqs, n_cols): True at gap characters."""
+        return np.isin(self.matrix, GAP_CODES)
+
+    def row_blocks(self, size=ROW_BLOCK):
+        """Yield (start, stop) row ranges of at most `size` rows."""
+        for start in range(0, self.n_seqs, size):
+            yield start, min(start + size, self.n_seqs)
+
+    def gap_counts(self):
+        """int64 gap count per column (accumulated over row blocks)."""
+        counts = np.zeros(self.n_cols, dtype=np.int64)
+        for start, stop in self.row_blocks():
+            counts += np.isin(self.matrix[start:stop], GAP_CODES).sum(axis=0)
+        return counts
+
+    def gap_fractions(self):
+        """float64 gap fraction per column (0 columns for an empty alignment)."""
+        if self.n_seqs == 0:
+            return np.zeros(self.n_cols)
+        return self.gap_counts() / self.n_seqs
+
+    def residue_counts(self):
+        """int64 non-gap character count per sequence."""
+        counts = np.empty(self.n_seqs, dtype=np.int64)
+        for start, stop in self.row_blocks():
+            gaps = np.isin(self.matrix[start:stop], GAP_CODES).sum(axis=1)
+            counts[start:stop] = self.n_cols - gaps
+        return counts
+
+    def kept_residue_counts(self, masks):
+        """Residues per sequence inside each of several column masks.
+
+        Args:
+            masks: bool (n_masks, n_cols) array, one keep-mask per row.
+
+        Returns:
+            int64 (n_seqs, n_masks) non-gap counts within each mask.
+        """
+        weights = np.asarray(masks, dtype=np.float64).T
+        counts = np.empty((self.n_seqs, weights.shape[1]), dtype=np.int64)
+        for start, stop in self.row_blocks():
+            residues = ~np.isin(self.matrix[start:stop], GAP_CODES)
+            counts[start:stop] = np.rint(residues @ weights)
+        return counts
+
+    # ── Subsetting ──────────────────────────────────────────────────────────
+    def select_columns(self, columns):
+        """Alignment restricted to a boolean column mask or integer column indexes."""
+        columns = np.asarray(columns)
+        if columns.dtype == bool:
+            columns = np.flatnonzero(columns)
+        return Alignment(self.ids, self.matrix[:, columns])
+
+    def select_rows(self, ids):
+        """Alignment restricted to `ids`, in the given order (KeyError if absent)."""
+        ids = list(ids)
+        rows = np.array([self.index[sid] for sid in ids], dtype=np.intp)
+        return Alignment(ids, self.matrix[rows] if len(rows) else self.matrix[:0])
+
+    def upper(self):
+        """Upper-cased copy (a-z -> A-Z)."""
+        lower = (self.matrix >= ord("a")) & (self.matrix <= ord("z"))
+        return Alignment(self.ids, np.where(lower, self.matrix - 32, self.matrix).astype(np.uint8))
+
+
+def mask_to_string(mask):
+    """'0'/'1' string for a boolean column mask (core_columns.mask format)."""
+    codes = np.where(np.asarray(mask, dtype=bool), ord("1"), ord("0")).astype(np.uint8)
+    return codes.tobytes().decode("ascii")
+
+
+def read_column_mask(path, n_cols):
+    """Boolean keep-mask from a core_columns.mask string or a .cols.tsv report.
+
+    Raises:
+        ValueError: if the mask does not describe exactly n_cols columns.
+    """
+    with open(path) as handle:
+        first = handle.readline()
+    if "\t" in first:
+        kept, report_cols = read_kept_columns(path)
+        if report_cols != n_cols:
+            raise ValueError(f"{path} describes {report_cols} columns, alignment has {n_cols}")
+        mask = np.zeros(n_cols, dtype=bool)
+        mask[kept] = True
+        return mask
+    with open(path) as handle:
+        text = "".join(handle.read().split())
+    if len(text) != n_cols or set(text) - {"0", "1"}:
+        raise ValueError(f"{path}: expected a {n_cols}-character 0/1 column mask")
+    return np.frombuffer(text.encode("ascii"), dtype=np.uint8) == ord("1")
+
+
+def read_kept_columns(report_path):
+    """Kept columns from a minimal_trim .cols.tsv report.
+
+    Returns:
+        (kept, n_cols): 0-based int64 indexes of kept columns, and the number
+        of columns in the untrimmed alignment.
+    """
+    kept = []
+    n_cols = 0
+    with open(report_path) as handle:
+        header = handle.readline().rstrip("\n").split("\t")
+        if "original_col_1based" not in header or "kept" not in header:
+            raise ValueError(f"{report_path}: expected original_col_1based and kept columns")
+        col_idx = header.index("original_col_1based")
+        kept_idx = header.index("kept")
+        for line in handle:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) <= max(col_idx, kept_idx):
+                continue
+            col = int(fields[col_idx])
+            n_cols = max(n_cols, col)
+            if fields[kept_idx] == "Y":
+                kept.append(col - 1)
+    return np.array(sorted(kept), dtype=np.int64), n_cols
+
+
+def map_kept_columns(full, trimmed):
+    """Derive which columns of `full` survive in `trimmed` from their shared rows.
+
+    Each trimmed column is compared (case-insensitively) as a whole column
+    vector over every shared sequence, and matched to the earliest identical
+    full column after the previous match.
+
+    Returns:
+        (kept, n_ambiguous): 0-based int64 indexes (None if some trimmed
+        column has no match), and how many trimmed columns had more than one
+        identical full-column candidate.
+    """
+    shared = [sid for sid in trimmed.ids if sid in full.index]
+    if not shared:
+        return None, 0
+    full_cols = np.ascontiguousarray(full.select_rows(shared).upper().matrix.T)
+    trim_cols = np.ascontiguousarray(trimmed.select_rows(shared).upper().matrix.T)
+
+    candidates = {}
+    for col, vector in enumerate(full_cols):
+        candidates.setdefault(vector.tobytes(), []).append(col)
+
+    kept = []
+    n_ambiguous = 0
+    prev = -1
+    for vector in trim_cols:
+        cols = candidates.get(vector.tobytes(), [])
+        pos = bisect.bisect_right(cols, prev)
+        if pos == len(cols):
+            return None, n_ambiguous
+        if len(cols) > 1:
+            n_ambiguous += 1
+        prev = cols[pos]
+        kept.append(prev)
+    return np.array(kept, dtype=np.int64), n_ambiguous
+
+
+def column_map_mismatches(full, trimmed, kept):
+    """IDs shared by both alignments whose trimmed row != full row at `kept`."""
+    shared = [sid for sid in trimmed.ids if sid in full.index]
+    if not shared:
+        return []
+    projected = full.select_rows(shared).select_columns(kept).upper().matrix
+    expected = trimmed.select_rows(shared).upper().matrix
+    if projected.shape != expected.shape:
+        return shared
+    bad = np.any(projected != expected, axis=1)
+    return [shared[i] for i in np.flatnonzero(bad)]
+
+
+def iter_fasta_records(path, clean=None):
+    """Yield (id, sequence) from a FASTA file without holding the whole file.
+
+    Header IDs are the first whitespace-delimited token; whitespace inside
+    sequence lines is removed. `clean` is as in read_alignment().
+    """
+    current_id = None
+    chunks = []
+    with open(path, errors="replace") as handle:
+        for line in handle:
+            if clean is not None:
+                line = clean(line.rstrip("\n"))
+                if line is None:
+                    continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    yield current_id, "".join(chunks)
+                current_id = line[1:].split()[0]
+                chunks = []
+            elif current_id is not None:
+                chunks.append("".join(line.split()))
+    if current_id is not None:
+        yield current_id, "".join(chunks)
+
+
+def read_alignment(path, keep_ids=None, upper=False, clean=None):
+    """Parse an aligned FASTA into an Alignment.
+
+    Args:
+        path: Aligned FASTA path.
+        keep_ids: optional set of IDs to load; others are skipped.
+        upper: upper-case residues while loading.
+        clean: optional callable applied to every raw line (newline stripped);
+            it returns the cleaned line, or None to drop the line.
+
+    Returns:
+        Alignment with rows in file order. Header IDs are the first
+        whitespace-delimited token; whitespace inside sequence lines is removed.
+
+    Raises:
+        ValueError: if sequences differ in length.
+    """
+    ids = []
+    seqs = []
+    for sid, seq in iter_fasta_records(path, clean=clean):
+        if keep_ids is None or sid in keep_ids:
+            ids.append(sid)
+            seqs.append(seq)
+
+    width = len(seqs[0]) if seqs else 0
+    for sid, seq in zip(ids, seqs):
+        if len(seq) != width:
+            raise ValueError(f"Sequence {sid} has {len(seq)} cols, expected {width}.")
+    text = "".join(seqs)
+    if upper:
+        text = text.upper()
+    matrix = np.frombuffer(text.encode("ascii", errors="replace"), dtype=np.uint8)
+    return Alignment(ids, matrix.reshape(len(ids), width).copy())
+
+
+def concat_alignments(alignments, ids):
+    """Concatenate alignments column-wise for the given IDs (KeyError if absent)."""
+    blocks = [aln.select_rows(ids).matrix for aln in alignments]
+    if not blocks:
+        return Alignment(ids, np.zeros((len(ids), 0), dtype=np.uint8))
+    return Alignment(ids, np.hstack(blocks))
+
+
+def write_alignment(aln, path, line_width=None, columns=None):
+    """Write an Alignment as FASTA.
+
+    Args:
+        aln: Alignment to write.
+        path: Output path.
+        line_width: wrap sequence lines at this width (None: one line per sequence).
+        columns: optional boolean mask or index array; only these columns are
+            written, sliced one row block at a time.
+    """
+    if columns is not None:
+        columns = np.asarray(columns)
+        if columns.dtype == bool:
+            columns = np.flatnonzero(columns)
+    with open(path, "wb") as handle:
+        for start, stop in aln.row_blocks():
+            block = aln.matrix[start:stop]
+            if columns is not None:
+                block = block[:, columns]
+            write_alignment_rows(handle, aln.ids[start:stop], block, line_width)
+
+
+def write_alignment_rows(handle, ids, matrix, line_width=None):
+    """Write FASTA records for `ids` / matrix rows to a binary handle."""
+    if line_width is None:
+        for sid, row in zip(ids, matrix):
+            handle.write(b">" + sid.encode() + b"\n" + row.tobytes() + b"\n")
+        return
+    n_cols = matrix.shape[1]
+    for sid, row in zip(ids, matrix):
+        data = row.tobytes()
+        body = b"".join(data[i:i + line_width] + b"\n" for i in range(0, n_cols, line_width))
+        handle.write(b">" + sid.encode() + b"\n" + body)
+
+
+def alignment_cache_dir(path, cache_dir=None):
+    base = os.path.basename(path) + ".npycache"
+    return os.path.join(cache_dir or os.path.dirname(path) or ".", base)
+
+
+def load_alignment_cached(path, cache=True, cache_dir=None):
+    """Load an aligned FASTA via its md5-keyed memory-mapped matrix cache.
+
+    Args:
+        path: Aligned FASTA path.
+        cache: read/write <path>.npycache (default True). Entries built from
+            an earlier version of the file (an overwritten alignment) are
+            removed when a new one is written.
+        cache_dir: parent directory of the cache (default: next to `path`).
+
+    Returns:
+        Alignment whose matrix is a read-only np.memmap when served from cache.
+
+    Raises:
+        ValueError: if sequences differ in length.
+    """
+    if not cache:
+        return read_alignment(path)
+    root = alignment_cache_dir(path, cache_dir)
+    source_md5 = cached_source_md5(path, root)
+    prefix = os.path.join(root, f"{source_md5}.v{MSA_CACHE_VERSION}")
+    ids_path = f"{prefix}.ids.npy"
+    matrix_path = f"{prefix}.matrix.npy"
+    if os.path.isfile(ids_path):
+        try:
+            return Alignment(np.load(ids_path).tolist(), np.load(matrix_path, mmap_mode="r"))
+        except (OSError, ValueError):
+            pass  # truncated or unreadable cache: rebuild below
+
+    aln = read_alignment(path)
+    try:
+        os.makedirs(root, exist_ok=True)
+        # matrix first: the ids file marks a complete entry
+        for target, array in ((matrix_path, aln.matrix), (ids_path, np.array(aln.ids, dtype=str))):
+            save_npy_atomic(target, array)
+    except OSError:
+        return aln  # read-only directory: still return the parsed alignment
+    prune_npy_cache(root, path, source_md5, ".ids.npy")
+    return Alignment(aln.ids, np.load(matrix_path, mmap_mode="r"))
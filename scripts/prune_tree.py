@@ -13,8 +13,12 @@ Usage:
 """
 
 import argparse
+import os
 import sys
-import re
+
+# Add scripts directory to path for tree_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tree_utils import parse_newick
 
 
 def parse_args():
@@ -42,64 +46,41 @@ def read_newick(path: str) -> str:
         return f.read().strip()
 
 
-def extract_tip_names(nwk: str) -> list[str]:
-    """Extract all tip names from a Newick string using regex."""
-    # Tip names are tokens that are not preceded by ')' and are followed by
-    # ':' (branch length) or ',' or ')'. We match any word-like token before ':'
-    # But Newick tip names can contain various chars. We use a robust pattern.
-    # In IQ-TREE output, tip names are alphanumeric with underscores.
-    tips = re.findall(r"[\(,]\s*([A-Za-z0-9_.\-|]+)\s*:", nwk)
-    return tips
-
-
-def prune_newick_string(nwk: str, remove_names: set[str]) -> str:
-    """Prune tips from a Newick string by direct string manipulation.
+def prune_newick_string(nwk: str, remove_names: set[str]):
+    """Prune tips from a Newick string using the array-backed tree core.
 
-    This is much faster than loading a full tree object for large trees.
-    Strategy: iteratively remove leaf tokens and clean up the resulting
-    tree structure (empty clades, dangling commas, single-child internal nodes).
+    The tree is parsed once into flat arrays (tree_utils.CompactTree);
+    pruning splices out unary nodes and sums their branch lengths,
+    matching ete3 prune(preserve_branch_length=True).
     """
-    from ete3 import Tree
-
-    print("  Loading tree with ete3 (this may take a minute for large trees)...")
-    sys.stdout.flush()
-    # format=1 includes internal node names and branch lengths
-    t = Tree(nwk, format=1)
+    t = parse_newick(nwk)
 
-    total_tips = len(t.get_leaves())
+    total_tips = t.n_tips
     print(f"  Tree loaded: {total_tips} tips")
 
     # Find tips to remove
-    tips_to_remove = [leaf for leaf in t.get_leaves() if leaf.name in remove_names]
-    found_names = {leaf.name for leaf in tips_to_remove}
+    found_names = {name for name in t.tip_names if name in remove_names}
     missing = remove_names - found_names
     if missing:
         print(f"  WARNING: {len(missing)} names not found in tree: {missing}")
 
-    print(f"  Tips to prune: {len(tips_to_remove)}")
+    print(f"  Tips to prune: {len(found_names)}")
 
     # --- Monophyly diagnostic ---
     if len(found_names) >= 2:
-        try:
-            mono, clade_type, violating = t.check_monophyly(
-                values=found_names, target_attr="name"
-            )
-            if mono:
-                print(f"  KDOPS monophyly: YES (monophyletic)")
-            else:
-                print(f"  KDOPS monophyly: NO ({clade_type})")
-                if violating:
-                    viol_names = [n.name for n in list(violating)[:5]]
-                    print(f"    Violating taxa (first 5): {viol_names}")
-        except Exception as e:
-            print(f"  Monophyly check failed: {e}")
+        mrca_names = t.leaf_names(t.mrca(found_names))
+        violating = [name for name in mrca_names if name not in found_names]
+        if not violating:
+            print(f"  KDOPS monophyly: YES (monophyletic)")
+        else:
+            print(f"  KDOPS monophyly: NO ({len(violating)} intruders in MRCA clade)")
+            print(f"    Violating taxa (first 5): {violating[:5]}")
 
     # --- Check root position relative to KDOPS ---
-    root = t.get_tree_root()
-    root_children = root.get_children()
+    root_children = t.children(0)
     print(f"  Root children: {len(root_children)}")
     for i, child in enumerate(root_children):
-        child_leaves = child.get_leaf_names()
+        child_leaves = t.leaf_names(child)
         kdops_in_child = [n for n in child_leaves if n in found_names]
         print(
             f"    Child {i}: {len(child_leaves)} tips "
@@ -107,14 +88,12 @@ def prune_newick_string(nwk: str, remove_names: set[str]) -> str:
         )
 
     # --- Prune by keeping only non-matching tips ---
-    keep_names = [
-        leaf.name for leaf in t.get_leaves() if leaf.name not in remove_names
-    ]
-    print(f"  Keeping {len(keep_names)} tips, pruning {len(tips_to_remove)}...")
+    keep_names = [name for name in t.tip_names if name not in remove_names]
+    print(f"  Keeping {len(keep_names)} tips, pruning {len(found_names)}...")
     sys.stdout.flush()
-    t.prune(keep_names, preserve_branch_length=True)
+    t = t.prune(keep_names)
 
-    remaining = len(t.get_leaves())
+    remaining = t.n_tips
     print(f"  Pruned tree: {remaining} tips")
 
     return t, remaining
@@ -129,10 +108,10 @@ def main():
     nwk = read_newick(args.input)
 
     # Quick scan for tip names to remove
-    all_tips = extract_tip_names(nwk)
+    all_tips = parse_newick(nwk).tip_names
     remove_names = {name for name in all_tips if name.startswith(args.remove_prefix)}
 
-    print(f"  Total tips (regex scan): {len(all_tips)}")
+    print(f"  Total tips: {len(all_tips)}")
     print(f"  Tips matching '{args.remove_prefix}*': {len(remove_names)}")
     for name in sorted(remove_names):
         print(f"    - {name}")
@@ -147,7 +126,7 @@ def main():
     pruned_tree, n_remaining = prune_newick_string(nwk, remove_names)
 
     # Assert rooted
-    root_children = pruned_tree.get_tree_root().get_children()
+    root_children = pruned_tree.children(0)
     is_rooted = len(root_children) == 2
     print(f"  Output tree rooted (bifurcating root): {is_rooted}")
 
@@ -160,8 +139,9 @@ def main():
         sys.exit(1)
 
     # Write output
-    # format=1 preserves internal node names + branch lengths + support values
-    pruned_tree.write(outfile=args.output, format=1)
+    # Internal labels (support values) and branch lengths are preserved
+    with open(args.output, "w") as f:
+        f.write(pruned_tree.to_newick(internal_labels=True) + "\n")
 
     print(f"[prune_tree.py] Output: {args.output}")
     print(f"[prune_tree.py] Done. {len(remove_names)} tips pruned, {n_remaining} remain.")
@@ -29,6 +29,20 @@ Usage:
     --cov_min 0.70 --cov_mode merged --merge_gap 5 \
     --outdir results/02_qc
 
+  # Sweep: one domtbl parse per subtype, counts for every threshold setting;
+  # FASTAs/TSV are written for the chosen --cov_min/--cov_mode/--merge_gap
+  python scripts/qc_length_coverage.py \
+    --sweep_input Ia=results/01_mining/hits_Ia_seqs.fasta,results/01_mining/hits_Ia.domtbl \
+    --sweep_input Ib=results/01_mining/hits_Ib_clean.fasta,results/01_mining/hits_Ib_vs_dah7ps_v41.domtbl \
+    --sweep_input II=results/01_mining/hits_II_final_seqs.fasta,results/01_mining/hits_II.domtbl \
+    --params meta/params.json \
+    --sweep_cov_min 0.5,0.6,0.65,0.7,0.75,0.8 --sweep_merge_gap 0,5,10 \
+    --sweep_cov_mode best,merged \
+    --cov_min 0.70 --cov_mode merged --merge_gap 5 --outdir results/02_qc
+
+  Hmm lengths and canonical windows come from qc.hmm_lengths and
+  qc.length_windows in --params. Counts go to qc_coverage_sweep.tsv.
+
 Outputs per subtype:
   qc_pass_{subtype}.fasta         PASS_CANONICAL sequences
   qc_long_{subtype}.fasta         PASS_LONG sequences
@@ -37,16 +51,15 @@ Outputs per subtype:
 """
 
 import argparse
+import json
 import os
 import sys
 
+import numpy as np
+
 # Import from hmmer_utils (same directory)
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from hmmer_utils import (
-    parse_domtbl_all_domains,
-    parse_domtbl_best_domain,
-    union_coverage_hmm,
-)
+from hmmer_utils import load_domtbl_table, parse_domtbl_best_domain, stitch_domtbl
 
 
 def load_fasta_records(path):
@@ -72,170 +85,122 @@ def load_fasta_records(path):
     return records
 
 
-def classify_sequence(l_seq, cov, canonical_min, canonical_max, cov_min):
-    """Classify a sequence into one of three bins."""
-    if cov < cov_min:
-        return "FRAG"
-    if l_seq < canonical_min:
-        return "FRAG"
-    if l_seq > canonical_max:
-        return "PASS_LONG"
-    return "PASS_CANONICAL"
+BINS = ("PASS_CANONICAL", "PASS_LONG", "FRAG")
+BIN_PREFIXES = {"PASS_CANONICAL": "qc_pass", "PASS_LONG": "qc_long", "FRAG": "fragments"}
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Phase 2.1: Length + HMM coverage triple-bin filtering"
-    )
-    parser.add_argument("--fasta", required=True, help="Input FASTA file")
-    parser.add_argument("--domtbl", required=True, help="domtblout for this subtype")
-    parser.add_argument("--hmm_length", type=int, required=True, help="HMM model length (match states)")
-    parser.add_argument("--subtype", required=True, help="Subtype label (Ia/Ib/II)")
-    parser.add_argument("--canonical_min", type=int, required=True, help="Min length for PASS_CANONICAL")
-    parser.add_argument("--canonical_max", type=int, required=True, help="Max length for PASS_CANONICAL")
-    parser.add_argument("--cov_min", type=float, default=0.70, help="Min HMM coverage for PASS (default: 0.70)")
-    parser.add_argument("--cov_mode", choices=["best", "merged"], default="best",
-                        help="Coverage mode: 'best' (single domain) or 'merged' (multi-domain stitching)")
-    parser.add_argument("--merge_gap", type=int, default=0,
-                        help="Gap tolerance for merging adjacent HMM intervals (default: 0)")
-    parser.add_argument("--ievalue_max", type=float, default=1e-5,
-                        help="Max i-Evalue for domain hits in merged mode (default: 1e-5)")
-    parser.add_argument("--min_hmm_span", type=int, default=30,
-                        help="Min HMM span for domain hits in merged mode (default: 30)")
-    parser.add_argument("--outdir", required=True, help="Output directory")
-    args = parser.parse_args()
+def bin_codes(l_seq, cov, canonical_min, canonical_max, cov_mins):
+    """Classify sequences into the three bins for each cov_min.
 
-    # Validate inputs
-    for path in [args.fasta, args.domtbl]:
-        if not os.path.isfile(path):
-            print(f"ERROR: File not found: {path}", file=sys.stderr)
-            sys.exit(1)
+    FRAG if cov < cov_min or l_seq < canonical_min, PASS_LONG if
+    l_seq > canonical_max, else PASS_CANONICAL.
 
-    os.makedirs(args.outdir, exist_ok=True)
+    Returns:
+        int8 (n_cov_min, n_seqs) indexes into BINS.
+    """
+    cov_ok = cov[None, :] >= np.asarray(cov_mins, dtype=float)[:, None]
+    len_ok = l_seq >= canonical_min
+    codes = np.full(cov_ok.shape, BINS.index("FRAG"), dtype=np.int8)
+    codes[cov_ok & len_ok & (l_seq <= canonical_max)] = BINS.index("PASS_CANONICAL")
+    codes[cov_ok & len_ok & (l_seq > canonical_max)] = BINS.index("PASS_LONG")
+    return codes
 
-    # Print config
-    print(f"Processing {args.subtype}...")
-    print(f"  FASTA: {args.fasta}")
-    print(f"  domtbl: {args.domtbl}")
-    print(f"  HMM length: {args.hmm_length}")
-    print(f"  Canonical window: [{args.canonical_min}, {args.canonical_max}]")
-    print(f"  Coverage threshold: {args.cov_min}")
-    print(f"  Coverage mode: {args.cov_mode}")
-    if args.cov_mode == "merged":
-        print(f"  Merge gap: {args.merge_gap}")
-        print(f"  i-Evalue max: {args.ievalue_max}")
-        print(f"  Min HMM span: {args.min_hmm_span}")
-    print()
 
-    # Parse domain hits
-    if args.cov_mode == "merged":
-        all_domains = parse_domtbl_all_domains(
-            args.domtbl,
-            ievalue_max=args.ievalue_max,
-            min_hmm_span=args.min_hmm_span,
-        )
-    # Always parse best for comparison
-    best_domains = parse_domtbl_best_domain(args.domtbl)
-
-    # Load FASTA records
-    records = load_fasta_records(args.fasta)
+def rescued_mask(l_seq, cov_best, cov_merged, canonical_min, cov_mins):
+    """bool (n_cov_min, n_seqs): FRAG by best-domain coverage but PASS by merged."""
+    cov_mins = np.asarray(cov_mins, dtype=float)[:, None]
+    return (cov_best[None, :] < cov_mins) & (cov_merged[None, :] >= cov_mins) & \
+        (l_seq >= canonical_min)
 
-    # Classify each sequence
-    classifications = {}
-    bins = {"PASS_CANONICAL": [], "PASS_LONG": [], "FRAG": []}
-    rescued_count = 0
 
-    for seqid, header, seq in records:
-        l_seq = len(seq)
+def coverage_arrays(records, domtbl, hmm_length, merge_gaps=(),
+                    ievalue_max=1e-5, min_hmm_span=30):
+    """Per-sequence coverage from one pass over the domtbl.
 
-        # Compute cov_best (single best domain)
+    Returns:
+        l_seq (int64), cov_best (float64), has_best (bool), all per record,
+        and merged: merge_gap -> (cov_merged float64, n_domains int64).
+        The all-domains hits are only parsed when merge_gaps is non-empty.
+    """
+    best_domains = parse_domtbl_best_domain(domtbl)
+    n = len(records)
+    l_seq = np.fromiter((len(seq) for _, _, seq in records), dtype=np.int64, count=n)
+    cov_best = np.zeros(n)
+    has_best = np.zeros(n, dtype=bool)
+    for k, (seqid, _, _) in enumerate(records):
         if seqid in best_domains:
             _, hmm_from, hmm_to, _, _ = best_domains[seqid]
-            cov_best = (hmm_to - hmm_from + 1) / args.hmm_length
-        else:
-            cov_best = 0.0
-
-        # Compute cov_merged (multi-domain stitching)
-        if args.cov_mode == "merged" and seqid in all_domains:
-            cov_merged, merged_intervals, n_doms = union_coverage_hmm(
-                all_domains[seqid], args.hmm_length, args.merge_gap
-            )
-        elif args.cov_mode == "merged":
-            cov_merged = 0.0
-            n_doms = 0
-        else:
-            cov_merged = cov_best
-            n_doms = 1 if seqid in best_domains else 0
-
-        # Use the appropriate coverage for classification
-        if args.cov_mode == "merged":
-            cov_used = cov_merged
-        else:
-            cov_used = cov_best
-
-        bin_label = classify_sequence(l_seq, cov_used, args.canonical_min, args.canonical_max, args.cov_min)
-
-        # Track rescues (would be FRAG by best, but PASS by merged)
-        rescued = (cov_best < args.cov_min and cov_merged >= args.cov_min and l_seq >= args.canonical_min)
-        if rescued:
-            rescued_count += 1
-
-        classifications[seqid] = {
-            "bin": bin_label,
-            "l_seq": l_seq,
-            "cov_best": cov_best,
-            "cov_merged": cov_merged,
-            "n_domains": n_doms,
-            "rescued": rescued,
-        }
-        bins[bin_label].append((seqid, header, seq))
-
-    # Write output FASTAs
-    for bin_label, prefix in [("PASS_CANONICAL", "qc_pass"), ("PASS_LONG", "qc_long"), ("FRAG", "fragments")]:
-        out_path = os.path.join(args.outdir, f"{prefix}_{args.subtype}.fasta")
+            cov_best[k] = (hmm_to - hmm_from + 1) / hmm_length
+            has_best[k] = True
+
+    merged = {}
+    if merge_gaps:
+        table = load_domtbl_table(domtbl)
+        qualifying = table.mask(ievalue_max=ievalue_max, min_hmm_span=min_hmm_span)
+        # Record -> target code (records without any hit map to an empty extra slot)
+        codes = np.fromiter((table.target_index.get(seqid, len(table.targets))
+                             for seqid, _, _ in records), dtype=np.int64, count=n)
+        for gap in merge_gaps:
+            hits = stitch_domtbl(table, hmm_length, mask=qualifying, merge_gap=gap)
+            cov_merged = np.append(hits.coverage, 0.0)[codes]
+            n_doms = np.append(hits.n_domains, 0)[codes].astype(np.int64)
+            merged[gap] = (cov_merged, n_doms)
+    return l_seq, cov_best, has_best, merged
+
+
+def write_outputs(records, subtype, outdir, l_seq, cov_best, cov_merged, n_doms, codes, rescued):
+    """Bin FASTAs (80-col) and qc_classification TSV for one setting."""
+    for b, bin_label in enumerate(BINS):
+        out_path = os.path.join(outdir, f"{BIN_PREFIXES[bin_label]}_{subtype}.fasta")
         with open(out_path, "w") as f:
-            for seqid, header, seq in bins[bin_label]:
+            for k in np.flatnonzero(codes == b):
+                _, header, seq = records[k]
                 f.write(f">{header[1:]}\n")
                 for i in range(0, len(seq), 80):
                     f.write(seq[i:i + 80] + "\n")
 
-    # Write classification TSV
-    tsv_path = os.path.join(args.outdir, f"qc_classification_{args.subtype}.tsv")
+    tsv_path = os.path.join(outdir, f"qc_classification_{subtype}.tsv")
     with open(tsv_path, "w") as f:
         f.write("seq_id\tL_seq\tcov_best\tcov_merged\tn_domains\trescued_by_stitching\tbin\n")
-        for seqid, header, seq in records:
-            c = classifications[seqid]
-            f.write(f"{seqid}\t{c['l_seq']}\t{c['cov_best']:.4f}\t{c['cov_merged']:.4f}\t"
-                    f"{c['n_domains']}\t{c['rescued']}\t{c['bin']}\n")
+        for k, (seqid, header, seq) in enumerate(records):
+            f.write(f"{seqid}\t{l_seq[k]}\t{cov_best[k]:.4f}\t{cov_merged[k]:.4f}\t"
+                    f"{n_doms[k]}\t{bool(rescued[k])}\t{BINS[codes[k]]}\n")
+
+
+def setting_arrays(cov_mode, merge_gap, cov_best, has_best, merged):
+    """(cov_used, cov_merged, n_domains) for one cov_mode / merge_gap."""
+    if cov_mode == "merged":
+        cov_merged, n_doms = merged[merge_gap]
+        return cov_merged, cov_merged, n_doms
+    return cov_best, cov_best, has_best.astype(np.int64)
+
 
-    # Summary
+def print_summary(subtype, cov_mode, records, codes, l_seq, cov_best, cov_merged, rescued_count):
     total = len(records)
-    n_pass = len(bins["PASS_CANONICAL"])
-    n_long = len(bins["PASS_LONG"])
-    n_frag = len(bins["FRAG"])
+    n_pass, n_long, n_frag = (int((codes == b).sum()) for b in range(len(BINS)))
 
     print(f"{'=' * 60}")
-    print(f"Phase 2.1 Results — {args.subtype} (cov_mode={args.cov_mode})")
+    print(f"Phase 2.1 Results — {subtype} (cov_mode={cov_mode})")
     print(f"{'=' * 60}")
     print(f"  Total input:       {total:>7}")
     print(f"  PASS_CANONICAL:    {n_pass:>7}  ({n_pass / total * 100:.1f}%)")
     print(f"  PASS_LONG:         {n_long:>7}  ({n_long / total * 100:.1f}%)")
     print(f"  FRAG:              {n_frag:>7}  ({n_frag / total * 100:.1f}%)")
-    if args.cov_mode == "merged":
+    if cov_mode == "merged":
         print(f"  Rescued by stitching: {rescued_count:>4}")
     print()
 
     # Per-bin stats
-    for bin_label in ["PASS_CANONICAL", "PASS_LONG", "FRAG"]:
-        seqs = bins[bin_label]
-        if seqs:
-            lens = [len(s[2]) for s in seqs]
-            covs_best = [classifications[s[0]]["cov_best"] for s in seqs]
-            covs_merged = [classifications[s[0]]["cov_merged"] for s in seqs]
+    for b, bin_label in enumerate(BINS):
+        rows = np.flatnonzero(codes == b)
+        if rows.size:
+            lens = l_seq[rows].tolist()
+            covs_best = cov_best[rows].tolist()
+            covs_merged = cov_merged[rows].tolist()
             print(f"  {bin_label}:")
             print(f"    Length: min={min(lens)}, median={sorted(lens)[len(lens) // 2]}, max={max(lens)}")
             print(f"    cov_best:   min={min(covs_best):.3f}, median={sorted(covs_best)[len(covs_best) // 2]:.3f}, max={max(covs_best):.3f}")
-            if args.cov_mode == "merged":
+            if cov_mode == "merged":
                 print(f"    cov_merged: min={min(covs_merged):.3f}, median={sorted(covs_merged)[len(covs_merged) // 2]:.3f}, max={max(covs_merged):.3f}")
         else:
             print(f"  {bin_label}: (empty)")
@@ -246,6 +211,223 @@ def main():
         f"FATAL: bins don't sum to total! {n_pass}+{n_long}+{n_frag} != {total}"
     print(f"  ✅ Sanity check passed: {n_pass}+{n_long}+{n_frag} = {total}")
     print()
+    return n_pass, n_long, n_frag
+
+
+def parse_list(text, cast, name):
+    """Comma-separated sweep values (None -> None)."""
+    if text is None:
+        return None
+    try:
+        values = [cast(v.strip()) for v in text.split(",") if v.strip()]
+    except ValueError:
+        print(f"ERROR: invalid {name}: {text}", file=sys.stderr)
+        sys.exit(1)
+    if not values:
+        print(f"ERROR: empty {name}", file=sys.stderr)
+        sys.exit(1)
+    return values
+
+
+def parse_sweep_inputs(items, params_path):
+    """--sweep_input LABEL=FASTA,DOMTBL → list of per-subtype config dicts."""
+    if not os.path.isfile(params_path):
+        print(f"ERROR: File not found: {params_path}", file=sys.stderr)
+        sys.exit(1)
+    with open(params_path) as f:
+        qc = json.load(f).get("qc", {})
+    subtypes = []
+    for item in items:
+        label, _, paths = item.partition("=")
+        parts = [p.strip() for p in paths.split(",")]
+        if not label or len(parts) != 2 or not all(parts):
+            print(f"ERROR: --sweep_input must be LABEL=FASTA,DOMTBL, got: {item}", file=sys.stderr)
+            sys.exit(1)
+        label = label.strip()
+        try:
+            window = qc["length_windows"][label]
+            hmm_length = int(qc["hmm_lengths"][label])
+            canonical_min = int(window["canonical_min"])
+            canonical_max = int(window["canonical_max"])
+        except KeyError as exc:
+            print(f"ERROR: {params_path} has no qc.hmm_lengths/length_windows entry "
+                  f"for {label} ({exc})", file=sys.stderr)
+            sys.exit(1)
+        subtypes.append({
+            "subtype": label, "fasta": parts[0], "domtbl": parts[1],
+            "hmm_length": hmm_length,
+            "canonical_min": canonical_min, "canonical_max": canonical_max,
+        })
+    labels = [st["subtype"] for st in subtypes]
+    if len(set(labels)) != len(labels):
+        print(f"ERROR: duplicate --sweep_input labels: {labels}", file=sys.stderr)
+        sys.exit(1)
+    return subtypes
+
+
+def run_sweep(args):
+    """Counts for every (cov_mode, merge_gap, cov_min) per subtype; outputs for the chosen one."""
+    subtypes = parse_sweep_inputs(args.sweep_input, args.params)
+    cov_mins = parse_list(args.sweep_cov_min, float, "--sweep_cov_min") or [args.cov_min]
+    merge_gaps = parse_list(args.sweep_merge_gap, int, "--sweep_merge_gap") or [args.merge_gap]
+    cov_modes = parse_list(args.sweep_cov_mode, str, "--sweep_cov_mode") or [args.cov_mode]
+    bad_modes = set(cov_modes) - {"best", "merged"}
+    if bad_modes:
+        print(f"ERROR: unknown --sweep_cov_mode values: {sorted(bad_modes)}", file=sys.stderr)
+        sys.exit(1)
+    for st in subtypes:
+        for path in [st["fasta"], st["domtbl"]]:
+            if not os.path.isfile(path):
+                print(f"ERROR: File not found: {path}", file=sys.stderr)
+                sys.exit(1)
+    # The chosen setting is always evaluated so its outputs can be written.
+    if args.cov_mode == "merged" and args.merge_gap not in merge_gaps:
+        merge_gaps.append(args.merge_gap)
+    gaps_needed = merge_gaps if ("merged" in cov_modes or args.cov_mode == "merged") else []
+
+    os.makedirs(args.outdir, exist_ok=True)
+    sweep_path = args.sweep_out or os.path.join(args.outdir, "qc_coverage_sweep.tsv")
+    settings = [(mode, gap) for mode in cov_modes
+                for gap in (merge_gaps if mode == "merged" else [None])]
+    print(f"Sweep: {len(subtypes)} subtypes x {len(settings)} coverage settings x "
+          f"{len(cov_mins)} cov_min values")
+    print()
+
+    with open(sweep_path, "w") as out:
+        out.write("subtype\tcov_mode\tmerge_gap\tcov_min\tn_total\t"
+                  "PASS_CANONICAL\tPASS_LONG\tFRAG\trescued\tchosen\n")
+        for st in subtypes:
+            records = load_fasta_records(st["fasta"])
+            l_seq, cov_best, has_best, merged = coverage_arrays(
+                records, st["domtbl"], st["hmm_length"], gaps_needed,
+                ievalue_max=args.ievalue_max, min_hmm_span=args.min_hmm_span,
+            )
+            for mode, gap in settings:
+                cov_used, cov_merged, _ = setting_arrays(mode, gap, cov_best, has_best, merged)
+                codes = bin_codes(l_seq, cov_used, st["canonical_min"], st["canonical_max"], cov_mins)
+                counts = [(codes == b).sum(axis=1) for b in range(len(BINS))]
+                rescued = rescued_mask(l_seq, cov_best, cov_merged,
+                                       st["canonical_min"], cov_mins).sum(axis=1)
+                for j, cov_min in enumerate(cov_mins):
+                    chosen = (mode == args.cov_mode and cov_min == args.cov_min
+                              and (mode == "best" or gap == args.merge_gap))
+                    out.write(f"{st['subtype']}\t{mode}\t{'NA' if gap is None else gap}\t"
+                              f"{cov_min}\t{len(records)}\t{counts[0][j]}\t{counts[1][j]}\t"
+                              f"{counts[2][j]}\t{rescued[j]}\t{'Y' if chosen else 'N'}\n")
+
+            # Outputs for the chosen setting only
+            cov_used, cov_merged, n_doms = setting_arrays(
+                args.cov_mode, args.merge_gap, cov_best, has_best, merged
+            )
+            codes = bin_codes(l_seq, cov_used, st["canonical_min"], st["canonical_max"],
+                              [args.cov_min])[0]
+            rescued = rescued_mask(l_seq, cov_best, cov_merged, st["canonical_min"],
+                                   [args.cov_min])[0]
+            write_outputs(records, st["subtype"], args.outdir, l_seq, cov_best, cov_merged,
+                          n_doms, codes, rescued)
+            print_summary(st["subtype"], args.cov_mode, records, codes, l_seq, cov_best,
+                          cov_merged, int(rescued.sum()))
+
+    print(f"Outputs:")
+    print(f"  {sweep_path}")
+    for st in subtypes:
+        print(f"  {args.outdir}/{{qc_pass,qc_long,fragments}}_{st['subtype']}.fasta, "
+              f"qc_classification_{st['subtype']}.tsv "
+              f"(cov_min={args.cov_min}, cov_mode={args.cov_mode}, merge_gap={args.merge_gap})")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Phase 2.1: Length + HMM coverage triple-bin filtering"
+    )
+    parser.add_argument("--fasta", help="Input FASTA file")
+    parser.add_argument("--domtbl", help="domtblout for this subtype")
+    parser.add_argument("--hmm_length", type=int, help="HMM model length (match states)")
+    parser.add_argument("--subtype", help="Subtype label (Ia/Ib/II)")
+    parser.add_argument("--canonical_min", type=int, help="Min length for PASS_CANONICAL")
+    parser.add_argument("--canonical_max", type=int, help="Max length for PASS_CANONICAL")
+    parser.add_argument("--cov_min", type=float, default=0.70, help="Min HMM coverage for PASS (default: 0.70)")
+    parser.add_argument("--cov_mode", choices=["best", "merged"], default="best",
+                        help="Coverage mode: 'best' (single domain) or 'merged' (multi-domain stitching)")
+    parser.add_argument("--merge_gap", type=int, default=0,
+                        help="Gap tolerance for merging adjacent HMM intervals (default: 0)")
+    parser.add_argument("--ievalue_max", type=float, default=1e-5,
+                        help="Max i-Evalue for domain hits in merged mode (default: 1e-5)")
+    parser.add_argument("--min_hmm_span", type=int, default=30,
+                        help="Min HMM span for domain hits in merged mode (default: 30)")
+    parser.add_argument("--outdir", required=True, help="Output directory")
+    parser.add_argument("--sweep_input", action="append", default=[],
+                        help="Sweep mode: LABEL=FASTA,DOMTBL (repeatable, e.g. Ia=hits_Ia_seqs.fasta,"
+                             "hits_Ia.domtbl); replaces --fasta/--domtbl/--subtype/--hmm_length/"
+                             "--canonical_min/--canonical_max")
+    parser.add_argument("--params", default="meta/params.json",
+                        help="Sweep mode: params JSON with qc.hmm_lengths and qc.length_windows")
+    parser.add_argument("--sweep_cov_min",
+                        help="Sweep mode: comma-separated cov_min values (default: --cov_min)")
+    parser.add_argument("--sweep_merge_gap",
+                        help="Sweep mode: comma-separated merge_gap values (default: --merge_gap)")
+    parser.add_argument("--sweep_cov_mode",
+                        help="Sweep mode: comma-separated cov_mode values, best and/or merged "
+                             "(default: --cov_mode)")
+    parser.add_argument("--sweep_out",
+                        help="Sweep mode: output TSV (default: <outdir>/qc_coverage_sweep.tsv)")
+    args = parser.parse_args()
+
+    if args.sweep_input:
+        run_sweep(args)
+        return
+
+    required = ["fasta", "domtbl", "hmm_length", "subtype", "canonical_min", "canonical_max"]
+    missing = [f"--{name}" for name in required if getattr(args, name) is None]
+    if missing:
+        parser.error(f"the following arguments are required without --sweep_input: "
+                     f"{', '.join(missing)}")
+
+    # Validate inputs
+    for path in [args.fasta, args.domtbl]:
+        if not os.path.isfile(path):
+            print(f"ERROR: File not found: {path}", file=sys.stderr)
+            sys.exit(1)
+
+    os.makedirs(args.outdir, exist_ok=True)
+
+    # Print config
+    print(f"Processing {args.subtype}...")
+    print(f"  FASTA: {args.fasta}")
+    print(f"  domtbl: {args.domtbl}")
+    print(f"  HMM length: {args.hmm_length}")
+    print(f"  Canonical window: [{args.canonical_min}, {args.canonical_max}]")
+    print(f"  Coverage threshold: {args.cov_min}")
+    print(f"  Coverage mode: {args.cov_mode}")
+    if args.cov_mode == "merged":
+        print(f"  Merge gap: {args.merge_gap}")
+        print(f"  i-Evalue max: {args.ievalue_max}")
+        print(f"  Min HMM span: {args.min_hmm_span}")
+    print()
+
+    # Load FASTA records; coverage per sequence from one domtbl pass
+    records = load_fasta_records(args.fasta)
+    l_seq, cov_best, has_best, merged = coverage_arrays(
+        records, args.domtbl, args.hmm_length,
+        [args.merge_gap] if args.cov_mode == "merged" else [],
+        ievalue_max=args.ievalue_max, min_hmm_span=args.min_hmm_span,
+    )
+    cov_used, cov_merged, n_doms = setting_arrays(
+        args.cov_mode, args.merge_gap, cov_best, has_best, merged
+    )
+
+    # Classify each sequence; track rescues (FRAG by best, PASS by merged)
+    codes = bin_codes(l_seq, cov_used, args.canonical_min, args.canonical_max, [args.cov_min])[0]
+    rescued = rescued_mask(l_seq, cov_best, cov_merged, args.canonical_min, [args.cov_min])[0]
+
+    # Write output FASTAs and classification TSV
+    write_outputs(records, args.subtype, args.outdir, l_seq, cov_best, cov_merged,
+                  n_doms, codes, rescued)
+
+    n_pass, n_long, n_frag = print_summary(
+        args.subtype, args.cov_mode, records, codes, l_seq, cov_best, cov_merged,
+        int(rescued.sum()),
+    )
     print(f"Outputs:")
     print(f"  {args.outdir}/qc_pass_{args.subtype}.fasta ({n_pass})")
     print(f"  {args.outdir}/qc_long_{args.subtype}.fasta ({n_long})")
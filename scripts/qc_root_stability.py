@@ -15,10 +15,13 @@ from __future__ import annotations
 import argparse
 import csv
 import os
-import re
 import sys
 from collections import defaultdict
 
+# Add scripts directory to path for tree_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tree_utils import CompactTree, load_tree as load_newick, nrf_matrix
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -54,6 +57,11 @@ def parse_args() -> argparse.Namespace:
         default="results/meta/metrics_manifest.tsv",
         help="Metrics manifest TSV with precomputed nRF values",
     )
+    parser.add_argument(
+        "--nrf_matrix",
+        default=None,
+        help="Optional TSV of all-pairs scenario nRF computed from tree_path (shared tips)",
+    )
     parser.add_argument(
         "--output_md",
         default="results/04_phylogeny_asr/QC3_root_stability.md",
@@ -62,103 +70,50 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-class Node:
-    __slots__ = ["name", "children"]
-
-    def __init__(self, name: str = "", children: list["Node"] | None = None) -> None:
-        self.name = name
-        self.children = children or []
-
-    def is_leaf(self) -> bool:
-        return not self.children
-
-    def leaves(self) -> list[str]:
-        if self.is_leaf():
-            return [self.name]
-        values: list[str] = []
-        for child in self.children:
-            values.extend(child.leaves())
-        return values
-
-
 def fail(message: str) -> None:
     print(f"[qc_root_stability] ERROR: {message}", file=sys.stderr)
     sys.exit(1)
 
 
-def parse_newick_string(raw: str) -> Node:
-    text = raw.strip().rstrip(";")
-    pos = [0]
-
-    def parse_node() -> Node:
-        children: list[Node] = []
-        if pos[0] < len(text) and text[pos[0]] == "(":
-            pos[0] += 1
-            children.append(parse_node())
-            while pos[0] < len(text) and text[pos[0]] == ",":
-                pos[0] += 1
-                children.append(parse_node())
-            if pos[0] < len(text) and text[pos[0]] == ")":
-                pos[0] += 1
-
-        name = []
-        while pos[0] < len(text) and text[pos[0]] not in ",):;":
-            name.append(text[pos[0]])
-            pos[0] += 1
-
-        if pos[0] < len(text) and text[pos[0]] == ":":
-            pos[0] += 1
-            while pos[0] < len(text) and text[pos[0]] not in ",);":
-                pos[0] += 1
-
-        return Node("".join(name).strip(), children)
-
-    return parse_node()
-
-
-def load_tree(path: str) -> Node | None:
+def load_tree(path: str) -> CompactTree | None:
     if not path or not os.path.isfile(path):
         return None
-    with open(path) as handle:
-        return parse_newick_string(handle.read())
-
+    return load_newick(path)
 
-def bipartitions(root: Node) -> set[frozenset[frozenset[str]]]:
-    all_leaves = frozenset(root.leaves())
-    splits: set[frozenset[frozenset[str]]] = set()
 
-    def visit(node: Node) -> frozenset[str]:
-        if node.is_leaf():
-            return frozenset([node.name])
-        current = frozenset()
-        for child in node.children:
-            current |= visit(child)
-        other = all_leaves - current
-        if 1 < len(current) < len(all_leaves) - 1:
-            splits.add(frozenset([current, other]))
-        return current
+def scenario_nrf(scenarios: list[dict[str, str]]) -> tuple[list[str], list[list[float]], int]:
+    """All-pairs nRF across the scenario trees that exist on disk.
 
-    visit(root)
-    return splits
-
-
-def normalized_rf(left: Node, right: Node) -> float | None:
-    left_tips = set(left.leaves())
-    right_tips = set(right.leaves())
-    if left_tips != right_tips:
-        return None
-    left_bips = bipartitions(left)
-    right_bips = bipartitions(right)
-    denom = len(left_bips) + len(right_bips)
-    if denom == 0:
-        return 0.0
-    return (len(left_bips - right_bips) + len(right_bips - left_bips)) / denom
-
-
-def root_identity(root: Node) -> str:
-    if len(root.children) < 2:
+    Trees are compared on the tips they all share, so KDOPS-rooted S1/S2
+    and ingroup-only S3/S4 trees sit in one matrix.
+    """
+    ids: list[str] = []
+    trees: list[CompactTree] = []
+    for row in scenarios:
+        tree = load_tree(row.get("tree_path", ""))
+        if tree is not None:
+            ids.append(row["scenario_id"])
+            trees.append(tree)
+    if len(trees) < 2:
+        return ids, [], 0
+    matrix, n_tips = nrf_matrix(trees, common_tips=True)
+    return ids, matrix.tolist(), n_tips
+
+
+def write_nrf_matrix(path: str, ids: list[str], matrix: list[list[float]], n_tips: int) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as handle:
+        handle.write("scenario_a\tscenario_b\tshared_tips\tnRF\n")
+        for i, left in enumerate(ids):
+            for j in range(i + 1, len(ids)):
+                handle.write(f"{left}\t{ids[j]}\t{n_tips}\t{matrix[i][j]:.6f}\n")
+
+
+def root_identity(tree: CompactTree) -> str:
+    children = tree.children(0)
+    if len(children) < 2:
         return "unresolved"
-    child_sets = [sorted(child.leaves()) for child in root.children]
+    child_sets = [sorted(tree.leaf_names(child)) for child in children]
     ordered = sorted(child_sets, key=lambda names: (len(names), names[:3]))
     labels = []
     for names in ordered[:2]:
@@ -167,10 +122,11 @@ def root_identity(root: Node) -> str:
     return " | ".join(labels)
 
 
-def root_split_sizes(root: Node) -> str:
-    if len(root.children) < 2:
+def root_split_sizes(tree: CompactTree) -> str:
+    children = tree.children(0)
+    if len(children) < 2:
         return "NA"
-    sizes = [len(child.leaves()) for child in root.children]
+    sizes = tree.subtree_sizes()[children]
     return ",".join(str(size) for size in sorted(sizes))
 
 
@@ -235,6 +191,7 @@ def topology_dimension(
     scenarios: list[dict[str, str]],
     tree_comparison_rows: list[dict[str, str]],
     metrics: dict[str, str],
+    computed_nrf: dict[tuple[str, str], float] | None = None,
 ) -> tuple[str, list[str]]:
     lines = []
     hold = False
@@ -244,6 +201,10 @@ def topology_dimension(
         s1s2 = metrics.get("qc3_s1_s2_nRF", "NA")
         verdict = "PASS"
         note = "precomputed model-sensitivity comparison"
+        computed = (computed_nrf or {}).get(("S1_MFP_KDOPS", "S2_LGC20_KDOPS"))
+        if s1s2 in ("", "NA") and computed is not None:
+            s1s2 = f"{computed:.4f}"
+            note = "computed from scenario trees"
         try:
             if float(s1s2) >= 0.10:
                 verdict = "SENSITIVE"
@@ -429,11 +390,22 @@ def main() -> None:
     panel_rows = read_tsv(args.panel_calibration)
     metrics = metrics_by_id(args.metrics_manifest)
 
+    computed_nrf: dict[tuple[str, str], float] = {}
+    if args.nrf_matrix:
+        ids, matrix, n_tips = scenario_nrf(scenarios)
+        write_nrf_matrix(args.nrf_matrix, ids, matrix, n_tips)
+        for i, left in enumerate(ids):
+            for j, right in enumerate(ids):
+                if i != j:
+                    computed_nrf[(left, right)] = matrix[i][j]
+        print(f"[qc_root_stability] wrote {args.nrf_matrix}")
+
     provenance_status, provenance_lines = provenance_dimension(scenarios, artifact_rows)
     topology_status, topology_lines = topology_dimension(
         scenarios,
         tree_comparison_rows,
         metrics,
+        computed_nrf,
     )
     root_status, root_lines = root_identity_dimension(scenarios)
     annotation_status, annotation_lines = annotation_dimension(feature_rows, panel_rows)
@@ -10,6 +10,10 @@ Outputs:
   - module_feature_matrix.tsv
   - panel35_feature_calibration.tsv
   - module_feature_encoding.md
+
+Raw per-sequence features come from the shared, cached feature table in
+module_utils.py (the same one annotate_modules.py uses); the feature calls
+are vectorized thresholds on it.
 """
 
 from __future__ import annotations
@@ -19,7 +23,10 @@ import csv
 import json
 import os
 import sys
-from collections import defaultdict
+
+# Add scripts directory to path for module_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from module_utils import load_module_features, orthogonal_feature_calls
 
 
 DEFAULT_THRESHOLDS = {
@@ -71,33 +78,12 @@ def load_thresholds(params_path: str | None) -> dict[str, float]:
     return thresholds
 
 
-def load_coords(path: str) -> list[dict[str, str]]:
-    if not os.path.isfile(path):
-        fail(f"coords not found: {path}")
-    with open(path) as handle:
-        return list(csv.DictReader(handle, delimiter="\t"))
-
-
-def load_domtbl(path: str) -> dict[str, list[dict[str, object]]]:
-    if not os.path.isfile(path):
-        fail(f"domtbl not found: {path}")
-    hits: dict[str, list[dict[str, object]]] = defaultdict(list)
-    with open(path) as handle:
-        for line in handle:
-            if line.startswith("#"):
-                continue
-            fields = line.split()
-            if len(fields) < 22:
-                continue
-            hits[fields[0]].append(
-                {
-                    "query": fields[3],
-                    "ievalue": float(fields[12]),
-                    "env_from": int(fields[19]),
-                    "env_to": int(fields[20]),
-                }
-            )
-    return hits
+def load_features(coords_path: str, domtbl_path: str):
+    if not os.path.isfile(coords_path):
+        fail(f"coords not found: {coords_path}")
+    if not os.path.isfile(domtbl_path):
+        fail(f"domtbl not found: {domtbl_path}")
+    return load_module_features(coords_path, domtbl_path)
 
 
 def load_panel_ids(path: str) -> dict[str, dict[str, str]]:
@@ -111,32 +97,6 @@ def load_panel_ids(path: str) -> dict[str, dict[str, str]]:
     return panel
 
 
-def parse_env_segments(raw: str) -> list[tuple[int, int]]:
-    result = []
-    for part in raw.split(";"):
-        part = part.strip()
-        if not part or "-" not in part:
-            continue
-        left, right = part.split("-", 1)
-        result.append((int(left), int(right)))
-    return result
-
-
-def largest_gap(raw: str) -> int:
-    segments = parse_env_segments(raw)
-    if len(segments) < 2:
-        return 0
-    gaps = [segments[i + 1][0] - segments[i][1] - 1 for i in range(len(segments) - 1)]
-    return max(gaps) if gaps else 0
-
-
-def best_hit(seq_hits: list[dict[str, object]], token: str) -> dict[str, object] | None:
-    candidates = [hit for hit in seq_hits if token in str(hit["query"])]
-    if not candidates:
-        return None
-    return min(candidates, key=lambda hit: float(hit["ievalue"]))
-
-
 def classify_binary(value: bool) -> str:
     return "1" if value else "0"
 
@@ -144,8 +104,7 @@ def classify_binary(value: bool) -> str:
 def main() -> None:
     args = parse_args()
     thresholds = load_thresholds(args.params)
-    coords = load_coords(args.coords)
-    domtbl = load_domtbl(args.domtbl)
+    features = load_features(args.coords, args.domtbl)
     panel = load_panel_ids(args.panel_manifest)
 
     os.makedirs(args.outdir, exist_ok=True)
@@ -158,41 +117,31 @@ def main() -> None:
     matrix_rows = []
     panel_rows = []
 
-    for row in coords:
-        seq_id = row["seq_id"]
-        seq_len = int(row["seq_len"])
-        raw_env_start = int(row["raw_env_start"])
-        raw_env_end = int(row["raw_env_end"])
-        n_ext_len = raw_env_start - 1
-        c_ext_len = seq_len - raw_env_end
-        insert_len = largest_gap(row["env_segments"])
-
-        seq_hits = domtbl.get(seq_id, [])
-        act_hit = best_hit(seq_hits, "ACT")
-        cm_hit = best_hit(seq_hits, "CM")
-        act_relaxed = act_hit is not None and float(act_hit["ievalue"]) <= thresholds["act_relaxed"]
-        act_strict = act_hit is not None and float(act_hit["ievalue"]) <= thresholds["act_strict"]
-        cm_relaxed = cm_hit is not None and float(cm_hit["ievalue"]) <= thresholds["cm_relaxed"]
-        cm_strict = cm_hit is not None and float(cm_hit["ievalue"]) <= thresholds["cm_strict"]
-
-        c_residual_relaxed = c_ext_len >= thresholds["c_ext_relaxed"] and not (act_relaxed or cm_relaxed)
-        c_residual_strict = c_ext_len >= thresholds["c_ext_strict"] and not (act_relaxed or cm_relaxed)
+    calls = {name: values.tolist() for name, values in
+             orthogonal_feature_calls(features, thresholds).items()}
+    n_ext_lens = features["n_ext_len"].tolist()
+    insert_lens = features["insert_len"].tolist()
+    c_ext_lens = features["c_ext_len"].tolist()
+
+    for k, seq_id in enumerate(features.seq_ids):
+        c_residual_relaxed = calls["c_residual_relaxed"][k]
+        c_residual_strict = calls["c_residual_strict"][k]
 
         matrix_row = {
             "seq_id": seq_id,
-            "n_ext_len": str(n_ext_len),
-            "n_ext_relaxed": classify_binary(n_ext_len >= thresholds["n_ext_relaxed"]),
-            "n_ext_strict": classify_binary(n_ext_len >= thresholds["n_ext_strict"]),
-            "insert_len": str(insert_len),
-            "insert_relaxed": classify_binary(insert_len >= thresholds["insert_relaxed"]),
-            "insert_strict": classify_binary(insert_len >= thresholds["insert_strict"]),
-            "act_hmm_relaxed": classify_binary(act_relaxed),
-            "act_hmm_strict": classify_binary(act_strict),
-            "cm_hmm_relaxed": classify_binary(cm_relaxed),
-            "cm_hmm_strict": classify_binary(cm_strict),
-            "c_ext_len": str(c_ext_len),
-            "c_ext_relaxed": classify_binary(c_ext_len >= thresholds["c_ext_relaxed"]),
-            "c_ext_strict": classify_binary(c_ext_len >= thresholds["c_ext_strict"]),
+            "n_ext_len": str(n_ext_lens[k]),
+            "n_ext_relaxed": classify_binary(calls["n_ext_relaxed"][k]),
+            "n_ext_strict": classify_binary(calls["n_ext_strict"][k]),
+            "insert_len": str(insert_lens[k]),
+            "insert_relaxed": classify_binary(calls["insert_relaxed"][k]),
+            "insert_strict": classify_binary(calls["insert_strict"][k]),
+            "act_hmm_relaxed": classify_binary(calls["act_hmm_relaxed"][k]),
+            "act_hmm_strict": classify_binary(calls["act_hmm_strict"][k]),
+            "cm_hmm_relaxed": classify_binary(calls["cm_hmm_relaxed"][k]),
+            "cm_hmm_strict": classify_binary(calls["cm_hmm_strict"][k]),
+            "c_ext_len": str(c_ext_lens[k]),
+            "c_ext_relaxed": classify_binary(calls["c_ext_relaxed"][k]),
+            "c_ext_strict": classify_binary(calls["c_ext_strict"][k]),
             "c_residual_relaxed": classify_binary(c_residual_relaxed),
             "c_residual_strict": classify_binary(c_residual_strict),
             "trait_asr_priority": (
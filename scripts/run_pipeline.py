@@ -0,0 +1,594 @@
+#!/usr/bin/env python3
+"""Incremental pipeline runner with content-hash caching of every step.
+
+Steps are declared in meta/pipeline.json (command, inputs, outputs). The
+runner orders them by their input -> output dependencies and skips a step
+when its cache key matches the one recorded at its last successful run and
+its outputs still carry the recorded md5s. The cache key covers:
+  - the rendered command
+  - the md5 of every input and of the step's source script
+  - the values of the meta/params.json keys the step reads, i.e. every
+    {section.key} placeholder in its command plus any keys listed under
+    "params" (for scripts that read --params meta/params.json themselves)
+
+params.json is never hashed as a whole, so changing one threshold re-runs
+only the steps that read it; downstream steps re-run only if the outputs
+they consume actually changed.
+
+Independent steps (per-subtype QC, per-scenario rooting/pruning/ASR) run
+concurrently under a global CPU budget (--cpus). A step declares the
+threads it can use ("cpus", default 1) and receives its grant through the
+{cpus} placeholder (e.g. iqtree -T {cpus}, hmmsearch --cpu {cpus}); when
+several steps are ready the free CPUs are split evenly between them. The
+grant is not part of the cache key. Each step's output goes to
+<log_dir>/<step>.log; wall-clock and peak RSS are reported per step.
+
+md5 and git commit come from build_artifact_manifest.py, including its
+(path, size, mtime, inode) md5 cache (<state>.md5cache.tsv), so unchanged
+inputs and outputs are not re-read on every invocation; --manifest writes
+the recorded runs in the artifact_manifest.tsv layout.
+
+Usage:
+  python scripts/run_pipeline.py --dry_run
+  python scripts/run_pipeline.py --cpus 20
+  python scripts/run_pipeline.py asr_sensitivity          # target + upstream
+  python scripts/run_pipeline.py --force core_trim_asr \
+    --manifest results/meta/pipeline_manifest.tsv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import string
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Add scripts directory to path for build_artifact_manifest
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from build_artifact_manifest import MANIFEST_COLUMNS, MD5_CACHE_SUFFIX, Md5Cache, git_commit
+
+STATE_VERSION = 1
+POLL_SECONDS = 0.2
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run pipeline steps, skipping those whose inputs and params are unchanged."
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="Step ids to bring up to date, with their upstream steps (default: all)",
+    )
+    parser.add_argument("--spec", default="meta/pipeline.json", help="Pipeline step declarations")
+    parser.add_argument("--params", default="meta/params.json", help="Project parameters")
+    parser.add_argument(
+        "--state",
+        default="results/meta/pipeline_state.json",
+        help="Run record (cache keys and md5s of the last successful run per step)",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Global CPU budget shared by concurrently running steps (default: all cores)",
+    )
+    parser.add_argument(
+        "--log_dir",
+        default="results/meta/pipeline_logs",
+        help="Per-step stdout/stderr logs (default: results/meta/pipeline_logs)",
+    )
+    parser.add_argument(
+        "--progress_interval",
+        type=float,
+        default=30.0,
+        help="Seconds between progress lines while steps are running (default: 30)",
+    )
+    parser.add_argument(
+        "--force",
+        action="append",
+        default=[],
+        help="Re-run this step even if cached (repeatable)",
+    )
+    parser.add_argument("--force_all", action="store_true", help="Re-run every selected step")
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Report which steps would run and why, without running anything",
+    )
+    parser.add_argument("--list", action="store_true", help="List steps in run order and exit")
+    parser.add_argument("--manifest", help="Write recorded runs as an artifact manifest TSV")
+    return parser.parse_args()
+
+
+def fail(message: str) -> None:
+    print(f"[run_pipeline] ERROR: {message}", file=sys.stderr)
+    sys.exit(1)
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, sec = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes}m{sec:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
+
+
+def param_value(params: dict, dotted: str):
+    node = params
+    for part in dotted.split("."):
+        if not isinstance(node, dict) or part not in node:
+            raise KeyError(dotted)
+        node = node[part]
+    return node
+
+
+class ParamFormatter(string.Formatter):
+    """str.format where {section.key} is a dotted lookup into params.json.
+
+    {cpus} is the step's CPU grant; with cpus=None it is left as the literal
+    placeholder, which is the form used for the cache key. Literal braces
+    (awk programs, shell ${VAR}) are written doubled, {{ and }}, as in
+    str.format; check_placeholders() enforces this when the spec is loaded.
+    """
+
+    def __init__(self, params: dict, cpus: int | None = None) -> None:
+        super().__init__()
+        self.params = params
+        self.cpus = cpus
+        self.used: dict[str, object] = {}
+
+    def get_field(self, field_name, args, kwargs):
+        if field_name == "cpus":
+            return ("{cpus}" if self.cpus is None else self.cpus), field_name
+        value = param_value(self.params, field_name)
+        self.used[field_name] = value
+        return value, field_name
+
+
+def check_placeholders(step: dict, params: dict) -> None:
+    """Fail unless every {field} in the step's cmd is {cpus} or a params.json key."""
+    hint = "write literal braces as {{ and }}"
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(step["cmd"])
+                  if field is not None]
+    except ValueError as exc:
+        fail(f"step {step['id']}: malformed cmd placeholder ({exc}); {hint}")
+    for field in fields:
+        if field == "cpus":
+            continue
+        try:
+            param_value(params, field)
+        except KeyError:
+            fail(f"step {step['id']}: {{{field}}} in cmd is not a params key; {hint}")
+
+
+def load_steps(spec_path: Path, params: dict) -> list[dict]:
+    with spec_path.open() as handle:
+        spec = json.load(handle)
+    steps = spec.get("steps", [])
+    seen: set[str] = set()
+    for step in steps:
+        for field in ("id", "cmd", "outputs"):
+            if field not in step:
+                fail(f"step {step.get('id', '?')} has no '{field}'")
+        if step["id"] in seen:
+            fail(f"duplicate step id: {step['id']}")
+        seen.add(step["id"])
+        step.setdefault("inputs", [])
+        step.setdefault("params", [])
+        step.setdefault("cpus", 1)
+        check_placeholders(step, params)
+    return steps
+
+
+def step_inputs(step: dict) -> list[str]:
+    inputs = list(step["inputs"])
+    script = step.get("script")
+    if script and script not in inputs:
+        inputs.append(script)
+    return inputs
+
+
+def dependency_order(steps: list[dict]) -> tuple[list[str], dict[str, list[str]]]:
+    """Topological order (declaration order among ready steps) and upstream ids per step."""
+    producer: dict[str, str] = {}
+    for step in steps:
+        for path in step["outputs"]:
+            if path in producer:
+                fail(f"{path} is an output of both {producer[path]} and {step['id']}")
+            producer[path] = step["id"]
+
+    deps: dict[str, list[str]] = {}
+    for step in steps:
+        upstream = []
+        for path in step_inputs(step):
+            sid = producer.get(path)
+            if sid and sid != step["id"] and sid not in upstream:
+                upstream.append(sid)
+        deps[step["id"]] = upstream
+
+    order: list[str] = []
+    done: set[str] = set()
+    remaining = [step["id"] for step in steps]
+    while remaining:
+        ready = [sid for sid in remaining if all(d in done for d in deps[sid])]
+        if not ready:
+            fail(f"dependency cycle among steps: {', '.join(remaining)}")
+        for sid in ready:
+            order.append(sid)
+            done.add(sid)
+        remaining = [sid for sid in remaining if sid not in done]
+    return order, deps
+
+
+def with_upstream(targets: list[str], deps: dict[str, list[str]]) -> set[str]:
+    selected: set[str] = set()
+    stack = list(targets)
+    while stack:
+        sid = stack.pop()
+        if sid not in selected:
+            selected.add(sid)
+            stack.extend(deps[sid])
+    return selected
+
+
+def render(step: dict, params: dict, cpus: int | None = None) -> tuple[str, dict]:
+    formatter = ParamFormatter(params, cpus)
+    try:
+        command = formatter.format(step["cmd"])
+        for dotted in step["params"]:
+            formatter.used[dotted] = param_value(params, dotted)
+    except KeyError as exc:
+        fail(f"step {step['id']}: params key not found: {exc.args[0]}")
+    return command, dict(sorted(formatter.used.items()))
+
+
+def cache_key(command: str, input_md5: dict[str, str], used_params: dict) -> str:
+    payload = json.dumps(
+        {"command": command, "inputs": input_md5, "params": used_params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def stale_reason(record: dict | None, key: str, command: str, input_md5: dict[str, str],
+                 used_params: dict, outputs: list[str], hasher: Md5Cache) -> str | None:
+    """Why a step must re-run, or None if its recorded run is still valid."""
+    if record is None:
+        return "no previous run"
+    if record.get("key") != key:
+        old_md5 = record.get("input_md5", {})
+        changed = [path for path, md5 in input_md5.items() if old_md5.get(path) != md5]
+        if changed:
+            return f"input changed: {', '.join(changed)}"
+        old_params = record.get("params", {})
+        changed = [k for k, v in used_params.items() if old_params.get(k) != v]
+        if changed:
+            return f"params changed: {', '.join(changed)}"
+        if record.get("command") != command:
+            return "command changed"
+        return "cache key changed"
+    for path in outputs:
+        if not Path(path).is_file():
+            return f"output missing: {path}"
+        if hasher.md5(path) != record["output_md5"].get(path):
+            return f"output modified: {path}"
+    return None
+
+
+def plan_step(step: dict, params: dict, state: dict[str, dict], forced: set[str],
+              hasher: Md5Cache) -> dict:
+    """Resolve a step against the current inputs: command, md5s, cache key and stale reason.
+
+    Raises FileNotFoundError listing missing inputs.
+    """
+    command, used_params = render(step, params)
+    inputs = step_inputs(step)
+    missing = [path for path in inputs if not Path(path).is_file()]
+    if missing:
+        raise FileNotFoundError(", ".join(missing))
+    input_md5 = {path: hasher.md5(path) for path in inputs}
+    key = cache_key(command, input_md5, used_params)
+    reason = stale_reason(state.get(step["id"]), key, command, input_md5, used_params,
+                          step["outputs"], hasher)
+    if step["id"] in forced:
+        reason = "forced"
+    return {"command": command, "params": used_params, "input_md5": input_md5,
+            "key": key, "reason": reason}
+
+
+def load_state(path: Path) -> dict[str, dict]:
+    if not path.is_file():
+        return {}
+    with path.open() as handle:
+        data = json.load(handle)
+    if data.get("version") != STATE_VERSION:
+        print(f"[run_pipeline] state version mismatch in {path}; starting fresh", file=sys.stderr)
+        return {}
+    return data.get("steps", {})
+
+
+def save_state(path: Path, steps: dict[str, dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w") as handle:
+        json.dump({"version": STATE_VERSION, "steps": steps}, handle, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def write_manifest(path: Path, steps: list[dict], state: dict[str, dict]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    n_rows = 0
+    with path.open("w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=MANIFEST_COLUMNS, delimiter="\t")
+        writer.writeheader()
+        for step in steps:
+            record = state.get(step["id"])
+            if record is None:
+                continue
+            for out in step["outputs"]:
+                writer.writerow({
+                    "artifact_id": f"{step['id']}:{Path(out).name}",
+                    "scenario_id": step.get("scenario_id", ""),
+                    "artifact_role": step.get("artifact_role", "output"),
+                    "file_path": out,
+                    "output_md5": record["output_md5"].get(out, ""),
+                    "source_script": record.get("source_script", ""),
+                    "git_commit": record.get("git_commit", ""),
+                    "command": record.get("run_command", record["command"]),
+                    "input_paths": ",".join(record["input_md5"]),
+                    "input_md5": ",".join(record["input_md5"].values()),
+                    "generated_at": record.get("generated_at", ""),
+                    "formal_status": step.get("formal_status", ""),
+                    "notes": step.get("notes", ""),
+                })
+                n_rows += 1
+    print(f"[run_pipeline] Wrote {n_rows} manifest rows to {path}")
+
+
+def dry_run(order: list[str], by_id: dict[str, dict], deps: dict[str, list[str]],
+            selected: set[str], params: dict, state: dict[str, dict], forced: set[str],
+            hasher: Md5Cache) -> None:
+    pending: set[str] = set()
+    n_cached = 0
+    for sid in order:
+        if sid not in selected:
+            continue
+        upstream = [d for d in deps[sid] if d in pending]
+        if upstream:
+            print(f"[run_pipeline] {sid}: would run (upstream: {', '.join(upstream)})")
+            pending.add(sid)
+            continue
+        try:
+            plan = plan_step(by_id[sid], params, state, forced, hasher)
+        except FileNotFoundError as exc:
+            print(f"[run_pipeline] {sid}: blocked (missing input: {exc})")
+            pending.add(sid)
+            continue
+        if plan["reason"] is None:
+            print(f"[run_pipeline] {sid}: cached")
+            n_cached += 1
+        else:
+            print(f"[run_pipeline] {sid}: would run ({plan['reason']})")
+            pending.add(sid)
+    print(f"[run_pipeline] {len(selected)} steps: {n_cached} cached, {len(pending)} would run")
+
+
+class Scheduler:
+    """Run ready steps concurrently under a CPU budget, in dependency order.
+
+    A step becomes ready when all its upstream steps are done; it is then
+    planned against its (now final) inputs and either marked cached or
+    queued. Queued steps are launched in order while CPUs are free, each
+    granted min(step cpus, free // n_queued) but at least one CPU.
+    """
+
+    def __init__(self, order, by_id, deps, selected, params, state, forced, hasher, args):
+        self.by_id = by_id
+        self.deps = deps
+        self.params = params
+        self.state = state
+        self.forced = forced
+        self.hasher = hasher
+        self.args = args
+        self.budget = max(1, args.cpus)
+        self.free = self.budget
+        self.waiting = [sid for sid in order if sid in selected]
+        self.total = len(self.waiting)
+        self.done: dict[str, str] = {}      # sid -> "cached" | "ran"
+        self.queue: list[tuple[str, dict]] = []
+        self.running: dict[int, dict] = {}  # pid -> task
+        self.report: list[dict] = []
+        self.failed: list[str] = []
+        self.commit = git_commit()
+        self.log_dir = Path(args.log_dir)
+        self.last_progress = time.time()
+
+    def promote(self) -> None:
+        """Plan every waiting step whose upstream steps are all done."""
+        changed = True
+        while changed and not self.failed:
+            changed = False
+            for sid in list(self.waiting):
+                if not all(d in self.done for d in self.deps[sid]):
+                    continue
+                self.waiting.remove(sid)
+                changed = True
+                try:
+                    plan = plan_step(self.by_id[sid], self.params, self.state, self.forced,
+                                     self.hasher)
+                except FileNotFoundError as exc:
+                    print(f"[run_pipeline] {sid}: missing input files: {exc}", file=sys.stderr)
+                    self.failed.append(sid)
+                    return
+                if plan["reason"] is None:
+                    print(f"[run_pipeline] {sid}: cached")
+                    self.done[sid] = "cached"
+                else:
+                    self.queue.append((sid, plan))
+
+    def launch(self) -> None:
+        while self.queue and self.free > 0 and not self.failed:
+            sid, plan = self.queue[0]
+            step = self.by_id[sid]
+            share = max(1, self.free // len(self.queue))
+            grant = max(1, min(int(step["cpus"]), share))
+            self.queue.pop(0)
+            self.free -= grant
+            command, _ = render(step, self.params, grant)
+            for out in step["outputs"]:
+                Path(out).parent.mkdir(parents=True, exist_ok=True)
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            log_path = self.log_dir / f"{sid}.log"
+            with log_path.open("w") as log:
+                log.write(f"$ {command}\n")
+                log.flush()
+                proc = subprocess.Popen(command, shell=True, executable="/bin/bash",
+                                        stdout=log, stderr=subprocess.STDOUT)
+            self.running[proc.pid] = {"sid": sid, "plan": plan, "proc": proc, "cpus": grant,
+                                      "command": command, "log": log_path, "t0": time.time()}
+            print(f"[run_pipeline] {sid}: started on {grant} cpu ({plan['reason']})")
+
+    def reap(self) -> None:
+        for pid, task in list(self.running.items()):
+            waited, status, usage = os.wait4(pid, os.WNOHANG)
+            if not waited:
+                continue
+            del self.running[pid]
+            task["proc"].returncode = os.waitstatus_to_exitcode(status)
+            self.free += task["cpus"]
+            self.finish(task, time.time() - task["t0"], usage.ru_maxrss / 1024)
+
+    def finish(self, task: dict, elapsed: float, peak_mb: float) -> None:
+        sid = task["sid"]
+        step = self.by_id[sid]
+        returncode = task["proc"].returncode
+        missing = [out for out in step["outputs"] if not Path(out).is_file()]
+        ok = returncode == 0 and not missing
+        self.report.append({"sid": sid, "cpus": task["cpus"], "elapsed": elapsed,
+                            "peak_mb": peak_mb, "status": "ok" if ok else "FAILED"})
+        if not ok:
+            self.state.pop(sid, None)
+            save_state(Path(self.args.state), self.state)
+            self.failed.append(sid)
+            detail = (f"exited with status {returncode}" if returncode
+                      else f"did not produce: {', '.join(missing)}")
+            print(f"[run_pipeline] {sid}: FAILED ({detail}); log: {task['log']}", file=sys.stderr)
+            with task["log"].open(errors="replace") as log:
+                for line in log.readlines()[-20:]:
+                    print(f"  | {line.rstrip()}", file=sys.stderr)
+            return
+
+        plan = task["plan"]
+        self.state[sid] = {
+            "key": plan["key"],
+            "command": plan["command"],
+            "run_command": task["command"],
+            "source_script": step.get("script", ""),
+            "input_md5": plan["input_md5"],
+            "params": plan["params"],
+            "output_md5": {out: self.hasher.md5(out) for out in step["outputs"]},
+            "git_commit": self.commit,
+            "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "cpus": task["cpus"],
+            "elapsed_sec": round(elapsed, 1),
+            "peak_rss_mb": round(peak_mb, 1),
+        }
+        save_state(Path(self.args.state), self.state)
+        self.hasher.save()
+        self.done[sid] = "ran"
+        print(f"[run_pipeline] {sid}: done in {format_duration(elapsed)}, "
+              f"peak RSS {peak_mb:.0f} MB [{len(self.done)}/{self.total}]")
+
+    def progress(self) -> None:
+        now = time.time()
+        if now - self.last_progress < self.args.progress_interval:
+            return
+        self.last_progress = now
+        tasks = ", ".join(
+            f"{t['sid']} ({t['cpus']} cpu, {format_duration(now - t['t0'])})"
+            for t in self.running.values()
+        )
+        print(f"[run_pipeline] [{len(self.done)}/{self.total} done, {len(self.queue)} queued, "
+              f"{self.budget - self.free}/{self.budget} cpus busy] running: {tasks or '-'}")
+
+    def run(self) -> None:
+        t0 = time.time()
+        while True:
+            self.promote()
+            self.launch()
+            if not self.running:
+                break
+            time.sleep(POLL_SECONDS)
+            self.reap()
+            self.progress()
+
+        if self.report:
+            print("[run_pipeline] step\tcpus\twall\tpeak_rss_mb\tstatus")
+            for row in self.report:
+                print(f"[run_pipeline] {row['sid']}\t{row['cpus']}\t"
+                      f"{format_duration(row['elapsed'])}\t{row['peak_mb']:.0f}\t{row['status']}")
+        n_cached = sum(1 for status in self.done.values() if status == "cached")
+        n_ran = len(self.done) - n_cached
+        print(f"[run_pipeline] {self.total} steps: {n_cached} cached, {n_ran} ran "
+              f"in {format_duration(time.time() - t0)}")
+        if self.failed:
+            not_run = len(self.waiting) + len(self.queue)
+            fail(f"failed: {', '.join(self.failed)} ({not_run} downstream/queued steps not run)")
+
+
+def main() -> None:
+    args = parse_args()
+    spec_path = Path(args.spec)
+    params_path = Path(args.params)
+    state_path = Path(args.state)
+    for path in (spec_path, params_path):
+        if not path.is_file():
+            fail(f"not found: {path}")
+
+    with params_path.open() as handle:
+        params = json.load(handle)
+    steps = load_steps(spec_path, params)
+    by_id = {step["id"]: step for step in steps}
+    order, deps = dependency_order(steps)
+
+    if args.list:
+        for sid in order:
+            upstream = ", ".join(deps[sid]) or "-"
+            print(f"{sid}\tphase {by_id[sid].get('phase', '?')}\t"
+                  f"cpus {by_id[sid]['cpus']}\tafter: {upstream}")
+        return
+
+    unknown = [sid for sid in args.targets + args.force if sid not in by_id]
+    if unknown:
+        fail(f"unknown step(s): {', '.join(unknown)}")
+    selected = with_upstream(args.targets, deps) if args.targets else set(order)
+    forced = set(selected) if args.force_all else set(args.force)
+
+    state = load_state(state_path)
+    hasher = Md5Cache(state_path.with_name(state_path.name + MD5_CACHE_SUFFIX))
+
+    try:
+        if args.dry_run:
+            dry_run(order, by_id, deps, selected, params, state, forced, hasher)
+        else:
+            Scheduler(order, by_id, deps, selected, params, state, forced, hasher, args).run()
+    finally:
+        hasher.save()
+
+    if args.manifest:
+        write_manifest(Path(args.manifest), [by_id[sid] for sid in order], state)
+
+
+if __name__ == "__main__":
+    main()
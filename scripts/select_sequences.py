@@ -28,6 +28,10 @@ import argparse
 import os
 import sys
 
+# Add scripts directory to path for fasta_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fasta_utils import fasta_ids
+
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -57,12 +61,7 @@ def parse_args():
 
 
 def read_ids_from_fasta(path):
-    ids = set()
-    with open(path) as f:
-        for line in f:
-            if line.startswith(">"):
-                ids.add(line[1:].split()[0].strip())
-    return ids
+    return set(fasta_ids(path))
 
 
 def read_ids_from_file(path):
@@ -2,24 +2,31 @@
 """
 Stitch core + module + linker alignments into a full-length MSA.
 
-Column order in output:
+Column order in output follows the ordered segment list, e.g.
     [core columns (fixed, from core_asr.afa)]
-    [module columns (fixed, from module_msa.afa)]
+    [N_ext / α2β3 insert / ACT / CM module columns (fixed, from module MSAs)]
     [linker/C-flank columns (free, from linker_einsi.afa)]
 
+Segments are given as repeated --segment LABEL=PATH (in output order); the
+single-module form (--core_msa/--module_msa/--module_name/--linker_msa) is
+still accepted and expands to core | module:<name> | linker:C-flank.
+Rows are concatenated and written one block of IDs at a time, so the
+stitched matrix is never held in memory.
+
 Hard assertion:
     The core segment of the output exactly matches the corresponding rows in
-    core_msa (i.e. core columns are never re-aligned).
+    core_msa (i.e. core columns are never re-aligned). The written file is
+    re-read and each record is checked against the core row found through a
+    direct ID index.
 
 Phase 3.9 of the DAH7PS V5.0 SOP.
 
 Usage:
     python scripts/stitch_full_length_msa.py \
         --seq_ids        results/03_msa_full/Ib_ACT.ids \
-        --core_msa       results/03_msa_core/core_asr.afa \
-        --module_msa     results/03_msa_modules/ACT_domain_msa.afa \
-        --module_name    ACT \
-        --linker_msa     results/03_msa_full/Ib_ACT_linkers_einsi.afa \
+        --segment        core=results/03_msa_core/core_asr.afa \
+        --segment        module:ACT=results/03_msa_modules/ACT_domain_msa.afa \
+        --segment        linker:C-flank=results/03_msa_full/Ib_ACT_linkers_einsi.afa \
         --output         results/03_msa_full/msa_full_Ib_v4.afa \
         --emit_column_map results/03_msa_full/msa_full_Ib_column_map.tsv \
         --assert_core_columns_unchanged
@@ -29,6 +36,12 @@ import argparse
 import os
 import sys
 
+import numpy as np
+
+# Add scripts directory to path for msa_utils
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from msa_utils import ROW_BLOCK, iter_fasta_records, read_alignment, write_alignment_rows
+
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -36,23 +49,65 @@ def parse_args():
     )
     p.add_argument("--seq_ids", required=True,
                    help="Text file: one seq_id per line (defines the subset and order)")
-    p.add_argument("--core_msa", required=True,
-                   help="Core MSA (e.g. core_asr.afa). Rows for seq_ids are extracted.")
-    p.add_argument("--module_msa", required=True,
-                   help="Module MSA (e.g. ACT_domain_msa.afa). Must contain all seq_ids.")
-    p.add_argument("--module_name", required=True,
-                   help="Module label used in column map (e.g. ACT)")
-    p.add_argument("--linker_msa", required=True,
-                   help="Aligned linker/C-flank MSA (from E-INS-i). Must contain all seq_ids.")
+    p.add_argument("--segment", action="append", default=[],
+                   help="Ordered segment LABEL=PATH (repeatable), e.g. core=core_asr.afa, "
+                        "module:ACT=ACT_domain_msa.afa, linker:C-flank=linkers_einsi.afa. "
+                        "Every MSA must contain all seq_ids.")
+    p.add_argument("--core_label", default="core",
+                   help="Label of the segment checked by --assert_core_columns_unchanged "
+                        "(default: core)")
+    p.add_argument("--core_msa",
+                   help="Single-module form: core MSA (e.g. core_asr.afa)")
+    p.add_argument("--module_msa",
+                   help="Single-module form: module MSA (e.g. ACT_domain_msa.afa)")
+    p.add_argument("--module_name",
+                   help="Single-module form: module label used in column map (e.g. ACT)")
+    p.add_argument("--linker_msa",
+                   help="Single-module form: aligned linker/C-flank MSA (from E-INS-i)")
     p.add_argument("--output", required=True,
                    help="Output full-length MSA (AFA format)")
     p.add_argument("--emit_column_map", required=True,
-                   help="Output TSV: col_start, col_end, segment_type, source_file")
+                   help="Output TSV: segment, source, col_start, col_end, n_cols")
     p.add_argument("--assert_core_columns_unchanged", action="store_true",
                    help="Verify that core columns in output exactly match core_msa (hard assertion).")
     return p.parse_args()
 
 
+def resolve_segments(args):
+    """Ordered list of (label, path) from --segment or the single-module options."""
+    legacy = [args.core_msa, args.module_msa, args.module_name, args.linker_msa]
+    if args.segment and any(legacy):
+        print("[ERROR] Use either --segment or --core_msa/--module_msa/--module_name/"
+              "--linker_msa, not both.", file=sys.stderr)
+        sys.exit(1)
+    if not args.segment:
+        if not all(legacy):
+            print("[ERROR] Provide --segment LABEL=PATH (repeatable) or all of "
+                  "--core_msa, --module_msa, --module_name, --linker_msa.", file=sys.stderr)
+            sys.exit(1)
+        return [
+            ("core", args.core_msa),
+            (f"module:{args.module_name}", args.module_msa),
+            ("linker:C-flank", args.linker_msa),
+        ]
+
+    segments = []
+    for item in args.segment:
+        if "=" not in item:
+            print(f"[ERROR] --segment must be LABEL=PATH, got: {item}", file=sys.stderr)
+            sys.exit(1)
+        label, path = (part.strip() for part in item.split("=", 1))
+        if not label or not path:
+            print(f"[ERROR] Invalid --segment: {item}", file=sys.stderr)
+            sys.exit(1)
+        segments.append((label, path))
+    labels = [label for label, _ in segments]
+    if len(set(labels)) != len(labels):
+        print(f"[ERROR] Duplicate segment labels: {labels}", file=sys.stderr)
+        sys.exit(1)
+    return segments
+
+
 def read_ids(path):
     ids = []
     with open(path) as f:
@@ -64,49 +119,50 @@ def read_ids(path):
 
 
 def parse_msa(path, keep_ids=None):
-    """Parse aligned FASTA → dict id -> aligned_sequence (gaps preserved).
+    """Parse aligned FASTA (upper-cased, gaps preserved) into an Alignment.
 
     keep_ids: if provided, only load those IDs (set).
-    All sequences must have the same length; validated after loading.
+    All sequences must have the same length; validated while loading.
     """
-    seqs = {}
-    order = []
-    current_id = None
-    current_seq = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                if current_id is not None:
-                    if keep_ids is None or current_id in keep_ids:
-                        seqs[current_id] = "".join(current_seq).upper()
-                        order.append(current_id)
-                current_id = line[1:].split()[0]
-                current_seq = []
-            else:
-                current_seq.append(line)
-    if current_id is not None:
-        if keep_ids is None or current_id in keep_ids:
-            seqs[current_id] = "".join(current_seq).upper()
-            order.append(current_id)
-
-    # Validate alignment width
-    lengths = set(len(s) for s in seqs.values())
-    if len(lengths) > 1:
-        print(f"[ERROR] {path}: sequences have unequal lengths: {lengths}", file=sys.stderr)
+    try:
+        return read_alignment(path, keep_ids=keep_ids, upper=True)
+    except ValueError as exc:
+        print(f"[ERROR] {path}: {exc}", file=sys.stderr)
         sys.exit(1)
 
-    width = lengths.pop() if lengths else 0
-    return seqs, order, width
-
 
-def write_fasta(records, path):
+def write_stitched(path, seq_ids, alignments):
+    """Stream per-ID concatenation of all segment rows to `path` (60-col FASTA)."""
     os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
-    with open(path, "w") as f:
-        for sid, seq in records:
-            f.write(f">{sid}\n")
-            for i in range(0, len(seq), 60):
-                f.write(seq[i:i+60] + "\n")
+    rows = [np.array([aln.index[sid] for sid in seq_ids], dtype=np.intp) for aln in alignments]
+    with open(path, "wb") as handle:
+        for start in range(0, len(seq_ids), ROW_BLOCK):
+            stop = min(start + ROW_BLOCK, len(seq_ids))
+            block = np.hstack([aln.matrix[r[start:stop]] for aln, r in zip(alignments, rows)])
+            write_alignment_rows(handle, seq_ids[start:stop], block, line_width=60)
+
+
+def check_core_columns(path, seq_ids, core, core_start):
+    """Re-read the stitched output; return IDs whose core columns differ from core MSA.
+
+    O(n): each output record is matched to its core row through core.index.
+    """
+    core_end = core_start + core.n_cols
+    failed = []
+    n_records = 0
+    for sid, seq in iter_fasta_records(path):
+        if n_records >= len(seq_ids) or sid != seq_ids[n_records]:
+            failed.append(sid)
+        else:
+            stitched_core = seq[core_start:core_end].upper()
+            if stitched_core != core.row_string(core.index[sid]):
+                failed.append(sid)
+        n_records += 1
+    if n_records != len(seq_ids):
+        print(f"[ASSERT FAIL] output has {n_records} records, expected {len(seq_ids)}",
+              file=sys.stderr)
+        failed.extend(seq_ids[n_records:])
+    return failed
 
 
 def write_column_map(segments, path):
@@ -121,70 +177,68 @@ def write_column_map(segments, path):
 
 def main():
     args = parse_args()
+    segments = resolve_segments(args)
 
-    for path in [args.seq_ids, args.core_msa, args.module_msa, args.linker_msa]:
+    for path in [args.seq_ids] + [path for _, path in segments]:
         if not os.path.isfile(path):
             print(f"[ERROR] Input not found: {path}", file=sys.stderr)
             sys.exit(1)
 
     seq_ids = read_ids(args.seq_ids)
     keep_set = set(seq_ids)
-    print(f"[stitch_full_length_msa] Stitching {len(seq_ids)} sequences", file=sys.stderr)
-
-    # Load MSAs
-    core_seqs, _, core_width = parse_msa(args.core_msa, keep_ids=keep_set)
-    mod_seqs, _, mod_width   = parse_msa(args.module_msa, keep_ids=keep_set)
-    lnk_seqs, _, lnk_width   = parse_msa(args.linker_msa, keep_ids=keep_set)
-
-    print(f"[stitch_full_length_msa] core={core_width} cols, "
-          f"module({args.module_name})={mod_width} cols, "
-          f"linker={lnk_width} cols", file=sys.stderr)
-
-    # Check all seq_ids are present in every MSA
-    for label, msa_dict in [("core", core_seqs), ("module", mod_seqs), ("linker", lnk_seqs)]:
-        missing = keep_set - set(msa_dict)
+    print(f"[stitch_full_length_msa] Stitching {len(seq_ids)} sequences from "
+          f"{len(segments)} segments", file=sys.stderr)
+
+    # Load segment MSAs (subset rows only)
+    alignments = []
+    for label, path in segments:
+        aln = parse_msa(path, keep_ids=keep_set)
+        missing = keep_set - set(aln.ids)
         if missing:
             print(f"[ERROR] {len(missing)} seq IDs missing from {label} MSA: "
                   f"{sorted(missing)[:5]}...", file=sys.stderr)
             sys.exit(1)
-
-    # Stitch: core | module | linker
-    stitched = []
-    for sid in seq_ids:
-        stitched.append((sid, core_seqs[sid] + mod_seqs[sid] + lnk_seqs[sid]))
-
-    total_cols = core_width + mod_width + lnk_width
-    print(f"[stitch_full_length_msa] Output: {len(stitched)} seqs × {total_cols} cols",
+        alignments.append(aln)
+
+    print("[stitch_full_length_msa] " + ", ".join(
+        f"{label}={aln.n_cols} cols" for (label, _), aln in zip(segments, alignments)
+    ), file=sys.stderr)
+
+    # Column map (1-based, inclusive)
+    column_map = []
+    col = 1
+    for (label, path), aln in zip(segments, alignments):
+        column_map.append((label, os.path.basename(path), col, col + aln.n_cols - 1))
+        col += aln.n_cols
+    total_cols = col - 1
+    print(f"[stitch_full_length_msa] Output: {len(seq_ids)} seqs × {total_cols} cols",
           file=sys.stderr)
 
+    # Stitch: segments in order, streamed to disk
+    write_stitched(args.output, seq_ids, alignments)
+    print(f"[stitch_full_length_msa] Wrote stitched MSA → {args.output}", file=sys.stderr)
+
     # Hard assertion: core columns unchanged
     if args.assert_core_columns_unchanged:
-        n_fail = 0
-        for sid in seq_ids:
-            stitched_core = stitched[seq_ids.index(sid)][1][:core_width]
-            if stitched_core != core_seqs[sid]:
-                print(f"[ASSERT FAIL] {sid}: core columns differ from core_msa", file=sys.stderr)
-                n_fail += 1
-        if n_fail > 0:
-            print(f"[ERROR] Core column assertion failed for {n_fail} sequences. "
+        labels = [label for label, _ in segments]
+        if args.core_label not in labels:
+            print(f"[ERROR] No segment labelled '{args.core_label}' to assert.",
+                  file=sys.stderr)
+            sys.exit(1)
+        k = labels.index(args.core_label)
+        core = alignments[k]
+        failed = check_core_columns(args.output, seq_ids, core, column_map[k][2] - 1)
+        for sid in failed:
+            print(f"[ASSERT FAIL] {sid}: core columns differ from core_msa", file=sys.stderr)
+        if failed:
+            print(f"[ERROR] Core column assertion failed for {len(failed)} sequences. "
                   f"Aborting.", file=sys.stderr)
+            os.remove(args.output)
             sys.exit(1)
         print(f"[stitch_full_length_msa] ✅ ASSERT PASS: core columns unchanged "
-              f"for all {len(seq_ids)} sequences ({core_width} cols)", file=sys.stderr)
-
-    # Write output MSA
-    write_fasta(stitched, args.output)
-    print(f"[stitch_full_length_msa] Wrote stitched MSA → {args.output}", file=sys.stderr)
+              f"for all {len(seq_ids)} sequences ({core.n_cols} cols)", file=sys.stderr)
 
-    # Write column map (1-based, inclusive)
-    segments = [
-        ("core",            os.path.basename(args.core_msa),   1,             core_width),
-        (f"module:{args.module_name}", os.path.basename(args.module_msa),
-         core_width + 1,   core_width + mod_width),
-        ("linker:C-flank",  os.path.basename(args.linker_msa),
-         core_width + mod_width + 1, total_cols),
-    ]
-    write_column_map(segments, args.emit_column_map)
+    write_column_map(column_map, args.emit_column_map)
 
 
 if __name__ == "__main__":
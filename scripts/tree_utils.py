@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Tree Utilities — Array-backed Newick trees shared by the tree-handling scripts.
+
+Used by:
+  - Phase 4.2: compare_trees.py (AA vs 3Di skeleton comparison)
+  - Phase 4.3: prune_tree.py (KDOPS outgroup removal, replaces ete3)
+  - Phase 4.4: mad_root_fast.py (linear-time root search)
+  - QC3:       qc_root_stability.py (root identity, all-pairs scenario nRF)
+
+Key concepts:
+  - A tree is parsed once into flat NumPy arrays instead of one Python
+    object per node. Nodes are numbered in preorder, so node 0 is the root,
+    parent[v] < v, and the subtree of v is the contiguous index range
+    [v, subtree_end[v]).
+  - Tip names are interned once: tip_names[k] is the name of tip k (tips
+    numbered in preorder), tip_index maps name -> k, and node_tip/tip_node
+    map between node and tip numbering.
+  - Per-node quantities (subtree sizes, depths, root-to-tip distances) are
+    computed with vectorized level sweeps or pointer jumping, not recursion,
+    so deep caterpillar-like trees never hit Python's recursion limit.
+  - Bipartitions are fixed-width uint64 bitsets over a canonical tip order,
+    hashed as bytes, so RF between 9k-tip trees is a set difference of
+    ~9k keys rather than of nested frozensets of names.
+"""
+
+from __future__ import annotations
+
+import re
+
+import numpy as np
+
+_NEWICK_TOKEN = re.compile(r"\[[^\]]*\]|[(),;]|:[^(),;\[]*|'[^']*'|[^(),;:\[]+")
+
+
+class CompactTree:
+    """Rooted tree stored as preorder-numbered NumPy arrays.
+
+    Attributes:
+        parent: int32 parent index per node (-1 for the root).
+        first_child, next_sibling: int32 child links (-1 where absent).
+        blen: float64 branch length to the parent (NaN where absent).
+        labels: per-node label (tip names, internal support/node names).
+        depth: int32 number of edges from the root.
+        subtree_end: int32 one past the last preorder index in subtree(v).
+        preorder, postorder: int32 node permutations.
+        tip_names, tip_index, node_tip, tip_node: interned tip-name table.
+    """
+
+    def __init__(self, labels: list[str], parent: np.ndarray, blen: np.ndarray) -> None:
+        self.labels = labels
+        self.parent = np.asarray(parent, dtype=np.int32)
+        self.blen = np.asarray(blen, dtype=np.float64)
+        n = len(self.parent)
+        idx = np.arange(n, dtype=np.int32)
+        if n and (self.parent[0] != -1 or np.any(self.parent[1:] >= idx[1:])):
+            raise ValueError("CompactTree arrays must be numbered in preorder")
+
+        # Child links: children of p appear in increasing index order
+        self.first_child = np.full(n, -1, dtype=np.int32)
+        self.next_sibling = np.full(n, -1, dtype=np.int32)
+        nonroot = idx[1:]
+        order = nonroot[np.argsort(self.parent[1:], kind="stable")]
+        par = self.parent[order]
+        same = par[1:] == par[:-1]
+        self.next_sibling[order[:-1][same]] = order[1:][same]
+        head = np.ones(len(order), dtype=bool)
+        head[1:] = ~same
+        self.first_child[par[head]] = order[head]
+
+        self.is_tip = self.first_child < 0
+        self.depth = self._pointer_jump(np.where(self.parent >= 0, 1, 0)).astype(np.int32)
+        self.preorder = idx
+        self._levels = None
+
+        # Subtree extent: a subtree ends at its last descendant (max index)
+        last = idx.copy()
+        for level in reversed(self.levels[1:]):
+            np.maximum.at(last, self.parent[level], last[level])
+        self.subtree_end = (last + 1).astype(np.int32)
+        self.postorder = np.lexsort((-self.depth, self.subtree_end)).astype(np.int32)
+
+        self.tip_node = idx[self.is_tip]
+        self.node_tip = np.full(n, -1, dtype=np.int32)
+        self.node_tip[self.tip_node] = np.arange(len(self.tip_node), dtype=np.int32)
+        self.tip_names = [labels[v] for v in self.tip_node]
+        self.tip_index = {name: k for k, name in enumerate(self.tip_names)}
+        self._tip_csum = np.concatenate([[0], np.cumsum(self.is_tip, dtype=np.int64)])
+
+    # ── Basic properties ────────────────────────────────────────────────────
+    @property
+    def n_nodes(self) -> int:
+        return len(self.parent)
+
+    @property
+    def n_tips(self) -> int:
+        return len(self.tip_node)
+
+    @property
+    def levels(self) -> list[np.ndarray]:
+        """Node indices grouped by depth (levels[0] is the root)."""
+        if self._levels is None:
+            order = np.argsort(self.depth, kind="stable")
+            counts = np.bincount(self.depth)
+            self._levels = np.split(order, np.cumsum(counts)[:-1])
+        return self._levels
+
+    def children(self, v: int) -> list[int]:
+        out = []
+        c = int(self.first_child[v])
+        while c >= 0:
+            out.append(c)
+            c = int(self.next_sibling[c])
+        return out
+
+    def lengths(self) -> np.ndarray:
+        """Branch lengths with missing values (and the root) as 0.0."""
+        out = np.nan_to_num(self.blen, nan=0.0)
+        out[0] = 0.0
+        return out
+
+    # ── Vectorized per-node quantities ──────────────────────────────────────
+    def _pointer_jump(self, values: np.ndarray) -> np.ndarray:
+        """Sum `values` along each node's path to the root (inclusive of v)."""
+        acc = np.array(values, dtype=np.float64)
+        anc = self.parent.copy()
+        while True:
+            live = anc >= 0
+            if not live.any():
+                return acc
+            src = anc[live]
+            acc_new = acc.copy()
+            acc_new[live] += acc[src]
+            anc_new = anc.copy()
+            anc_new[live] = anc[src]
+            acc, anc = acc_new, anc_new
+
+    def subtree_sizes(self) -> np.ndarray:
+        """Number of tips in each subtree."""
+        return (self._tip_csum[self.subtree_end] - self._tip_csum[self.preorder]).astype(np.int64)
+
+    def node_depths(self) -> np.ndarray:
+        """Number of edges from the root to each node."""
+        return self.depth.copy()
+
+    def root_to_tip(self) -> np.ndarray:
+        """Path length from the root to every node (missing lengths as 0)."""
+        return self._pointer_jump(self.lengths())
+
+    def subtree_sum(self, values: np.ndarray) -> np.ndarray:
+        """Sum a per-node array over each subtree (level-by-level)."""
+        acc = np.array(values, dtype=np.float64)
+        for level in reversed(self.levels[1:]):
+            np.add.at(acc, self.parent[level], acc[level])
+        return acc
+
+    # ── Tip sets ────────────────────────────────────────────────────────────
+    def tips_under(self, v: int) -> np.ndarray:
+        """Tip indices (interned numbering) of the subtree rooted at v."""
+        return np.arange(self._tip_csum[v], self._tip_csum[self.subtree_end[v]])
+
+    def leaf_names(self, v: int = 0) -> list[str]:
+        return self.tip_names[self._tip_csum[v]:self._tip_csum[self.subtree_end[v]]]
+
+    def mrca(self, names) -> int:
+        """Deepest node whose subtree contains every named tip (-1 if none given)."""
+        hits = np.zeros(self.n_nodes, dtype=np.float64)
+        wanted = [self.tip_index[name] for name in names if name in self.tip_index]
+        if not wanted:
+            return -1
+        hits[self.tip_node[wanted]] = 1.0
+        counts = self.subtree_sum(hits)
+        full = np.flatnonzero(counts == len(wanted))
+        return int(full[np.argmax(self.depth[full])])
+
+    # ── Derived trees ───────────────────────────────────────────────────────
+    def prune(self, keep_names) -> "CompactTree":
+        """Keep only the named tips, splicing out unary nodes.
+
+        Branch lengths of spliced nodes are added to their surviving child
+        (like ete3 prune(preserve_branch_length=True)).
+        """
+        keep_tip = np.zeros(self.n_nodes, dtype=np.float64)
+        wanted = [self.tip_index[name] for name in keep_names if name in self.tip_index]
+        keep_tip[self.tip_node[wanted]] = 1.0
+        kept = self.subtree_sum(keep_tip) > 0
+        n_kept_children = np.bincount(self.parent[1:][kept[1:]], minlength=self.n_nodes)
+        spliced = kept & ~self.is_tip & (n_kept_children == 1)
+
+        blen = self.lengths()
+        new_parent = np.full(self.n_nodes, -1, dtype=np.int64)
+        new_blen = np.zeros(self.n_nodes, dtype=np.float64)
+        parent = self.parent.tolist()
+        for v in np.flatnonzero(kept[1:]) + 1:
+            p = parent[v]
+            if spliced[p]:
+                new_parent[v] = new_parent[p]
+                new_blen[v] = blen[v] + new_blen[p]
+            else:
+                new_parent[v] = p
+                new_blen[v] = blen[v]
+        survivors = np.flatnonzero(kept & ~spliced)
+        top = survivors[0]
+        new_parent[top] = -1
+        new_blen[top] = np.nan
+        missing = np.isnan(self.blen) & (new_blen == 0)
+        new_blen[missing] = np.nan
+        return _renumber(self.labels, new_parent, new_blen, survivors)
+
+    def unrooted(self) -> "CompactTree":
+        """Suppress a bifurcating root so that every edge is a real edge.
+
+        The two root branches form one edge; the sibling of the first
+        internal root child is re-attached below it with the summed length.
+        """
+        kids = self.children(0)
+        if len(kids) != 2 or all(self.is_tip[kids]):
+            return self
+        new_root, other = (kids[0], kids[1]) if not self.is_tip[kids[0]] else (kids[1], kids[0])
+        parent = self.parent.astype(np.int64)
+        blen = self.lengths()
+        parent[other] = new_root
+        blen[other] += blen[new_root]
+        parent[new_root] = -1
+        survivors = np.arange(1, self.n_nodes)
+        return _rebuild(self.labels, parent, blen, survivors, new_root)
+
+    def rerooted(self, v: int, x: float) -> "CompactTree":
+        """Root on the branch above v, at distance x from v.
+
+        Internal labels are dropped: support values belong to edges whose
+        direction changes on rerooting.
+        """
+        p = int(self.parent[v])
+        if p < 0:
+            raise ValueError("cannot reroot on the root branch")
+        b = float(self.lengths()[v])
+        adj: list[list[tuple[int, float]]] = [[] for _ in range(self.n_nodes)]
+        lengths = self.lengths().tolist()
+        for c, q in enumerate(self.parent.tolist()):
+            if q >= 0:
+                adj[q].append((c, lengths[c]))
+                adj[c].append((q, lengths[c]))
+
+        labels, parent, blen = [""], [-1], [np.nan]
+        stack = [(p, v, 0, b - x), (v, p, 0, x)]
+        while stack:
+            node, came_from, new_par, length = stack.pop()
+            nbrs = [(w, bw) for w, bw in adj[node] if w != came_from]
+            # A former bifurcating root becomes unary after rerooting: splice it
+            if len(nbrs) == 1 and node == 0:
+                w, bw = nbrs[0]
+                stack.append((w, node, new_par, length + bw))
+                continue
+            labels.append(self.labels[node] if not nbrs else "")
+            parent.append(new_par)
+            blen.append(length)
+            me = len(labels) - 1
+            for w, bw in reversed(nbrs):
+                stack.append((w, node, me, bw))
+        return CompactTree(labels, np.array(parent), np.array(blen))
+
+    # ── Output ──────────────────────────────────────────────────────────────
+    def to_newick(self, internal_labels: bool = True, precision: int = 10) -> str:
+        """Serialize to Newick (iterative, so no recursion limit)."""
+        fmt = f".{precision}g"
+        out: list[str] = []
+
+        def suffix(v: int) -> str:
+            label = self.labels[v] if (self.is_tip[v] or internal_labels) else ""
+            if v != 0 and not np.isnan(self.blen[v]):
+                return f"{label}:{format(self.blen[v], fmt)}"
+            return label
+
+        # ("open", v) emits a node, ("close", v) its label, ("sep", -1) a comma
+        stack: list[tuple[str, int]] = [("open", 0)]
+        while stack:
+            kind, v = stack.pop()
+            if kind == "sep":
+                out.append(",")
+            elif kind == "close":
+                out.append(")" + suffix(v))
+            elif self.is_tip[v]:
+                out.append(suffix(v))
+            else:
+                out.append("(")
+                stack.append(("close", v))
+                kids = self.children(v)
+                for i, c in enumerate(reversed(kids)):
+                    if i:
+                        stack.append(("sep", -1))
+                    stack.append(("open", c))
+        return "".join(out) + ";"
+
+
+def _rebuild(labels, parent, blen, survivors, root) -> CompactTree:
+    """Renumber the `survivors` subset (rooted at `root`) into preorder."""
+    children: dict[int, list[int]] = {}
+    for v in survivors:
+        p = int(parent[v])
+        if p >= 0:
+            children.setdefault(p, []).append(int(v))
+    new_labels, new_parent, new_blen = [], [], []
+    stack = [(int(root), -1)]
+    while stack:
+        v, new_par = stack.pop()
+        new_labels.append(labels[v])
+        new_parent.append(new_par)
+        new_blen.append(np.nan if new_par < 0 else blen[v])
+        me = len(new_labels) - 1
+        for c in reversed(children.get(v, [])):
+            stack.append((c, me))
+    return CompactTree(new_labels, np.array(new_parent), np.array(new_blen))
+
+
+def _renumber(labels, parent, blen, survivors) -> CompactTree:
+    root = int(survivors[np.flatnonzero(parent[survivors] < 0)[0]])
+    return _rebuild(labels, parent, blen, survivors, root)
+
+
+def parse_newick(text: str) -> CompactTree:
+    """Parse a Newick string into a CompactTree (iterative, preorder numbering).
+
+    Labels after ')' become internal labels (support values or IQ-TREE
+    NodeN names); [...] comments are ignored.
+    """
+    labels, parent, blen = [""], [-1], [np.nan]
+    stack: list[int] = []
+    current = 0
+    for tok in _NEWICK_TOKEN.findall(text.strip()):
+        if tok == "(":
+            stack.append(current)
+            labels.append(""); parent.append(current); blen.append(np.nan)
+            current = len(labels) - 1
+        elif tok == ",":
+            labels.append(""); parent.append(stack[-1]); blen.append(np.nan)
+            current = len(labels) - 1
+        elif tok == ")":
+            current = stack.pop()
+        elif tok == ";":
+            break
+        elif tok.startswith("["):
+            continue
+        elif tok.startswith(":"):
+            try:
+                blen[current] = float(tok[1:])
+            except ValueError:
+                pass
+        else:
+            labels[current] = tok.strip().strip("'")
+    return CompactTree(labels, np.array(parent), np.array(blen))
+
+
+def load_tree(path: str) -> CompactTree:
+    """Read and parse a Newick file."""
+    with open(path) as handle:
+        return parse_newick(handle.read())
+
+
+# ── Bipartitions as bitsets ─────────────────────────────────────────────────
+def split_bitsets(tree: CompactTree, tip_order: list[str]) -> np.ndarray:
+    """Non-trivial splits of `tree` as canonical uint64 bitsets.
+
+    Args:
+        tree: any CompactTree (rooting is ignored).
+        tip_order: canonical tip numbering shared by every tree being
+            compared; must contain all tips of `tree`.
+
+    Returns:
+        uint64 array (n_splits, n_words). Each split is stored as the side
+        that does not contain the tree's lowest-numbered tip, so identical
+        splits have identical rows regardless of rooting.
+    """
+    position = {name: k for k, name in enumerate(tip_order)}
+    try:
+        canon = np.array([position[name] for name in tree.tip_names], dtype=np.int64)
+    except KeyError as exc:
+        raise ValueError(f"tip {exc.args[0]!r} missing from tip_order") from None
+    n_words = max(1, (len(tip_order) + 63) // 64)
+    bits = np.zeros((tree.n_nodes, n_words), dtype=np.uint64)
+    one = np.uint64(1)
+    np.bitwise_or.at(
+        bits,
+        (tree.tip_node, canon >> 6),
+        np.left_shift(one, (canon & 63).astype(np.uint64)),
+    )
+    for level in reversed(tree.levels[1:]):
+        np.bitwise_or.at(bits, tree.parent[level], bits[level])
+
+    full = bits[0].copy()
+    sizes = tree.subtree_sizes()
+    nontrivial = (sizes > 1) & (tree.n_tips - sizes > 1)
+    nontrivial[0] = False
+    splits = bits[nontrivial]
+    anchor = int(canon.min()) if len(canon) else 0
+    flip = (splits[:, anchor >> 6] >> np.uint64(anchor & 63)) & one
+    flip = flip.astype(bool)
+    splits[flip] = splits[flip] ^ full
+    return splits
+
+
+def split_keys(splits: np.ndarray) -> set[bytes]:
+    """Hashable keys (one bytes object per split row) for set operations."""
+    rows = np.ascontiguousarray(splits)
+    return set(rows.view(np.dtype((np.void, rows.shape[1] * 8))).ravel().tolist())
+
+
+def rf_counts(left: set[bytes], right: set[bytes]) -> tuple[int, int, int]:
+    """(shared, left_only, right_only) split counts."""
+    shared = len(left & right)
+    return shared, len(left) - shared, len(right) - shared
+
+
+def normalized_rf(left: CompactTree, right: CompactTree) -> float | None:
+    """Normalized RF distance, or None if the trees have different tips."""
+    if set(left.tip_names) != set(right.tip_names):
+        return None
+    tip_order = sorted(left.tip_names)
+    left_keys = split_keys(split_bitsets(left, tip_order))
+    right_keys = split_keys(split_bitsets(right, tip_order))
+    _, only_left, only_right = rf_counts(left_keys, right_keys)
+    denom = len(left_keys) + len(right_keys)
+    return (only_left + only_right) / denom if denom else 0.0
+
+
+def nrf_matrix(trees: list[CompactTree], common_tips: bool = True) -> tuple[np.ndarray, int]:
+    """All-pairs normalized RF across several trees in one call.
+
+    Splits are computed once per tree. With common_tips=True every tree is
+    first pruned to the tips shared by all trees (e.g. KDOPS-rooted S1/S2
+    against ingroup-only S3/S4); otherwise all trees must share one tip set.
+
+    Returns:
+        (matrix, n_tips): symmetric float matrix of nRF values and the
+        number of tips the comparison was made on.
+    """
+    shared = set(trees[0].tip_names)
+    for tree in trees[1:]:
+        shared &= set(tree.tip_names)
+    if common_tips:
+        trees = [t if t.n_tips == len(shared) else t.prune(shared) for t in trees]
+    elif any(set(t.tip_names) != shared for t in trees):
+        raise ValueError("trees have different tip sets; use common_tips=True")
+    tip_order = sorted(shared)
+    keys = [split_keys(split_bitsets(tree, tip_order)) for tree in trees]
+    matrix = np.zeros((len(trees), len(trees)))
+    for i in range(len(trees)):
+        for j in range(i + 1, len(trees)):
+            _, only_i, only_j = rf_counts(keys[i], keys[j])
+            denom = len(keys[i]) + len(keys[j])
+            matrix[i, j] = matrix[j, i] = (only_i + only_j) / denom if denom else 0.0
+    return matrix, len(shared)